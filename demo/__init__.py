@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 
 import uptane
 import os
+import shutil # for publish_metadata
 import tuf.formats
 import tuf.repository_tool as rt
 import random, string # To generate random strings for Secondary directory names
@@ -99,3 +100,77 @@ def get_random_string(length):
       random.choice(string.ascii_uppercase + string.ascii_lowercase +
       string.digits) for i in range(length))
 
+
+
+def publish_metadata(repo_dir, generations_to_keep=2):
+  """
+  Publishes the metadata last written to the repository in repo_dir (in
+  <repo_dir>/metadata.staged) as its live metadata, <repo_dir>/metadata, which
+  the demo hosts serve.
+
+  Each publication is a new generation directory,
+  <repo_dir>/metadata.generations/<n>, whose files are hard links to those in
+  metadata.staged (TUF replaces, rather than rewrites, the files it writes, so
+  later writes do not change published files). <repo_dir>/metadata is a
+  symlink to the current generation, and is switched to the new generation
+  atomically, so it never appears empty, missing or partially written. The
+  generations_to_keep most recent generations (at least the new one) are
+  kept, so that clients part-way through reading the previous generation can
+  finish; older ones are removed.
+
+  Returns the directory of the new generation.
+  """
+  tuf.formats.PATH_SCHEMA.check_match(repo_dir)
+  tuf.formats.LENGTH_SCHEMA.check_match(generations_to_keep)
+
+  staged_dir = os.path.join(repo_dir, 'metadata.staged')
+  live_link = os.path.join(repo_dir, 'metadata')
+  generations_dir = os.path.join(repo_dir, 'metadata.generations')
+
+  if not os.path.isdir(staged_dir):
+    raise uptane.Error('There is no staged metadata to publish in ' +
+        repr(staged_dir) + '.')
+
+  if not os.path.exists(generations_dir):
+    os.makedirs(generations_dir)
+
+  generations = sorted(
+      int(name) for name in os.listdir(generations_dir) if name.isdigit())
+
+  new_generation = str(generations[-1] + 1 if generations else 1)
+  new_generation_dir = os.path.join(generations_dir, new_generation)
+
+  # Populate the new generation with links to the staged files, falling back
+  # to copies where links are not possible (e.g. across filesystems).
+  for dirpath, dirnames, filenames in os.walk(staged_dir):
+    target_dir = os.path.normpath(os.path.join(
+        new_generation_dir, os.path.relpath(dirpath, staged_dir)))
+    os.makedirs(target_dir)
+    for filename in filenames:
+      try:
+        os.link(
+            os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+      except OSError:
+        shutil.copy2(
+            os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+
+  # A live metadata directory from before generations were used is replaced
+  # (non-atomically) once.
+  if os.path.isdir(live_link) and not os.path.islink(live_link):
+    shutil.rmtree(live_link)
+
+  # Point a new symlink at the new generation and move it over the old one:
+  # renames are atomic.
+  temp_link = live_link + '.newlink'
+  if os.path.lexists(temp_link):
+    os.remove(temp_link)
+  os.symlink(
+      os.path.join('metadata.generations', new_generation), temp_link)
+  os.rename(temp_link, live_link)
+
+  # Garbage-collect old generations.
+  generations.append(int(new_generation))
+  for generation in generations[:-max(generations_to_keep, 1)]:
+    shutil.rmtree(os.path.join(generations_dir, str(generation)))
+
+  return new_generation_dir
@@ -45,6 +45,7 @@ import demo
 import uptane
 import uptane.services.director as director
 import uptane.services.inventorydb as inventory
+import uptane.services.inventorydb_backends as inventorydb_backends
 import tuf.formats
 
 import threading # for the director services interface
@@ -56,22 +57,45 @@ import demo.demo_oem_repo as demo_oem_repo # for the main repo directory /:
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
 from six.moves import xmlrpc_server # for the director services interface
+from six.moves import socketserver
 
 
 KNOWN_VINS = ['111', '112', '113']
 
+# How often, in seconds, the refresh thread started by listen() rewrites and
+# publishes the metadata of vehicles whose metadata is due to expire soon (see
+# uptane.services.director.EXPIRATION_REFRESH_MARGIN).
+REFRESH_INTERVAL = 60 * 60
+
 # Dynamic global objects
 #repo = None
 repo_server_process = None
 director_service_instance = None
 director_service_thread = None
+refresh_thread = None
+manifest_pipeline = None
+
+# Held while writing and publishing metadata, which both the Director service
+# thread and the refresh thread do.
+write_lock = threading.Lock()
 
 
-def clean_slate(use_new_keys=False):
+def clean_slate(use_new_keys=False, inventory_db_fname=None):
+  """
+  Sets up a fresh demo Director. If inventory_db_fname is provided, the
+  Director's inventory (vehicles, ECUs, keys and manifests) is kept in an
+  SQLite database with that filename instead of in memory, and so persists
+  beyond this process.
+  """
 
   global director_service_instance
 
 
+  if inventory_db_fname is not None:
+    inventory.set_backend(
+        inventorydb_backends.SQLiteInventoryBackend(inventory_db_fname))
+
+
   director_dir = os.path.join(uptane.WORKING_DIR, 'director')
 
   # Create a directory for the Director's files.
@@ -126,8 +150,8 @@ def clean_slate(use_new_keys=False):
   # Director starts off with. (Currently 3)
   # This copies the file to each repository's targets directory from the
   # main repository.
-  for vin in inventory.ecus_by_vin:
-    for ecu in inventory.ecus_by_vin[vin]:
+  for vin in KNOWN_VINS:
+    for ecu in inventory.get_ecu_serials_in_vehicle(vin):
       add_target_to_director(
           os.path.join(demo.MAIN_REPO_TARGETS_DIR, 'infotainment_firmware.txt'),
           'infotainment_firmware.txt',
@@ -145,50 +169,58 @@ def clean_slate(use_new_keys=False):
 
 
 def write_to_live(vin_to_update=None):
+  """
+  Writes and publishes the metadata of each vehicle repository that has
+  changed since it was last published, or whose metadata is due to expire soon
+  (or only that of vehicle vin_to_update, if given and if it needs writing).
+  Returns the VINs of the vehicles whose metadata was republished.
+  """
 
   global director_service_instance
 
-  # For each vehicle repository:
-  #   - write metadata.staged
-  #   - copy metadata.staged to the live metadata directory
-  for vin in director_service_instance.vehicle_repositories:
-    if vin_to_update is not None and vin != vin_to_update:
-      continue
-    repo = director_service_instance.vehicle_repositories[vin]
-    repo_dir = repo._repository_directory
-
-    repo.write()
-
-    assert(os.path.exists(os.path.join(repo_dir, 'metadata.staged'))), \
-        'Programming error: a repository write just occurred; why is ' + \
-        'there no metadata.staged directory where it is expected?'
-
-    # This shouldn't exist, but just in case something was interrupted,
-    # warn and remove it.
-    if os.path.exists(os.path.join(repo_dir, 'metadata.livetemp')):
-      print(YELLOW + 'Warning: metadata.livetemp existed already. '
-          'Some previous process was interrupted, or there is a programming '
-          'error.' + ENDCOLORS)
-      shutil.rmtree(os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Copy the staged metadata to a temp directory we'll move into place
-    # atomically in a moment.
-    shutil.copytree(
-        os.path.join(repo_dir, 'metadata.staged'),
-        os.path.join(repo_dir, 'metadata.livetemp'))
-
-    # Empty the existing (old) live metadata directory (relatively fast).
-    if os.path.exists(os.path.join(repo_dir, 'metadata')):
-      shutil.rmtree(os.path.join(repo_dir, 'metadata'))
-
-    # Atomically move the new metadata into place.
-    os.rename(
-        os.path.join(repo_dir, 'metadata.livetemp'),
-        os.path.join(repo_dir, 'metadata'))
+  with write_lock:
+    if vin_to_update is None:
+      vins = director_service_instance.write_dirty_director_repos()
+    else:
+      vins = director_service_instance.write_dirty_director_repos(
+          [vin_to_update])
+
+    # For each vehicle repository just written to metadata.staged, publish
+    # metadata.staged as the live metadata.
+    for vin in vins:
+      repo = director_service_instance.vehicle_repositories[vin]
+      repo_dir = repo._repository_directory
+
+      assert(os.path.exists(os.path.join(repo_dir, 'metadata.staged'))), \
+          'Programming error: a repository write just occurred; why is ' + \
+          'there no metadata.staged directory where it is expected?'
+
+      # Atomically switch the live metadata to a new generation made from the
+      # staged metadata.
+      demo.publish_metadata(repo_dir)
 
   # TODO: <~> Call the encoders here to convert the metadata files into BER
   # versions and also host those!
 
+  return vins
+
+
+
+
+
+def refresh_periodically():
+  """
+  Calls write_to_live every REFRESH_INTERVAL seconds, so that vehicles whose
+  repositories have not changed still receive fresh timestamp and snapshot
+  metadata before theirs expires. Runs until the process exits.
+  """
+  while True:
+    time.sleep(REFRESH_INTERVAL)
+    try:
+      write_to_live()
+    except Exception as e:
+      print(RED + 'Unable to refresh Director metadata: ' + repr(e) + ENDCOLORS)
+
 
 
 
@@ -309,6 +341,13 @@ class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
   rpc_paths = ('/RPC2',)
 
 
+# Handles each request in a thread of its own, so that Vehicle Manifests from
+# many Primaries can be in the manifest ingestion pipeline at once.
+class ThreadingXMLRPCServer(
+    socketserver.ThreadingMixIn, xmlrpc_server.SimpleXMLRPCServer):
+  daemon_threads = True
+
+
 def listen():
   """
   Listens on DIRECTOR_SERVER_PORT for xml-rpc calls to functions:
@@ -317,25 +356,31 @@ def listen():
 
   Note that you must also run host() in order to serve the metadata files via
   http.
+
+  Vehicle Manifests are registered through a
+  uptane.services.director.ManifestIngestionPipeline, which verifies their
+  signatures in a pool of worker processes.
   """
 
   global director_service_thread
+  global manifest_pipeline
 
   if director_service_thread is not None:
     print('Sorry - there is already a Director service thread listening.')
     return
 
   # Create server
-  server = xmlrpc_server.SimpleXMLRPCServer(
+  server = ThreadingXMLRPCServer(
       (demo.DIRECTOR_SERVER_HOST, demo.DIRECTOR_SERVER_PORT),
       requestHandler=RequestHandler, allow_none=True)
   #server.register_introspection_functions()
 
   # Register function that can be called via XML-RPC, allowing a Primary to
   # submit a vehicle version manifest.
+  manifest_pipeline = director.ManifestIngestionPipeline(
+      director_service_instance)
   server.register_function(
-      director_service_instance.register_vehicle_manifest,
-      'submit_vehicle_manifest')
+      manifest_pipeline.register_vehicle_manifest, 'submit_vehicle_manifest')
 
   server.register_function(
       director_service_instance.register_ecu_serial, 'register_ecu_serial')
@@ -368,6 +413,13 @@ def listen():
   director_service_thread.setDaemon(True)
   director_service_thread.start()
 
+  global refresh_thread
+
+  if refresh_thread is None:
+    refresh_thread = threading.Thread(target=refresh_periodically)
+    refresh_thread.setDaemon(True)
+    refresh_thread.start()
+
 
 
 
@@ -136,14 +136,9 @@ def write_to_live():
   # Write the metadata files out to mainrepo's 'metadata.staged'
   repo.write()
 
-  # Move staged metadata (from the write above) to live metadata directory.
-
-  if os.path.exists(os.path.join(demo.MAIN_REPO_DIR, 'metadata')):
-    shutil.rmtree(os.path.join(demo.MAIN_REPO_DIR, 'metadata'))
-
-  shutil.copytree(
-      os.path.join(demo.MAIN_REPO_DIR, 'metadata.staged'),
-      os.path.join(demo.MAIN_REPO_DIR, 'metadata'))
+  # Atomically switch the live metadata directory to a new generation made
+  # from the staged metadata (from the write above).
+  demo.publish_metadata(demo.MAIN_REPO_DIR)
 
 
 
@@ -85,14 +85,22 @@ director_proxy = None
 listener_thread = None
 most_recent_signed_vehicle_manifest = None
 
+# Held while the Primary's state (e.g. nonces, ECU Manifests) is read or
+# changed, so that Secondaries can be served concurrently with the update
+# cycle (see listen). It is not held across network I/O, such as the update
+# cycle's downloads (see uptane.clients.asyncprimary).
+primary_lock = threading.RLock()
+
 
 def clean_slate(
     use_new_keys=False,
     # client_directory_name=None,
     vin=_vin,
     ecu_serial=_ecu_serial,
-    c_interface=False):
+    c_interface=False,
+    use_asyncio=False):
   """
+  If use_asyncio is True, Secondaries are served concurrently (see listen).
   """
 
   global primary_ecu
@@ -153,11 +161,14 @@ def clean_slate(
       ecu_serial=_ecu_serial,
       primary_key=ecu_key,
       time=clock,
-      timeserver_public_key=key_timeserver_pub)
+      timeserver_public_key=key_timeserver_pub,
+      image_deltas=True,
+      per_ecu_metadata_archives=True)
 
 
   if listener_thread is None:
-    listener_thread = threading.Thread(target=listen)
+    listener_thread = threading.Thread(
+        target=listen, kwargs={'use_asyncio': use_asyncio})
     listener_thread.setDaemon(True)
     listener_thread.start()
   print('\n' + GREEN + 'Primary is now listening for messages from ' +
@@ -280,7 +291,8 @@ def update_cycle():
   # First, we'll send the Timeserver a request for a signed time, with the
   # nonces Secondaries have sent us since last time. (This also saves these
   # nonces as "sent" and empties the Primary's list of nonces to send.)
-  nonces_to_send = primary_ecu.get_nonces_to_send_and_rotate()
+  with primary_lock:
+    nonces_to_send = primary_ecu.get_nonces_to_send_and_rotate()
 
   tserver = xmlrpc_client.ServerProxy(
       'http://' + str(demo.TIMESERVER_HOST) + ':' + str(demo.TIMESERVER_PORT))
@@ -294,7 +306,8 @@ def update_cycle():
   # This validates the attestation and also saves the time therein (if the
   # attestation was valid). Secondaries can request this from the Primary at
   # will.
-  primary_ecu.validate_time_attestation(time_attestation)
+  with primary_lock:
+    primary_ecu.validate_time_attestation(time_attestation)
 
   print('Time attestation validated. New time registered.')
 
@@ -330,6 +343,9 @@ def update_cycle():
   # This will update the Primary's metadata and download images from the
   # Director and OEM Repositories, and create a mapping of assignments from
   # each Secondary ECU to its Director-intended target.
+  # This is not done holding primary_lock: the downloads may take a long
+  # time, during which Secondaries must still be served. The Primary puts
+  # the results in place itself once they are complete.
   primary_ecu.primary_update_cycle()
 
   # All targets have now been downloaded.
@@ -351,8 +367,9 @@ def generate_signed_vehicle_manifest():
 
   # Generate and sign a manifest indicating that this ECU has a particular
   # version/hash/size of file2.txt as its firmware.
-  most_recent_signed_vehicle_manifest = \
-      primary_ecu.generate_signed_vehicle_manifest()
+  with primary_lock:
+    most_recent_signed_vehicle_manifest = \
+        primary_ecu.generate_signed_vehicle_manifest()
 
 
 
@@ -591,6 +608,76 @@ def get_image_for_ecu(ecu_serial):
 
 
 
+def get_image_delta_for_ecu(ecu_serial):
+  """
+  For FV Secondaries via XMLRPC, an alternative to get_image_for_ecu that
+  provides only the difference between the image the Secondary last reported
+  as installed and the image it should install.
+
+  Returns:
+   - filename of the image, relative to the targets directory (or None if
+     there is no image for the ECU)
+   - the delta in xmlrpc.Binary format, or None if no delta is available, in
+     which case the Secondary should call get_image_for_ecu instead
+  """
+
+  # Ensure serial is correct format & registered
+  primary_ecu._check_ecu_serial(ecu_serial)
+
+  image_fname = primary_ecu.get_image_fname_for_ecu(ecu_serial)
+
+  if image_fname is None:
+    return None, None
+
+  relative_fname = os.path.relpath(
+      image_fname, os.path.join(primary_ecu.full_client_dir, 'targets'))
+
+  delta_fname = primary_ecu.get_image_delta_fname_for_ecu(ecu_serial)
+
+  if delta_fname is None:
+    return relative_fname, None
+
+  with open(delta_fname, 'rb') as fobj:
+    delta = fobj.read()
+
+  print('Distributing image delta (' + str(len(delta)) + ' bytes, for an '
+      'image of ' + str(os.path.getsize(image_fname)) + ' bytes) to ECU ' +
+      repr(ecu_serial))
+
+  return relative_fname, xmlrpc_client.Binary(delta)
+
+
+
+
+
+def get_image_chunk_manifest_for_ecu(ecu_serial):
+  """
+  For FV Secondaries via XMLRPC, an alternative to get_image_for_ecu for
+  obtaining the image in chunks (with get_image_chunk_for_ecu), so that the
+  whole image is never held in memory, on either side.
+
+  Returns the chunk manifest for the ECU's image (see
+  uptane.clients.primary.Primary.get_image_chunk_manifest), or None if there
+  is no image for the ECU.
+  """
+  return primary_ecu.get_image_chunk_manifest(ecu_serial)
+
+
+
+
+
+def get_image_chunk_for_ecu(ecu_serial, offset, length):
+  """
+  Returns the given part of the ECU's image in xmlrpc.Binary format. See
+  get_image_chunk_manifest_for_ecu.
+  """
+  return xmlrpc_client.Binary(
+      primary_ecu.get_image_chunk(ecu_serial, offset, length))
+
+
+
+
+
 def get_metadata_for_ecu(ecu_serial, force_partial_verification=False):
   """
   Send a zip archive of the most recent consistent set of the Primary's client
@@ -635,22 +722,26 @@ def get_metadata_for_ecu(ecu_serial, force_partial_verification=False):
           'force_partial_verification is True, even though the client is not '
           'on a CAN interface.')
       fname = primary_ecu.get_partial_metadata_fname()
+
+      if not os.path.exists(fname):
+        raise uptane.Error('This Primary does not have a collection of '
+            'metadata to distribute to Secondaries.')
+
+      with open(fname, 'rb') as fobj:
+        data = fobj.read()
+
     else:
       # If this is a Full Verification Secondary not running on a CAN network,
-      # select the full metadata archive.
+      # select the metadata archive for that Secondary.
       print('Treating requester as full-verification Secondary without a CAN '
           'interface because the C CAN interface is off or the ECU Serial (' +
           repr(ecu_serial) + ') does not appear in the mapping of ECU Serials '
           'to CAN IDs.')
-      fname = primary_ecu.get_full_metadata_archive_fname()
-
-    if not os.path.exists(fname):
-      raise uptane.Error('This Primary does not have a collection of metadata '
-          'to distribute to Secondaries.')
+      data = primary_ecu.get_metadata_archive_for_ecu(ecu_serial)
 
     print('Distributing metadata to ECU ' + repr(ecu_serial))
 
-    binary_data = xmlrpc_client.Binary(open(fname, 'rb').read())
+    binary_data = xmlrpc_client.Binary(data)
 
     print('Distributing image to ECU ' + repr(ecu_serial))
     return binary_data
@@ -701,6 +792,39 @@ def get_metadata_for_ecu(ecu_serial, force_partial_verification=False):
 
 
 
+def get_metadata_for_ecu_if_changed(
+    ecu_serial, fingerprint, force_partial_verification=False):
+  """
+  A conditional version of get_metadata_for_ecu, for Secondaries communicating
+  via XMLRPC: the Secondary provides the fingerprint of the metadata it last
+  received (see uptane.clients.primary.Primary.get_metadata_fingerprint), or
+  None, and the metadata is only sent if it has changed since.
+
+  Returns:
+   - the fingerprint of the Primary's current metadata (None if it has none)
+   - None if the metadata has not changed since the given fingerprint, or
+     else the metadata, as returned by get_metadata_for_ecu
+  """
+  # Ensure serial is correct format & registered
+  primary_ecu._check_ecu_serial(ecu_serial)
+
+  # Read the fingerprint before the metadata: the fingerprint is updated after
+  # the metadata files are replaced, so the metadata sent is never older than
+  # the fingerprint sent with it.
+  current_fingerprint = primary_ecu.get_metadata_fingerprint()
+
+  if current_fingerprint is not None and fingerprint == current_fingerprint:
+    print('Metadata for ECU ' + repr(ecu_serial) + ' has not changed; not '
+        'sending it.')
+    return current_fingerprint, None
+
+  return current_fingerprint, get_metadata_for_ecu(
+      ecu_serial, force_partial_verification)
+
+
+
+
+
 def get_time_attestation_for_ecu(ecu_serial):
   """
   """
@@ -754,12 +878,21 @@ class RequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
 
 
 
-def listen():
+def listen(use_asyncio=False):
   """
   Listens on an available port from list PRIMARY_SERVER_AVAILABLE_PORTS, for
   XML-RPC calls from demo Secondaries for Primary interface calls.
+
+  If use_asyncio is True, serves Secondaries concurrently with asyncio,
+  streaming images and metadata to them (see
+  uptane/clients/asyncprimary.py). This requires Python 3.7 or later, and
+  serves only Secondaries that communicate via XML-RPC, not via CAN.
   """
 
+  if use_asyncio:
+    listen_asynchronously()
+    return
+
   # Create server
   server = None
   successful_port = None
@@ -799,8 +932,24 @@ def listen():
 
   server.register_function(get_image_for_ecu, 'get_image')
 
+  server.register_function(get_image_delta_for_ecu, 'get_image_delta')
+
+  server.register_function(
+      get_image_chunk_manifest_for_ecu, 'get_image_chunk_manifest')
+
+  server.register_function(get_image_chunk_for_ecu, 'get_image_chunk')
+
   server.register_function(get_metadata_for_ecu, 'get_metadata')
 
+  server.register_function(
+      get_metadata_for_ecu_if_changed, 'get_metadata_if_changed')
+
+  server.register_function(
+      primary_ecu.get_metadata_fingerprint, 'get_metadata_fingerprint')
+
+  server.register_function(
+      primary_ecu.metadata_changed_since, 'metadata_changed_since')
+
   server.register_function(
       primary_ecu.update_exists_for_ecu, 'update_exists_for_ecu')
 
@@ -811,6 +960,50 @@ def listen():
 
 
 
+
+def listen_asynchronously():
+  """
+  Serves Secondaries with an asyncio server (see listen), on an available port
+  from list PRIMARY_SERVER_AVAILABLE_PORTS, accessing the Primary only while
+  holding primary_lock.
+  """
+  import uptane.clients.asyncprimary as asyncprimary
+
+  last_error = None
+  for port in demo.PRIMARY_SERVER_AVAILABLE_PORTS:
+    service = asyncprimary.PrimaryService(
+        primary_ecu, demo.PRIMARY_SERVER_HOST, port, lock=primary_lock)
+
+    # Functions beyond the Primary interface that demo Secondaries also use.
+    service.register_function(
+        get_image_chunk_manifest_for_ecu, 'get_image_chunk_manifest')
+    service.register_function(get_image_chunk_for_ecu, 'get_image_chunk')
+    service.register_function(
+        get_metadata_for_ecu_if_changed, 'get_metadata_if_changed')
+    service.register_function(
+        primary_ecu.get_metadata_fingerprint, 'get_metadata_fingerprint')
+    service.register_function(
+        primary_ecu.metadata_changed_since, 'metadata_changed_since')
+
+    print('Primary will now listen on port ' + str(port) + ', serving '
+        'Secondaries concurrently.')
+
+    try:
+      # Fails at once if the port cannot be bound.
+      service.serve_forever()
+    except socket.error as e:
+      print('Failed to bind Primary asyncio Listener to port ' + repr(port) +
+          '. Trying next port.')
+      last_error = e
+    else:
+      return
+
+  assert last_error is not None, 'Programming error'
+  raise last_error
+
+
+
+
 def try_banners():
   preview_all_banners()
 
@@ -271,9 +271,11 @@ def update_cycle():
   # Download the time attestation from the Primary.
   time_attestation = pserver.get_last_timeserver_attestation()
 
-  # Download the metadata from the Primary in the form of an archive. This
-  # returns the binary data that we need to write to file.
-  metadata_archive = pserver.get_metadata(secondary_ecu.ecu_serial)
+  # Download the metadata from the Primary in the form of an archive, unless
+  # it has not changed since we last processed it. This returns the binary
+  # data of the archive (or None if it has not changed).
+  (metadata_fingerprint, metadata_archive) = pserver.get_metadata_if_changed(
+      secondary_ecu.ecu_serial, secondary_ecu.metadata_fingerprint)
 
   # Validate the time attestation and internalize the time. Continue
   # regardless.
@@ -291,16 +293,12 @@ def update_cycle():
   #else:
   #  print(GREEN + 'Official time has been updated successfully.' + ENDCOLORS)
 
-  # Dump the archive file to disk.
-  archive_fname = os.path.join(
-      secondary_ecu.full_client_dir, 'metadata_archive.zip')
-
-  with open(archive_fname, 'wb') as fobj:
-    fobj.write(metadata_archive.data)
-
-  # Now tell the Secondary reference implementation code where the archive file
-  # is and let it expand and validate the metadata.
-  secondary_ecu.process_metadata(archive_fname)
+  # Let the Secondary reference implementation code validate the metadata in
+  # the archive, straight from memory: only the metadata that validates is
+  # written to disk. (If the metadata has not changed, it already has been.)
+  secondary_ecu.process_metadata_from_memory(
+      metadata_archive.data if metadata_archive is not None else None,
+      metadata_fingerprint)
 
 
   # As part of the process_metadata call, the secondary will have saved
@@ -353,8 +351,39 @@ def update_cycle():
     submit_ecu_manifest_to_primary()
     return
 
-  # Download the image for this ECU from the Primary.
-  (image_fname, image) = pserver.get_image(secondary_ecu.ecu_serial)
+  # If we have our installed image on disk, ask the Primary for just the
+  # difference between it and the new image, and fall back to downloading the
+  # whole image.
+  installed_image_fname = os.path.join(
+      client_directory, secondary_ecu.firmware_fileinfo['filepath'].lstrip('/'))
+  image_delta = None
+
+  if os.path.exists(installed_image_fname):
+    (image_fname, image_delta) = pserver.get_image_delta(
+        secondary_ecu.ecu_serial)
+
+  if image_delta is not None and image_fname != expected_image_fname:
+    print(YELLOW + 'Image delta from Primary is not for the expected image. '
+        'Downloading the whole image instead.' + ENDCOLORS)
+    image_delta = None
+
+  if image_delta is not None:
+    try:
+      secondary_ecu.reconstruct_image_from_delta(
+          image_fname, image_delta.data, installed_image_fname)
+    except uptane.BadDelta:
+      print(YELLOW + 'Image delta from Primary did not apply. Downloading '
+          'the whole image instead.' + ENDCOLORS)
+      image_delta = None
+
+  if image_delta is not None:
+    image = image_delta
+
+  else:
+    # Download the image for this ECU from the Primary, in chunks, so that the
+    # whole image is never held in memory. Here, find out what to download.
+    image = pserver.get_image_chunk_manifest(secondary_ecu.ecu_serial)
+    image_fname = None if image is None else image['filepath']
 
   if image is None:
     print(YELLOW + 'Requested image from Primary but received none. Update '
@@ -385,25 +414,26 @@ def update_cycle():
     submit_ecu_manifest_to_primary()
     return
 
-  # Write the downloaded image binary data to disk.
-  unverified_targets_dir = os.path.join(client_directory, 'unverified_targets')
-  if not os.path.exists(unverified_targets_dir):
-    os.mkdir(unverified_targets_dir)
-  with open(os.path.join(unverified_targets_dir, image_fname), 'wb') as fobj:
-    fobj.write(image.data)
+  def get_image_chunk(offset, length):
+    return pserver.get_image_chunk(
+        secondary_ecu.ecu_serial, offset, length).data
 
-
-  # Validate the image against the metadata.
+  # Validate the image against the metadata. (An image received in chunks is
+  # written to disk and validated as it arrives; an image reconstructed from
+  # a delta is already on disk.)
   try:
-    secondary_ecu.validate_image(image_fname)
-  except uptane.DownloadLengthMismatchError:
+    if image_delta is None:
+      secondary_ecu.receive_image_in_chunks(image_fname, image, get_image_chunk)
+    else:
+      secondary_ecu.validate_image(image_fname)
+  except tuf.DownloadLengthMismatchError:
     attacks_detected += 'Image from Primary failed to validate: length ' + \
         'mismatch.\n'
     generate_signed_ecu_manifest()
     submit_ecu_manifest_to_primary()
     return
   except tuf.BadHashError:
-    attacks_detected += 'Image from Primary failed to validate: length ' + \
+    attacks_detected += 'Image from Primary failed to validate: hash ' + \
         'mismatch.\n'
     generate_signed_ecu_manifest()
     submit_ecu_manifest_to_primary()
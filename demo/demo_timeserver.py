@@ -50,10 +50,15 @@ def load_timeserver_key(use_new_keys=False):
 
 
 
-def listen(use_new_keys=False):
+def listen(use_new_keys=False, batched=False):
   """
   Listens on TIMESERVER_PORT for xml-rpc calls to functions:
    - get_signed_time(nonces)
+
+  If batched is True, serves requests concurrently with asyncio, signing the
+  time for batches of requests that arrive close together with a single
+  signature (see uptane/services/asynctimeserver.py). This requires Python
+  3.7 or later.
   """
 
   # Set the timeserver's signing key.
@@ -61,6 +66,19 @@ def listen(use_new_keys=False):
   timeserver.set_timeserver_key(load_timeserver_key(use_new_keys))
   print('Timeserver signing key loaded.')
 
+  # Precompute per-second and per-key work rather than repeating it for every
+  # request.
+  timeserver.set_tick_mode(True)
+
+  if batched:
+    import uptane.services.asynctimeserver as asynctimeserver
+    server = asynctimeserver.make_server(
+        demo.TIMESERVER_HOST, demo.TIMESERVER_PORT)
+    print('Timeserver will now listen on port ' + str(demo.TIMESERVER_PORT) +
+        ', signing the time for requests in batches.')
+    server.serve_forever()
+    return
+
   # Create server
   server = xmlrpc_server.SimpleXMLRPCServer(
       (demo.TIMESERVER_HOST, demo.TIMESERVER_PORT),
@@ -0,0 +1,73 @@
+"""
+<Program Name>
+  benchmark_formats.py
+
+<Purpose>
+  Compares the time taken to validate a signable Vehicle Manifest containing
+  100 ECU Manifests using plain tuf.schema validation and using the
+  fast-path validation in uptane/fastschema.py, then the time taken to check
+  the manifest followed by each ECU Manifest in it (as the Director does when
+  registering a Vehicle Manifest), with and without a validation session.
+
+  Run from the repository root:
+    python -m tests.benchmark_formats
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane.formats
+import uptane.fastschema
+
+import timeit
+
+from tests.test_formats import make_vehicle_manifest
+
+N_ECUS = 100
+REPEAT = 200
+
+
+def main():
+
+  schema = uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA
+  ecu_schema = uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA
+  manifest = make_vehicle_manifest(N_ECUS)
+  ecu_manifests = [m for ms in manifest['signed']['ecu_version_manifests'
+      ].values() for m in ms]
+
+  def validate():
+    schema.check_match(manifest)
+
+  def validate_each():
+    schema.check_match(manifest)
+    for ecu_manifest in ecu_manifests:
+      ecu_schema.check_match(ecu_manifest)
+
+  def validate_each_in_session():
+    with uptane.fastschema.validation_session():
+      validate_each()
+
+  def best(function):
+    return min(timeit.repeat(function, number=REPEAT, repeat=3)) / REPEAT
+
+  results = []
+  for fast in [False, True]:
+    uptane.fastschema.set_fast_validation(fast)
+    validate_each() # Compile the validators, if fast.
+    results.append((best(validate), best(validate_each),
+        best(validate_each_in_session)))
+
+  print('Validating a Vehicle Manifest with ' + str(N_ECUS) + ' ECU Manifests '
+      '(microseconds):')
+  print('                             tuf.schema     compiled   speedup')
+  for i, label in enumerate(['manifest', 'manifest, then each ECU',
+      'same, in validation session']):
+    plain = results[0][i]
+    fast = results[1][i]
+    print('  {:<27}{:>10.1f}   {:>10.1f}   {:>6.1f}x'.format(
+        label, plain * 1e6, fast * 1e6, plain / fast))
+
+
+
+if __name__ == '__main__':
+  main()
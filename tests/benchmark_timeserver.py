@@ -0,0 +1,83 @@
+"""
+<Program Name>
+  benchmark_timeserver.py
+
+<Purpose>
+  Measures how many time attestation requests per second
+  uptane.services.timeserver.get_signed_time answers, for nonce lists of 1 to
+  1000 nonces, with and without tick mode (see set_tick_mode), and, for
+  comparison, how many requests per second get_signed_time_batch answers when
+  given 100 requests at a time.
+
+  Run from the repository root (the optional argument is the number of
+  seconds to spend on each measurement):
+    python -m tests.benchmark_timeserver [1]
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane.services.timeserver as timeserver
+import tuf.keys
+
+import sys
+import time
+import random
+
+NONCE_COUNTS = [1, 10, 100, 1000]
+BATCH_SIZE = 100
+
+
+def requests_per_second(nonce_lists, seconds, batched):
+  """
+  Returns the number of requests answered per second, given requests for the
+  given nonce lists, over about the given number of seconds.
+  """
+  served = 0
+  start = time.time()
+
+  while time.time() - start < seconds:
+    if batched:
+      for i in range(0, len(nonce_lists), BATCH_SIZE):
+        timeserver.get_signed_time_batch(nonce_lists[i:i + BATCH_SIZE])
+    else:
+      for nonces in nonce_lists:
+        timeserver.get_signed_time(nonces)
+    served += len(nonce_lists)
+
+  return served / (time.time() - start)
+
+
+
+def main():
+
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+  timeserver.set_timeserver_key(tuf.keys.generate_ed25519_key())
+  rng = random.Random(0)
+
+  print('Time attestation requests answered per second:')
+  print('   nonces     per-request   tick mode   speedup   batched (x' +
+      str(BATCH_SIZE) + ')')
+
+  for nonce_count in NONCE_COUNTS:
+    nonce_lists = [[rng.randrange(2**31) for i in range(nonce_count)]
+        for j in range(BATCH_SIZE)]
+
+    try:
+      timeserver.set_tick_mode(False)
+      plain = requests_per_second(nonce_lists, seconds, False)
+      timeserver.set_tick_mode(True)
+      tick = requests_per_second(nonce_lists, seconds, False)
+      batched = requests_per_second(nonce_lists, seconds, True)
+
+    finally:
+      timeserver.set_tick_mode(False)
+
+    print('  {:>7} {:>15.0f} {:>11.0f}   {:>6.2f}x {:>14.0f}'.format(
+        nonce_count, plain, tick, tick / plain, batched))
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,251 @@
+"""
+<Program Name>
+  test_asyncprimary.py
+
+<Purpose>
+  Unit testing for uptane/clients/asyncprimary.py, and the streaming of files
+  by the XML-RPC server it uses (uptane/asyncxmlrpc.py)
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.asyncxmlrpc
+import uptane.clients.asyncprimary as asyncprimary
+
+import os
+import time
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import unittest
+
+from six.moves import xmlrpc_client
+
+ECU_SERIAL = 'ecu1'
+
+
+class SimplePrimary(object):
+  """
+  Stands in for an uptane.clients.primary.Primary, offering only what
+  asyncprimary uses, with one ECU and one image.
+  """
+
+  def __init__(self, full_client_dir):
+    self.full_client_dir = full_client_dir
+    self.per_ecu_metadata_archives = False
+    self.manifests = []
+
+  def _check_ecu_serial(self, ecu_serial):
+    if ecu_serial != ECU_SERIAL:
+      raise uptane.UnknownECU('Unknown ECU ' + repr(ecu_serial))
+
+  def update_exists_for_ecu(self, ecu_serial):
+    self._check_ecu_serial(ecu_serial)
+    return os.path.exists(
+        os.path.join(self.full_client_dir, 'targets', 'image.img'))
+
+  def get_image_fname_for_ecu(self, ecu_serial):
+    if not self.update_exists_for_ecu(ecu_serial):
+      return None
+    return os.path.join(self.full_client_dir, 'targets', 'image.img')
+
+  def get_image_delta_fname_for_ecu(self, ecu_serial):
+    self._check_ecu_serial(ecu_serial)
+    delta_fname = os.path.join(self.full_client_dir, 'image.delta')
+    return delta_fname if os.path.exists(delta_fname) else None
+
+  def get_full_metadata_archive_fname(self):
+    return os.path.join(self.full_client_dir, 'full_metadata_archive.zip')
+
+  def get_partial_metadata_fname(self):
+    return os.path.join(self.full_client_dir, 'director_targets.json')
+
+  def register_ecu_manifest(self, vin, ecu_serial, nonce, signed_ecu_manifest):
+    # Slow, to check that other requests are handled meanwhile.
+    time.sleep(0.2)
+    self.manifests.append(signed_ecu_manifest)
+
+  def register_new_secondary(self, ecu_serial):
+    pass
+
+  def get_last_timeserver_attestation(self):
+    return None
+
+
+
+
+
+class TestAsyncPrimary(unittest.TestCase):
+  """
+  "unittest"-style test class for the asyncprimary module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.temp_dir, 'targets'))
+    self.primary = SimplePrimary(self.temp_dir)
+    self.service = asyncprimary.PrimaryService(
+        self.primary, 'localhost', 0, request_timeout=0.5)
+
+
+
+  def tearDown(self):
+    self.service.server.executor.shutdown()
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def serve(self, *calls):
+    """
+    Makes the given calls ((name, params) pairs) to the service concurrently,
+    each over its own connection, and returns their results (or the faults
+    raised).
+    """
+    def call(port, name, params):
+      proxy = xmlrpc_client.ServerProxy(
+          'http://localhost:' + str(port), allow_none=True)
+      try:
+        return getattr(proxy, name)(*params)
+      except xmlrpc_client.Fault as fault:
+        return fault
+
+    async def call_all():
+      asyncio_server = await self.service.start()
+      port = asyncio_server.sockets[0].getsockname()[1]
+      loop = asyncio.get_running_loop()
+
+      try:
+        return await asyncio.gather(*[loop.run_in_executor(
+            None, call, port, name, params) for name, params in calls])
+
+      finally:
+        asyncio_server.close()
+        await asyncio_server.wait_closed()
+
+    return asyncio.run(call_all())
+
+
+
+
+
+  def test_01_streamed_files(self):
+
+    self.assertEqual([[None, None], False], self.serve(
+        ('get_image', [ECU_SERIAL]),
+        ('update_exists_for_ecu', [ECU_SERIAL])))
+
+    # Images of several sizes around and above the chunk size, so that they
+    # are sent in several chunks with any remainder.
+    chunk_size = uptane.asyncxmlrpc.STREAM_CHUNK_SIZE
+    for size in [0, 1, 2, 3, chunk_size - 1, 2 * chunk_size + 1]:
+      image = os.urandom(size)
+      with open(os.path.join(self.temp_dir, 'targets', 'image.img'),
+          'wb') as fobj:
+        fobj.write(image)
+
+      [[fname, data]] = self.serve(('get_image', [ECU_SERIAL]))
+      self.assertEqual('image.img', fname)
+      self.assertEqual(image, data.data)
+
+    # Deltas are streamed likewise, if there is one.
+    self.assertEqual([['image.img', None]],
+        self.serve(('get_image_delta', [ECU_SERIAL])))
+    with open(os.path.join(self.temp_dir, 'image.delta'), 'wb') as fobj:
+      fobj.write(b'delta')
+    [[fname, delta]] = self.serve(('get_image_delta', [ECU_SERIAL]))
+    self.assertEqual('image.img', fname)
+    self.assertEqual(b'delta', delta.data)
+
+    fault = self.serve(('get_metadata', [ECU_SERIAL]))[0]
+    self.assertIsInstance(fault, xmlrpc_client.Fault)
+    self.assertIn('does not have a collection of metadata', fault.faultString)
+
+    for fname, metadata in [
+        (self.primary.get_full_metadata_archive_fname(), b'full'),
+        (self.primary.get_partial_metadata_fname(), b'partial')]:
+      with open(fname, 'wb') as fobj:
+        fobj.write(metadata)
+
+    full, partial = self.serve(
+        ('get_metadata', [ECU_SERIAL]), ('get_metadata', [ECU_SERIAL, True]))
+    self.assertEqual(b'full', full.data)
+    self.assertEqual(b'partial', partial.data)
+
+    fault = self.serve(('get_image', ['unknown']))[0]
+    self.assertIsInstance(fault, xmlrpc_client.Fault)
+    self.assertIn('UnknownECU', fault.faultString)
+
+
+
+
+
+  def test_05_concurrency_and_timeouts(self):
+
+    # A client that connects but never sends a request is disconnected after
+    # the timeout, without holding up the other clients.
+    idle_socket = []
+
+    def connect_idly(port):
+      sock = socket.create_connection(('localhost', port))
+      idle_socket.append(sock)
+      # Returns once the server closes the connection.
+      return sock.recv(1)
+
+    async def serve_with_idle_client():
+      asyncio_server = await self.service.start()
+      port = asyncio_server.sockets[0].getsockname()[1]
+      loop = asyncio.get_running_loop()
+
+      def call(name, *params):
+        proxy = xmlrpc_client.ServerProxy(
+            'http://localhost:' + str(port), allow_none=True)
+        return getattr(proxy, name)(*params)
+
+      try:
+        idle = loop.run_in_executor(None, connect_idly, port)
+        start = time.time()
+        results = await asyncio.gather(
+            loop.run_in_executor(None, call, 'submit_ecu_manifest', 'vin',
+            ECU_SERIAL, 5, {'manifest': 1}),
+            loop.run_in_executor(None, call, 'update_exists_for_ecu',
+            ECU_SERIAL),
+            loop.run_in_executor(None, call,
+            'get_last_timeserver_attestation'))
+        served = time.time() - start
+        self.assertEqual(b'', await idle)
+        return results, served
+
+      finally:
+        for sock in idle_socket:
+          sock.close()
+        asyncio_server.close()
+        await asyncio_server.wait_closed()
+
+    results, served = asyncio.run(serve_with_idle_client())
+    self.assertEqual([None, False, None], results)
+    self.assertEqual([{'manifest': 1}], self.primary.manifests)
+    self.assertLess(served, 0.5)
+
+    # The Primary is accessed holding the service's lock.
+    self.service.lock.acquire()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        self.serve(('update_exists_for_ecu', [ECU_SERIAL]))))
+    thread.start()
+    thread.join(0.2)
+    self.assertTrue(thread.is_alive())
+    self.service.lock.release()
+    thread.join()
+    self.assertEqual([[False]], result)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,111 @@
+"""
+<Program Name>
+  test_asynctimeserver.py
+
+<Purpose>
+  Unit testing for uptane/services/asynctimeserver.py and the XML-RPC server
+  it uses (uptane/asyncxmlrpc.py)
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import uptane.services.timeserver as timeserver
+import uptane.services.asynctimeserver as asynctimeserver
+import tuf
+import tuf.keys
+
+import asyncio
+import unittest
+
+from six.moves import xmlrpc_client
+
+
+class TestAsyncTimeserver(unittest.TestCase):
+  """
+  "unittest"-style test class for the asynctimeserver module in the reference
+  implementation
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.key = tuf.keys.generate_ed25519_key()
+    timeserver.set_timeserver_key(cls.key)
+
+
+
+  def check_attestation(self, nonces, attestation):
+    self.assertTrue(uptane.common.verify_signature(
+        self.key, attestation['signatures'][0], attestation['signed']))
+    self.assertEqual(nonces, uptane.common.get_attested_nonces(attestation))
+
+
+
+
+
+  def test_01_batching(self):
+
+    batching_timeserver = asynctimeserver.BatchingTimeserver(
+        batch_window=0.05, max_batch_size=4)
+    nonce_lists = [[i] for i in range(10)]
+
+    async def request_all():
+      return await asyncio.gather(*[batching_timeserver.get_signed_time(
+          nonces) for nonces in nonce_lists])
+
+    attestations = asyncio.run(request_all())
+
+    for nonces, attestation in zip(nonce_lists, attestations):
+      self.check_attestation(nonces, attestation)
+
+    # Two full batches, and one of the rest once the window passed.
+    self.assertEqual(3, batching_timeserver.batches_signed)
+    self.assertEqual(10, batching_timeserver.requests_signed)
+    self.assertEqual(3, len(set(
+        attestation['signed']['merkle_root'] for attestation in attestations)))
+
+    with self.assertRaises(tuf.FormatError):
+      asyncio.run(batching_timeserver.get_signed_time(['not a nonce']))
+
+
+
+
+
+  def test_05_xmlrpc(self):
+
+    server = asynctimeserver.make_server('localhost', 0)
+    server.request_timeout = 1
+
+    def call(port, name, *params):
+      proxy = xmlrpc_client.ServerProxy('http://localhost:' + str(port))
+      return getattr(proxy, name)(*params)
+
+    async def request_all():
+      asyncio_server = await server.start()
+      port = asyncio_server.sockets[0].getsockname()[1]
+      loop = asyncio.get_running_loop()
+
+      try:
+        attestations = await asyncio.gather(*[loop.run_in_executor(
+            None, call, port, 'get_signed_time', [i, i + 1]) for i in range(5)])
+
+        with self.assertRaises(xmlrpc_client.Fault):
+          await loop.run_in_executor(None, call, port, 'no_such_function')
+
+      finally:
+        asyncio_server.close()
+        await asyncio_server.wait_closed()
+
+      return attestations
+
+    for i, attestation in enumerate(asyncio.run(request_all())):
+      self.check_attestation([i, i + 1], attestation)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
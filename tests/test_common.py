@@ -0,0 +1,178 @@
+"""
+<Program Name>
+  test_common.py
+
+<Purpose>
+  Unit testing for uptane/common.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import tuf
+import tuf.formats
+import tuf.keys
+
+import os
+import hashlib
+import tempfile
+import unittest
+
+# For temporary convenience:
+import demo # for import_public_key, import_private_key
+
+# Initialize these in setUpModule below.
+key_pub = None
+key_pri = None
+
+
+
+
+
+def setUpModule():
+  global key_pub
+  global key_pri
+
+  key_pub = demo.import_public_key('secondary')
+  key_pri = demo.import_private_key('secondary')
+
+
+
+
+
+class TestCommon(unittest.TestCase):
+  """
+  "unittest"-style test class for the common module in the reference
+  implementation
+  """
+
+  def test_01_encode_canonical(self):
+
+    signed = {'b': [1, 2, {'c': 'quote " backslash \\ newline \n'}], 'a': None,
+        'unicode': 'é', 'flag': True}
+
+    expected = tuf.formats.encode_canonical(signed).encode('utf-8')
+
+    self.assertEqual(expected, uptane.common.encode_canonical(signed))
+    # Cached the second time around, with the same result.
+    self.assertEqual(expected, uptane.common.encode_canonical(signed))
+
+    # A modified object gets a new encoding.
+    signed['a'] = 5
+    self.assertEqual(tuf.formats.encode_canonical(signed).encode('utf-8'),
+        uptane.common.encode_canonical(signed))
+
+    # Objects that canonical JSON cannot represent are still rejected.
+    with self.assertRaises(tuf.FormatError):
+      uptane.common.encode_canonical({'a': 1.5})
+    with self.assertRaises(tuf.FormatError):
+      uptane.common.encode_canonical({'a': object()})
+
+    # The cache does not exceed its size limit.
+    for i in range(uptane.common.CANONICAL_CACHE_SIZE + 10):
+      uptane.common.encode_canonical({'i': i})
+    self.assertEqual(uptane.common.CANONICAL_CACHE_SIZE,
+        len(uptane.common._canonical_cache))
+
+
+
+
+
+  def test_10_sign_and_verify(self):
+
+    signable = tuf.formats.make_signable({'vin': '111', 'nonces': [1, 2]})
+    uptane.common.sign_signable(signable, [key_pri])
+
+    # Signatures match those TUF produces and are verified the same way.
+    self.assertEqual(
+        tuf.keys.create_signature(key_pri, signable['signed']),
+        signable['signatures'][0])
+    self.assertTrue(uptane.common.verify_signature(
+        key_pub, signable['signatures'][0], signable['signed']))
+    self.assertTrue(tuf.keys.verify_signature(
+        key_pub, signable['signatures'][0], signable['signed']))
+
+    signable['signed']['nonces'].append(3)
+    self.assertFalse(uptane.common.verify_signature(
+        key_pub, signable['signatures'][0], signable['signed']))
+
+    self.assertEqual([False, True], uptane.common.verify_signatures([
+        (key_pub, signable['signatures'][0], signable['signed']),
+        (key_pub, uptane.common.create_signature(key_pri, signable['signed']),
+            signable['signed'])]))
+
+
+
+
+
+  def test_15_validate_file(self):
+
+    data = b'image data ' * 10000
+    hashes = {
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'sha512': hashlib.sha512(data).hexdigest()}
+
+    # Fed incrementally.
+    validator = uptane.common.FileValidator(len(data), hashes)
+    for i in range(0, len(data), 7000):
+      validator.update(data[i:i + 7000])
+    self.assertEqual(hashes, validator.hexdigests())
+    validator.check()
+
+    validator = uptane.common.FileValidator(len(data), hashes)
+    validator.update(data[:-1])
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      validator.check()
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      validator.update(b'xx')
+    validator.update(b'x')
+    with self.assertRaises(tuf.BadHashError):
+      validator.check()
+
+    with self.assertRaises(tuf.UnsupportedAlgorithmError):
+      uptane.common.FileValidator(len(data), {'nohash': 'ab'})
+
+    # Read from a file, or memory-mapped (with a small chunk size, to feed the
+    # hashes in several parts).
+    fd, fname = tempfile.mkstemp()
+    default_settings = (
+        uptane.common.MMAP_THRESHOLD, uptane.common.MMAP_CHUNK_SIZE)
+    try:
+      os.write(fd, data)
+      os.close(fd)
+      uptane.common.MMAP_CHUNK_SIZE = 30000
+
+      for threshold in [None, 0]:
+        uptane.common.MMAP_THRESHOLD = threshold
+
+        uptane.common.validate_file(fname, len(data), hashes)
+        self.assertEqual(hashes, uptane.common.hash_file(fname, hashes))
+
+        with self.assertRaises(tuf.DownloadLengthMismatchError):
+          uptane.common.validate_file(fname, len(data) + 1, hashes)
+
+        # Part of a file.
+        with open(fname, 'rb') as fobj:
+          fobj.seek(100)
+          validator = uptane.common.FileValidator(len(data) - 100,
+              {'sha256': hashlib.sha256(data[100:]).hexdigest()})
+          validator.update_from_file(fobj)
+          validator.check()
+
+        bad_hashes = dict(hashes, sha512=hashlib.sha512(b'other').hexdigest())
+        with self.assertRaises(tuf.BadHashError):
+          uptane.common.validate_file(fname, len(data), bad_hashes)
+
+    finally:
+      uptane.common.MMAP_THRESHOLD, uptane.common.MMAP_CHUNK_SIZE = \
+          default_settings
+      os.remove(fname)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,175 @@
+"""
+<Program Name>
+  test_delta.py
+
+<Purpose>
+  Unit testing for uptane/delta.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.delta as delta
+import tuf
+
+import os
+import shutil
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+BLOCK_SIZE = 64
+
+
+class TestDelta(unittest.TestCase):
+  """
+  "unittest"-style test class for the delta module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.old_fname = os.path.join(self.temp_dir, 'old.img')
+    self.new_fname = os.path.join(self.temp_dir, 'new.img')
+    self.out_fname = os.path.join(self.temp_dir, 'reconstructed.img')
+    self.delta_fname = os.path.join(self.temp_dir, 'image.delta')
+
+    rng = random.Random(5)
+    self.old_image = bytes(bytearray(
+        rng.randrange(256) for i in range(BLOCK_SIZE * 100 + 10)))
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def write(self, fname, data):
+    with open(fname, 'wb') as fobj:
+      fobj.write(data)
+
+
+
+  def round_trip(self, new_image):
+    """
+    Returns the delta from self.old_image to new_image, after checking that it
+    reconstructs new_image.
+    """
+    self.write(self.old_fname, self.old_image)
+    self.write(self.new_fname, new_image)
+
+    length = delta.create_delta(
+        self.old_fname, self.new_fname, self.delta_fname, BLOCK_SIZE)
+    with open(self.delta_fname, 'rb') as fobj:
+      d = fobj.read()
+    self.assertEqual(length, len(d))
+
+    delta.apply_delta(self.old_fname, d, self.out_fname)
+
+    with open(self.out_fname, 'rb') as fobj:
+      self.assertEqual(new_image, fobj.read())
+
+    return d
+
+
+
+
+
+  def test_01_round_trip(self):
+
+    old = self.old_image
+
+    # Identical images: the delta is a single copy operation.
+    d = self.round_trip(old)
+    self.assertEqual(len(delta.DELTA_MAGIC) + 16 + 17, len(d))
+
+    # A few changed blocks, moved blocks, and an appended tail.
+    new = (old[:BLOCK_SIZE * 10] + b'x' * BLOCK_SIZE + old[BLOCK_SIZE * 11:
+        BLOCK_SIZE * 50] + old[BLOCK_SIZE * 80:BLOCK_SIZE * 90] +
+        old[BLOCK_SIZE * 50:BLOCK_SIZE * 100] + b'new tail')
+    d = self.round_trip(new)
+    self.assertLess(len(d), BLOCK_SIZE * 4)
+
+    # Nothing in common, and empty images.
+    self.round_trip(b'y' * 1000)
+    self.round_trip(b'')
+    self.old_image = b''
+    self.round_trip(old)
+
+    # Long runs of literal bytes are split into several operations.
+    self.old_image = old
+    original_max_literal_length = delta.MAX_LITERAL_LENGTH
+    delta.MAX_LITERAL_LENGTH = BLOCK_SIZE * 2
+    try:
+      d = self.round_trip(b'z' * (BLOCK_SIZE * 5 + 1))
+    finally:
+      delta.MAX_LITERAL_LENGTH = original_max_literal_length
+    self.assertEqual(
+        len(delta.DELTA_MAGIC) + 16 + 3 * 9 + BLOCK_SIZE * 5 + 1, len(d))
+
+
+
+
+
+  def test_05_bad_deltas(self):
+
+    new = self.old_image[:BLOCK_SIZE * 10] + b'changed'
+    d = self.round_trip(new)
+    os.remove(self.out_fname)
+
+    # Applying to a different base image, or a malformed delta.
+    self.write(self.old_fname, self.old_image[:-1])
+    with self.assertRaises(uptane.BadDelta):
+      delta.apply_delta(self.old_fname, d, self.out_fname)
+
+    self.write(self.old_fname, self.old_image)
+    for bad_delta in [b'', b'not a delta', d[:-1], d + b'L',
+        d[:len(delta.DELTA_MAGIC) + 16] + b'X',
+        d[:len(delta.DELTA_MAGIC) + 16] + b'C' + b'\xff' * 16]:
+      with self.assertRaises(uptane.BadDelta):
+        delta.apply_delta(self.old_fname, bad_delta, self.out_fname)
+
+    self.assertFalse(os.path.exists(self.out_fname))
+
+    # An error other than a bad delta also leaves no partial image.
+    failing_copy = mock.Mock(size=delta._COPY.size,
+        unpack_from=mock.Mock(side_effect=IOError('read error')))
+    with mock.patch.object(delta, '_COPY', failing_copy):
+      with self.assertRaises(IOError):
+        delta.apply_delta(self.old_fname, d, self.out_fname)
+    self.assertFalse(os.path.exists(self.out_fname))
+
+    with self.assertRaises(tuf.FormatError):
+      delta.create_delta(self.old_fname, self.new_fname, self.delta_fname, 0)
+
+
+
+
+
+  def test_10_max_length(self):
+
+    new = self.old_image[:BLOCK_SIZE * 10] + b'changed'
+    d = self.round_trip(new)
+
+    # A delta that would be longer than max_length is not written.
+    self.assertEqual(len(d), delta.create_delta(self.old_fname,
+        self.new_fname, self.delta_fname, BLOCK_SIZE, max_length=len(d)))
+    self.assertIsNone(delta.create_delta(self.old_fname, self.new_fname,
+        self.delta_fname, BLOCK_SIZE, max_length=len(d) - 1))
+    self.assertFalse(os.path.exists(self.delta_fname))
+
+    # Nor is a delta that fails to be made.
+    with self.assertRaises(EnvironmentError):
+      delta.create_delta(self.old_fname + '.missing', self.new_fname,
+          self.delta_fname, BLOCK_SIZE)
+    self.assertFalse(os.path.exists(self.delta_fname))
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
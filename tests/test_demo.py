@@ -0,0 +1,163 @@
+"""
+<Program Name>
+  test_demo.py
+
+<Purpose>
+  Unit testing for the functions in demo/__init__.py that the demo services
+  share, e.g. the publication of repository metadata (publish_metadata)
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import demo
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class TestDemo(unittest.TestCase):
+  """
+  "unittest"-style test class for the demo module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.repo_dir = tempfile.mkdtemp()
+    self.staged_dir = os.path.join(self.repo_dir, 'metadata.staged')
+    self.live_link = os.path.join(self.repo_dir, 'metadata')
+    self.generations_dir = os.path.join(self.repo_dir, 'metadata.generations')
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.repo_dir)
+
+
+
+  def stage(self, version):
+    """
+    Writes staged metadata of the given version, replacing (as TUF does) the
+    files rather than rewriting them.
+    """
+    for dirname in [self.staged_dir, os.path.join(self.staged_dir, 'targets')]:
+      if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    for fname in ['timestamp.json', os.path.join('targets', 'role1.json')]:
+      staged_fname = os.path.join(self.staged_dir, fname)
+      with open(staged_fname + '.tmp', 'w') as fobj:
+        fobj.write(str(version))
+      os.rename(staged_fname + '.tmp', staged_fname)
+
+
+
+  def read_live(self, fname='timestamp.json'):
+    with open(os.path.join(self.live_link, fname)) as fobj:
+      return fobj.read()
+
+
+
+  def generations(self):
+    return sorted(os.listdir(self.generations_dir))
+
+
+
+
+
+  def test_01_publish_metadata(self):
+
+    with self.assertRaises(uptane.Error):
+      demo.publish_metadata(self.repo_dir)
+
+    # A live metadata directory from before generations were used is replaced
+    # by the symlink.
+    os.makedirs(self.live_link)
+
+    self.stage(1)
+    self.assertEqual(os.path.join(self.generations_dir, '1'),
+        demo.publish_metadata(self.repo_dir))
+    self.assertTrue(os.path.islink(self.live_link))
+    self.assertEqual(os.path.join('metadata.generations', '1'),
+        os.readlink(self.live_link))
+    self.assertEqual('1', self.read_live())
+    self.assertEqual('1', self.read_live(os.path.join('targets', 'role1.json')))
+
+    # Publishing again swaps the symlink to a new generation, leaving no
+    # temporary link behind, and leaves the previous generation unchanged
+    # for clients still reading it.
+    self.stage(2)
+    demo.publish_metadata(self.repo_dir)
+    self.assertEqual(os.path.join('metadata.generations', '2'),
+        os.readlink(self.live_link))
+    self.assertFalse(os.path.lexists(self.live_link + '.newlink'))
+    self.assertEqual('2', self.read_live())
+    self.assertEqual(['1', '2'], self.generations())
+    with open(os.path.join(
+        self.generations_dir, '1', 'timestamp.json')) as fobj:
+      self.assertEqual('1', fobj.read())
+
+    # Old generations are pruned to generations_to_keep, and at least the
+    # new generation is always kept. A stale temporary link is replaced.
+    os.symlink('nowhere', self.live_link + '.newlink')
+    self.stage(3)
+    demo.publish_metadata(self.repo_dir)
+    self.assertEqual(['2', '3'], self.generations())
+
+    self.stage(4)
+    demo.publish_metadata(self.repo_dir, generations_to_keep=3)
+    self.assertEqual(['2', '3', '4'], self.generations())
+
+    self.stage(5)
+    demo.publish_metadata(self.repo_dir, generations_to_keep=0)
+    self.assertEqual(['5'], self.generations())
+    self.assertEqual('5', self.read_live())
+
+
+
+
+
+  def test_05_live_metadata_always_present(self):
+
+    self.stage(0)
+    demo.publish_metadata(self.repo_dir)
+
+    # While metadata is published repeatedly, a reader of the live metadata
+    # always finds it complete.
+    missing = []
+    done = threading.Event()
+
+    def read_repeatedly():
+      while not done.is_set():
+        try:
+          if self.read_live() == '':
+            missing.append('empty')
+        except (IOError, OSError) as e:
+          missing.append(e)
+
+    reader = threading.Thread(target=read_repeatedly)
+    reader.start()
+
+    try:
+      for version in range(1, 50):
+        self.stage(version)
+        demo.publish_metadata(self.repo_dir, generations_to_keep=3)
+
+    finally:
+      done.set()
+      reader.join()
+
+    self.assertEqual([], missing)
+    self.assertEqual('49', self.read_live())
+    self.assertEqual(['48', '49', '50'], self.generations())
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
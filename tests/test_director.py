@@ -11,11 +11,21 @@
 
 """
 import os
+import time
+import threading
 import unittest
+from unittest import mock
 
 import shutil
+import json
+import sqlite3
 import tuf
+import tuf.formats
+import tuf.repository_tool as rt
 import uptane.services.inventorydb as inventory
+import uptane.services.inventorydb_backends as inventorydb_backends
+import uptane.common
+import uptane.formats
 import demo
 import uptane
 from uptane.services import director
@@ -95,6 +105,25 @@ def tearDownModule():
 
 
 
+def make_signed_ecu_manifest(ecu_serial, key, time='2017-03-03T17:16:30Z'):
+    """
+    Returns an ECU Manifest from the given ECU, signed with the given key.
+    """
+    ecu_manifest = {
+        'ecu_serial': ecu_serial,
+        'installed_image': {
+            'filepath': '/secondary_firmware.txt',
+            'fileinfo': {'length': 37, 'hashes': {'sha256': 'ab' * 32}}},
+        'timeserver_time': time,
+        'previous_timeserver_time': time,
+        'attacks_detected': ''}
+    return uptane.common.sign_signable(
+        tuf.formats.make_signable(ecu_manifest), [key])
+
+
+
+
+
 class TestDirector(unittest.TestCase):
     """
     "unittest"-style test class for the Director module in the reference
@@ -545,5 +574,810 @@ class TestDirector(unittest.TestCase):
 
 
 
+class TestInventoryDBBackends(unittest.TestCase):
+    """
+    Tests of inventorydb's public functions running against the SQLite backend,
+    checking that they behave the way they do with the default in-memory
+    backend used by TestDirector.
+    """
+
+    def setUp(self):
+        self.backend = inventorydb_backends.SQLiteInventoryBackend(':memory:')
+        inventory.set_backend(self.backend)
+
+
+
+
+
+    def tearDown(self):
+        inventory.set_backend(inventory.memory_backend)
+        inventory.set_retention_policy()
+        self.backend.close()
+
+
+
+
+
+    def test_set_backend(self):
+        with self.assertRaises(tuf.FormatError):
+            inventory.set_backend({})
+
+        self.assertIs(self.backend, inventory.backend)
+
+
+
+
+
+    def test_registration_and_manifests(self):
+        key = demo.import_private_key('secondary')
+        key_pub = demo.import_public_key('secondary')
+
+        with self.assertRaises(uptane.UnknownVehicle):
+            inventory.check_vin_registered('114')
+
+        inventory.register_ecu(True, '114', '22222', key_pub)
+        inventory.register_ecu(False, '114', '33333', key_pub)
+        inventory.register_ecu(False, '114', '33333', key_pub)
+
+        # The in-memory dictionaries are not used by this backend.
+        self.assertNotIn('114', inventory.ecus_by_vin)
+
+        inventory.check_vin_registered('114')
+        self.assertEqual(['22222', '33333'],
+            inventory.get_ecu_serials_in_vehicle('114'))
+        self.assertEqual('22222', self.backend.get_primary_ecu_serial('114'))
+        self.assertEqual(key_pub, inventory.get_ecu_public_key('33333'))
+
+        with self.assertRaises(uptane.Spoofing):
+            inventory.register_ecu(
+                True, '114', '44444', key_pub, overwrite=False)
+
+        with self.assertRaises(uptane.UnknownECU):
+            inventory.get_ecu_public_key('44444')
+
+        self.assertIsNone(inventory.get_last_vehicle_manifest('114'))
+        self.assertIsNone(inventory.get_last_ecu_manifest('22222'))
+
+        first = make_signed_ecu_manifest('22222', key)
+        second = make_signed_ecu_manifest('22222', key)
+        second['signed']['attacks_detected'] = 'second'
+        inventory.save_ecu_manifest('114', '22222', first)
+        inventory.save_ecu_manifest('114', '22222', second)
+
+        self.assertEqual([first, second], inventory.get_ecu_manifests('22222'))
+        self.assertEqual(second, inventory.get_last_ecu_manifest('22222'))
+        self.assertEqual({'22222': [first, second], '33333': []},
+            inventory.get_all_ecu_manifests_from_vehicle('114'))
+
+        vehicle_manifest = uptane.common.sign_signable(
+            tuf.formats.make_signable({
+                'vin': '114',
+                'primary_ecu_serial': '22222',
+                'ecu_version_manifests': {'22222': [first, second]}}),
+            [key])
+        inventory.save_vehicle_manifest('114', vehicle_manifest)
+
+        self.assertEqual(
+            [vehicle_manifest], inventory.get_vehicle_manifests('114'))
+        self.assertEqual(
+            vehicle_manifest, inventory.get_last_vehicle_manifest('114'))
+
+        # Re-registering an ECU discards its manifests.
+        inventory.register_ecu(False, '114', '22222', key_pub)
+        self.assertEqual([], inventory.get_ecu_manifests('22222'))
+
+
+
+
+
+    def test_retention_policy(self):
+        key = demo.import_private_key('secondary')
+        key_pub = demo.import_public_key('secondary')
+        spill_dir = os.path.join(
+            uptane.WORKING_DIR, director_repos_name, 'spilled')
+        if os.path.exists(spill_dir):
+            shutil.rmtree(spill_dir)
+
+        with self.assertRaises(tuf.FormatError):
+            inventory.set_retention_policy(max_ecu_manifests_per_ecu=0)
+
+        # The same behavior is expected of both backends. Use a different VIN
+        # and ECU Serial for each, since the memory backend is shared.
+        for backend, vin, ecu_serial in [
+                (self.backend, '115', '55555'),
+                (inventory.memory_backend, '116', '66666')]:
+            inventory.set_backend(backend)
+            inventory.set_retention_policy(
+                max_vehicle_manifests_per_vin=2, max_ecu_manifests_per_ecu=3,
+                spill_dir=spill_dir)
+            inventory.register_ecu(True, vin, ecu_serial, key_pub)
+
+            vehicle_manifests = []
+            ecu_manifests = []
+            for day in range(1, 5):
+                ecu_manifest = make_signed_ecu_manifest(
+                    ecu_serial, key, '2017-03-0' + str(day) + 'T00:00:00Z')
+                vehicle_manifest = uptane.common.sign_signable(
+                    tuf.formats.make_signable({
+                        'vin': vin,
+                        'primary_ecu_serial': ecu_serial,
+                        'ecu_version_manifests': {ecu_serial: [ecu_manifest]}}),
+                    [key])
+                vehicle_manifest_id = inventory.save_vehicle_manifest(
+                    vin, vehicle_manifest)
+                inventory.save_ecu_manifest(
+                    vin, ecu_serial, ecu_manifest,
+                    vehicle_manifest_id=vehicle_manifest_id, position=0)
+                vehicle_manifests.append(vehicle_manifest)
+                ecu_manifests.append(ecu_manifest)
+
+            # ECU Manifests whose Vehicle Manifests were pruned remain intact.
+            self.assertEqual(
+                vehicle_manifests[2:], inventory.get_vehicle_manifests(vin))
+            self.assertEqual(
+                ecu_manifests[1:], inventory.get_ecu_manifests(ecu_serial))
+            self.assertEqual(vehicle_manifests[:2],
+                inventory.get_spilled_vehicle_manifests(vin))
+            self.assertEqual(ecu_manifests[:1],
+                inventory.get_spilled_ecu_manifests(ecu_serial))
+
+            inventory.prune_manifests_older_than('2017-03-04T00:00:00Z')
+            self.assertEqual(
+                vehicle_manifests[3:], inventory.get_vehicle_manifests(vin))
+            self.assertEqual(
+                ecu_manifests[3:], inventory.get_ecu_manifests(ecu_serial))
+            self.assertEqual(vehicle_manifests[:3],
+                inventory.get_spilled_vehicle_manifests(vin))
+            self.assertEqual(ecu_manifests[:3],
+                inventory.get_spilled_ecu_manifests(ecu_serial))
+
+        with self.assertRaises(tuf.FormatError):
+            inventory.save_ecu_manifest(
+                vin, ecu_serial, ecu_manifests[0], vehicle_manifest_id=1)
+
+
+
+
+
+    def test_persistence(self):
+        temp_dir = os.path.join(uptane.WORKING_DIR, director_repos_name)
+        if not os.path.exists(temp_dir):
+            os.mkdir(temp_dir)
+        db_fname = os.path.join(temp_dir, 'inventory.sqlite')
+        if os.path.exists(db_fname):
+            os.remove(db_fname)
+
+        key_pub = demo.import_public_key('secondary')
+
+        backend = inventorydb_backends.SQLiteInventoryBackend(db_fname)
+        inventory.set_backend(backend)
+        inventory.register_ecu(True, '112', '22222', key_pub)
+        backend.close()
+
+        # A new backend on the same file (e.g. after a Director restart) sees
+        # everything registered before.
+        backend = inventorydb_backends.SQLiteInventoryBackend(db_fname)
+        inventory.set_backend(backend)
+        inventory.check_vin_registered('112')
+        self.assertEqual(key_pub, inventory.get_ecu_public_key('22222'))
+        backend.close()
+
+
+
+
+
+    def test_schema_migration(self):
+        key = demo.import_private_key('secondary')
+        key_pub = demo.import_public_key('secondary')
+        temp_dir = os.path.join(uptane.WORKING_DIR, director_repos_name)
+        if not os.path.exists(temp_dir):
+            os.mkdir(temp_dir)
+        db_fname = os.path.join(temp_dir, 'inventory_version_1.sqlite')
+        if os.path.exists(db_fname):
+            os.remove(db_fname)
+
+        # A database in the original (unversioned) layout.
+        ecu_manifest = make_signed_ecu_manifest(
+            '22222', key, '2017-03-01T00:00:00Z')
+        vehicle_manifest = uptane.common.sign_signable(
+            tuf.formats.make_signable({
+                'vin': '117',
+                'primary_ecu_serial': '22222',
+                'ecu_version_manifests': {'22222': [ecu_manifest]}}),
+            [key])
+        connection = sqlite3.connect(db_fname)
+        with connection:
+            for statement in [
+                    'CREATE TABLE vehicles (vin TEXT PRIMARY KEY, '
+                    'primary_ecu_serial TEXT)',
+                    'CREATE TABLE ecus (ecu_serial TEXT PRIMARY KEY, '
+                    'public_key TEXT NOT NULL)',
+                    'CREATE TABLE vehicle_ecus (id INTEGER PRIMARY KEY '
+                    'AUTOINCREMENT, vin TEXT NOT NULL, ecu_serial TEXT NOT '
+                    'NULL, UNIQUE (vin, ecu_serial))',
+                    'CREATE TABLE vehicle_manifests (id INTEGER PRIMARY KEY '
+                    'AUTOINCREMENT, vin TEXT NOT NULL, manifest TEXT NOT '
+                    'NULL)',
+                    'CREATE TABLE ecu_manifests (id INTEGER PRIMARY KEY '
+                    'AUTOINCREMENT, ecu_serial TEXT NOT NULL, manifest TEXT '
+                    'NOT NULL)',
+                    'CREATE INDEX ecu_manifests_by_serial '
+                    'ON ecu_manifests (ecu_serial, id)']:
+                connection.execute(statement)
+            connection.execute("INSERT INTO vehicles VALUES ('117', '22222')")
+            connection.execute('INSERT INTO ecus VALUES (?, ?)',
+                ('22222', json.dumps(key_pub)))
+            connection.execute(
+                "INSERT INTO vehicle_ecus (vin, ecu_serial) "
+                "VALUES ('117', '22222')")
+            connection.execute(
+                "INSERT INTO vehicle_manifests (vin, manifest) "
+                "VALUES ('117', ?)", (json.dumps(vehicle_manifest),))
+            connection.execute(
+                "INSERT INTO ecu_manifests (ecu_serial, manifest) "
+                "VALUES ('22222', ?)", (json.dumps(ecu_manifest),))
+        connection.close()
+
+        backend = inventorydb_backends.SQLiteInventoryBackend(db_fname)
+        inventory.set_backend(backend)
+        self.assertEqual([ecu_manifest], inventory.get_ecu_manifests('22222'))
+        self.assertEqual(
+            [vehicle_manifest], inventory.get_vehicle_manifests('117'))
+
+        # The migrated times are used for pruning.
+        self.assertEqual([vehicle_manifest],
+            backend.prune_vehicle_manifests(
+            '117', older_than='2017-03-02T00:00:00Z'))
+        self.assertEqual([ecu_manifest], backend.prune_ecu_manifests(
+            '22222', older_than='2017-03-02T00:00:00Z'))
+        backend.close()
+
+        # A database of a layout newer than the code knows is refused.
+        connection = sqlite3.connect(db_fname)
+        self.assertEqual(
+            inventorydb_backends.SQLiteInventoryBackend.SCHEMA_VERSION,
+            connection.execute('PRAGMA user_version').fetchone()[0])
+        connection.execute('PRAGMA user_version = 1000')
+        connection.close()
+
+        with self.assertRaises(uptane.Error):
+            inventorydb_backends.SQLiteInventoryBackend(db_fname)
+
+
+
+
+
+    def test_large_prune(self):
+        key = demo.import_private_key('secondary')
+        key_pub = demo.import_public_key('secondary')
+        inventory.register_ecu(True, '118', '88888', key_pub)
+
+        # More manifests than SQLite accepts parameters in one statement (999
+        # in older versions of SQLite, which newer ones can be limited to).
+        if hasattr(self.backend._connection, 'setlimit'):
+            self.backend._connection.setlimit(
+                sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        ecu_manifest = make_signed_ecu_manifest('88888', key)
+        for i in range(2500):
+            self.backend.save_ecu_manifest('88888', ecu_manifest)
+
+        self.assertEqual(2490,
+            len(self.backend.prune_ecu_manifests('88888', keep_last=10)))
+        self.assertEqual(10, len(inventory.get_ecu_manifests('88888')))
+
+
+
+
+
+class TestVehicleManifestIngestion(unittest.TestCase):
+    """
+    Tests of the Director's handling of full Vehicle Manifests, using freshly
+    signed manifests and a separate (SQLite) inventory.
+    """
+
+    def setUp(self):
+        self.backend = inventorydb_backends.SQLiteInventoryBackend(':memory:')
+        inventory.set_backend(self.backend)
+
+        self.primary_key = demo.import_private_key('primary')
+        self.secondary_key = demo.import_private_key('secondary')
+
+        inventory.register_ecu(
+            True, '117', '77777', demo.import_public_key('primary'))
+        inventory.register_ecu(
+            False, '117', '88888', demo.import_public_key('secondary'))
+
+        self.director = director.Director(
+            director_repos_dir=os.path.join(
+                uptane.WORKING_DIR, director_repos_name),
+            key_root_pri=key_root_pri,
+            key_root_pub=key_root_pub,
+            key_timestamp_pri=key_timestamp_pri,
+            key_timestamp_pub=key_timestamp_pub,
+            key_snapshot_pri=key_snapshot_pri,
+            key_snapshot_pub=key_snapshot_pub,
+            key_targets_pri=key_targets_pri,
+            key_targets_pub=key_targets_pub)
+
+
+
+
+
+    def tearDown(self):
+        inventory.set_backend(inventory.memory_backend)
+        self.backend.close()
+
+
+
+
+
+    def make_vehicle_manifest(self):
+        """
+        Returns a Vehicle Manifest signed by the Primary containing, for ECU
+        88888, one valid ECU Manifest, one with a bad signature and one
+        claiming to be from another ECU, and for unknown ECU 99999, one
+        validly signed ECU Manifest.
+        """
+        valid = make_signed_ecu_manifest('88888', self.secondary_key)
+        bad_signature = make_signed_ecu_manifest('88888', self.secondary_key)
+        bad_signature['signed']['attacks_detected'] = 'tampered'
+        spoofed = make_signed_ecu_manifest('99999', self.secondary_key)
+        unknown = make_signed_ecu_manifest('99999', self.secondary_key)
+
+        return uptane.common.sign_signable(tuf.formats.make_signable({
+            'vin': '117',
+            'primary_ecu_serial': '77777',
+            'ecu_version_manifests': {
+                '88888': [valid, bad_signature, spoofed],
+                '99999': [unknown]}}), [self.primary_key])
+
+
+
+
+
+    def test_verify_signatures(self):
+        signable = self.make_vehicle_manifest()
+        primary_key = demo.import_public_key('primary')
+        secondary_key = demo.import_public_key('secondary')
+        ecu_manifests = signable['signed']['ecu_version_manifests']['88888']
+
+        to_verify = [
+            (primary_key, signable['signatures'][0], signable['signed']),
+            (secondary_key, signable['signatures'][0], signable['signed'])]
+        for ecu_manifest in ecu_manifests:
+            to_verify.append((secondary_key, ecu_manifest['signatures'][0],
+                ecu_manifest['signed']))
+
+        self.assertEqual(
+            [tuf.keys.verify_signature(*args) for args in to_verify],
+            uptane.common.verify_signatures(to_verify))
+        self.assertEqual([True, False, True, False, True],
+            uptane.common.verify_signatures(to_verify))
+
+        primary_error, ecu_manifest_errors = \
+            director.verify_vehicle_manifest_signatures(
+                signable, primary_key, {'88888': secondary_key})
+
+        self.assertIsNone(primary_error)
+        self.assertEqual(['88888', '99999'], sorted(ecu_manifest_errors))
+        self.assertIsNone(ecu_manifest_errors['88888'][0])
+        self.assertIsInstance(
+            ecu_manifest_errors['88888'][1], tuf.BadSignatureError)
+        self.assertIsInstance(ecu_manifest_errors['88888'][2], uptane.Spoofing)
+        self.assertIsInstance(
+            ecu_manifest_errors['99999'][0], uptane.UnknownECU)
+
+        primary_error, ecu_manifest_errors = \
+            director.verify_vehicle_manifest_signatures(
+                signable, secondary_key, {'88888': secondary_key})
+        self.assertIsInstance(primary_error, tuf.BadSignatureError)
+
+
+
+
+
+    def test_register_vehicle_manifest(self):
+        signable = self.make_vehicle_manifest()
+
+        self.director.register_vehicle_manifest('117', '77777', signable)
+
+        # Only the valid ECU Manifest was kept.
+        self.assertEqual([signable],
+            inventory.get_vehicle_manifests('117'))
+        self.assertEqual(
+            [signable['signed']['ecu_version_manifests']['88888'][0]],
+            inventory.get_ecu_manifests('88888'))
+
+        # A Vehicle Manifest whose Primary signature is invalid is rejected
+        # entirely.
+        signable = self.make_vehicle_manifest()
+        signable['signed']['ecu_version_manifests'].pop('99999')
+        with self.assertRaises(tuf.BadSignatureError):
+            self.director.register_vehicle_manifest('117', '77777', signable)
+
+        self.assertEqual(1, len(inventory.get_vehicle_manifests('117')))
+        self.assertEqual(1, len(inventory.get_ecu_manifests('88888')))
+
+        signable = self.make_vehicle_manifest()
+        signable['signed']['primary_ecu_serial'] = '99999'
+        with self.assertRaises(uptane.UnknownECU):
+            self.director.register_vehicle_manifest('117', '99999', signable)
+
+
+
+
+
+
+    def test_ingestion_pipeline(self):
+        pipeline = director.ManifestIngestionPipeline(
+            self.director, num_processes=2, max_pending=3)
+
+        try:
+            # Manifests from the same vehicle are committed in the order in
+            # which they were submitted.
+            submitted = [self.make_vehicle_manifest() for i in range(6)]
+            pending = [pipeline.submit('117', '77777', signable)
+                for signable in submitted]
+            for each in pending:
+                each.wait()
+                self.assertTrue(each.done())
+
+            self.assertEqual(submitted, inventory.get_vehicle_manifests('117'))
+            self.assertEqual(
+                [signable['signed']['ecu_version_manifests']['88888'][0]
+                for signable in submitted],
+                inventory.get_ecu_manifests('88888'))
+
+            # Errors are raised as register_vehicle_manifest would raise them.
+            signable = self.make_vehicle_manifest()
+            signable['signed']['ecu_version_manifests'].pop('99999')
+            with self.assertRaises(tuf.BadSignatureError):
+                pipeline.register_vehicle_manifest('117', '77777', signable)
+
+            with self.assertRaises(uptane.UnknownVehicle):
+                pipeline.register_vehicle_manifest(
+                    '118', '77777', self.make_vehicle_manifest())
+
+            pipeline.register_vehicle_manifest(
+                '117', '77777', self.make_vehicle_manifest())
+            self.assertEqual(7, len(inventory.get_vehicle_manifests('117')))
+
+            # A manifest the pool fails to process (here, because the keys
+            # to verify it with cannot be sent to a worker) is finished with
+            # the error, and does not hold up later manifests from the same
+            # vehicle.
+            prepare = self.director._prepare_vehicle_manifest
+            self.director._prepare_vehicle_manifest = \
+                lambda *args: (lambda: 'unpicklable', {})
+            try:
+                failed = pipeline.submit(
+                    '117', '77777', self.make_vehicle_manifest())
+                with self.assertRaises(Exception) as context:
+                    failed.wait(10)
+                # Not the timeout.
+                self.assertNotIsInstance(context.exception, uptane.Error)
+            finally:
+                self.director._prepare_vehicle_manifest = prepare
+
+            pipeline.submit(
+                '117', '77777', self.make_vehicle_manifest()).wait(10)
+            self.assertEqual(8, len(inventory.get_vehicle_manifests('117')))
+
+        finally:
+            pipeline.close()
+
+        with self.assertRaises(uptane.Error):
+            pipeline.submit('117', '77777', self.make_vehicle_manifest())
+
+
+
+
+
+
+    def test_ingestion_pipeline_close_while_submitting(self):
+        pipeline = director.ManifestIngestionPipeline(
+            self.director, num_processes=2)
+
+        # Every manifest that submit() accepts is processed, even if the
+        # pipeline is closed meanwhile; the rest are refused with uptane.Error.
+        accepted = []
+        refused = []
+
+        def submit_repeatedly():
+            for i in range(10):
+                try:
+                    accepted.append(pipeline.submit(
+                        '117', '77777', self.make_vehicle_manifest()))
+                except uptane.Error:
+                    refused.append(i)
+
+        threads = [threading.Thread(target=submit_repeatedly)
+            for i in range(4)]
+        for thread in threads:
+            thread.start()
+        pipeline.close()
+        for thread in threads:
+            thread.join()
+
+        for pending in accepted:
+            pending.wait(10)
+        self.assertEqual(40, len(accepted) + len(refused))
+        self.assertEqual(
+            len(accepted), len(inventory.get_vehicle_manifests('117')))
+
+
+
+
+
+class TestVehicleRepositories(unittest.TestCase):
+    """
+    Tests of the lazily loaded, evictable collection of vehicle repositories
+    used by a Director in shared-root mode, with stand-ins for repositories.
+    """
+
+    def setUp(self):
+        # Each entry is (vin, exists) for a load, or (vin, persist) for an
+        # unload.
+        self.loads = []
+        self.unloads = []
+
+        def load(vin, exists):
+            self.loads.append((vin, exists))
+            return {'vin': vin}
+
+        def unload(vin, repository, persist):
+            self.assertEqual(vin, repository['vin'])
+            self.unloads.append((vin, persist))
+
+        self.repos = director.VehicleRepositories(load, unload, max_loaded=2)
+
+
+
+
+
+    def test_lazy_loading_and_eviction(self):
+        for vin in ['201', '202', '203']:
+            self.repos.add(vin)
+
+        # Nothing is created until used.
+        self.assertEqual([], self.loads)
+        self.assertEqual(['201', '202', '203'], sorted(self.repos))
+        self.assertIn('202', self.repos)
+        self.assertNotIn('204', self.repos)
+        with self.assertRaises(KeyError):
+            self.repos['204']
+
+        self.assertEqual({'vin': '201'}, self.repos['201'])
+        self.repos['202']
+        self.repos['201']
+        self.assertEqual([('201', False), ('202', False)], self.loads)
+        self.assertEqual(['202', '201'], self.repos.loaded_vins())
+
+        # Beyond the limit, the least recently used repository is saved and
+        # dropped, to be loaded (not created) when next used.
+        self.repos['203']
+        self.assertEqual([('202', True)], self.unloads)
+        self.assertEqual(['201', '203'], self.repos.loaded_vins())
+        self.repos['202']
+        self.assertEqual(('202', True), self.loads[-1])
+
+        # Idle repositories can be evicted.
+        self.assertEqual([], self.repos.evict_idle(3600))
+        self.assertEqual(['203', '202'], self.repos.evict_idle(0))
+        self.assertEqual([], self.repos.loaded_vins())
+
+        # Adding a vehicle again discards its repository, unsaved.
+        self.repos['201']
+        self.repos.add('201')
+        self.assertEqual(('201', False), self.unloads[-1])
+        self.repos['201']
+        self.assertEqual(('201', False), self.loads[-1])
+
+
+
+
+
+
+    def test_write_dirty_director_repos(self):
+        writes = []
+
+        class FakeRole(object):
+            expiration = None
+
+        class FakeRepository(object):
+            def __init__(self, vin):
+                self.vin = vin
+                self.timestamp = FakeRole()
+                self.snapshot = FakeRole()
+                self.targets = FakeRole()
+            def write(self):
+                writes.append(self.vin)
+
+        director_instance = director.Director(
+            director_repos_dir=os.path.join(
+                uptane.WORKING_DIR, director_repos_name),
+            key_root_pri=key_root_pri,
+            key_root_pub=key_root_pub,
+            key_timestamp_pri=key_timestamp_pri,
+            key_timestamp_pub=key_timestamp_pub,
+            key_snapshot_pri=key_snapshot_pri,
+            key_snapshot_pub=key_snapshot_pub,
+            key_targets_pri=key_targets_pri,
+            key_targets_pub=key_targets_pub)
+
+        for vin in ['301', '302', '303']:
+            director_instance.vehicle_repositories[vin] = FakeRepository(vin)
+
+        self.assertEqual([], director_instance.write_dirty_director_repos())
+
+        # Only changed repositories are written, once.
+        director_instance.mark_director_repo_dirty('303')
+        director_instance.mark_director_repo_dirty('301')
+        self.assertEqual(
+            ['301', '303'], director_instance.write_dirty_director_repos())
+        self.assertEqual(['301', '303'], writes)
+        self.assertEqual([], director_instance.write_dirty_director_repos())
+
+        # Writes can be restricted to certain vehicles.
+        director_instance.mark_director_repo_dirty('302')
+        director_instance.mark_director_repo_dirty('303')
+        self.assertEqual(
+            ['303'], director_instance.write_dirty_director_repos(['303']))
+        self.assertEqual(set(['302']), director_instance.dirty_vins)
+
+        # A repository that fails to be written stays dirty.
+        del director_instance.vehicle_repositories['302']
+        with self.assertRaises(uptane.UnknownVehicle):
+            director_instance.write_dirty_director_repos()
+        self.assertEqual(set(['302']), director_instance.dirty_vins)
+
+        # Once the clock passes the point where the timestamp metadata of
+        # repositories is due to expire soon, unchanged repositories are
+        # written again, with fresh expirations.
+        director_instance.vehicle_repositories['302'] = FakeRepository('302')
+        director_instance.write_dirty_director_repos()
+        del writes[:]
+        now = time.time()
+        later = now + rt.TIMESTAMP_EXPIRATION - \
+            director.EXPIRATION_REFRESH_MARGIN + 60
+
+        with mock.patch.object(director.time, 'time', return_value=now + 60):
+            self.assertEqual([], director_instance.write_dirty_director_repos())
+
+        with mock.patch.object(director.time, 'time', return_value=later):
+            self.assertEqual(['301', '302', '303'],
+                director_instance.write_dirty_director_repos())
+            self.assertEqual([], director_instance.write_dirty_director_repos())
+
+        self.assertEqual(['301', '302', '303'], writes)
+        repository = director_instance.vehicle_repositories['301']
+        for role, expiration in [
+            (repository.timestamp, rt.TIMESTAMP_EXPIRATION),
+            (repository.snapshot, rt.SNAPSHOT_EXPIRATION),
+            (repository.targets, rt.TARGETS_EXPIRATION)]:
+            self.assertEqual(
+                tuf.formats.unix_timestamp_to_datetime(
+                int(later + expiration)), role.expiration)
+
+
+
+
+
+    def make_shared_root_director(self):
+        return director.Director(
+            director_repos_dir=os.path.join(
+                uptane.WORKING_DIR, director_repos_name),
+            key_root_pri=key_root_pri,
+            key_root_pub=key_root_pub,
+            key_timestamp_pri=key_timestamp_pri,
+            key_timestamp_pub=key_timestamp_pub,
+            key_snapshot_pri=key_snapshot_pri,
+            key_snapshot_pub=key_snapshot_pub,
+            key_targets_pri=key_targets_pri,
+            key_targets_pub=key_targets_pub,
+            shared_root=True)
+
+
+
+
+
+    @unittest.skipUnless(hasattr(tuf.roledb, 'remove_roledb'),
+        'requires the Uptane fork of TUF')
+    def test_eviction_writes_only_dirty_repos(self):
+        director_instance = self.make_shared_root_director()
+        writes = []
+        director_instance._write_director_repo = \
+            lambda repository: writes.append(repository['vin'])
+        director_instance.vehicle_repositories = director.VehicleRepositories(
+            lambda vin, exists: {'vin': vin},
+            director_instance._unload_director_repo, max_loaded=1)
+
+        for vin in ['401', '402']:
+            director_instance.vehicle_repositories.add(vin)
+            director_instance.mark_director_repo_dirty(vin)
+        self.assertEqual(
+            ['401'], director_instance.write_dirty_director_repos(['401']))
+
+        # Evicting an unchanged repository does not write it again; evicting
+        # a changed one writes it, once, and reports it for publication.
+        director_instance.vehicle_repositories['401']
+        director_instance.vehicle_repositories['402']
+        self.assertEqual(['401'], writes)
+        director_instance.vehicle_repositories['401']
+        self.assertEqual(['401', '402'], writes)
+        self.assertEqual(set(), director_instance.dirty_vins)
+
+        self.assertEqual(
+            ['402'], director_instance.write_dirty_director_repos())
+        self.assertEqual(['401', '402'], writes)
+        self.assertEqual([], director_instance.write_dirty_director_repos())
+
+
+
+
+
+    def test_shared_root_key_type(self):
+        # Root metadata can only be shared if its signatures are
+        # deterministic, so other root key types are warned about.
+        with mock.patch.object(director.log, 'warning') as warning:
+            self.make_shared_root_director()
+        self.assertEqual('ed25519', key_root_pub['keytype'])
+        self.assertFalse(warning.called)
+
+        rsa_key_root_pub = dict(key_root_pub, keytype='rsa')
+        with mock.patch.object(director.log, 'warning') as warning:
+            director.Director(
+                director_repos_dir=os.path.join(
+                    uptane.WORKING_DIR, director_repos_name),
+                key_root_pri=key_root_pri,
+                key_root_pub=rsa_key_root_pub,
+                key_timestamp_pri=key_timestamp_pri,
+                key_timestamp_pub=key_timestamp_pub,
+                key_snapshot_pri=key_snapshot_pri,
+                key_snapshot_pub=key_snapshot_pub,
+                key_targets_pri=key_targets_pri,
+                key_targets_pub=key_targets_pub,
+                shared_root=True)
+        self.assertTrue(warning.called)
+
+
+
+
+
+    def test_remove_unused_shared_roots(self):
+        director_instance = self.make_shared_root_director()
+        self.assertEqual([], director_instance.remove_unused_shared_roots())
+
+        shared_root_dir = os.path.join(
+            uptane.WORKING_DIR, director_repos_name, '.shared_root')
+        if os.path.exists(shared_root_dir):
+            shutil.rmtree(shared_root_dir)
+        os.makedirs(shared_root_dir)
+
+        in_use = os.path.join(shared_root_dir, 'aaaa.root.json')
+        unused = os.path.join(shared_root_dir, 'bbbb.root.json')
+        for fname in [in_use, unused]:
+            with open(fname, 'w') as fobj:
+                fobj.write('{}')
+        vehicle_root = os.path.join(shared_root_dir, 'vehicle_root.json')
+        os.link(in_use, vehicle_root)
+
+        try:
+            # Only copies that no vehicle links to are removed.
+            self.assertEqual(
+                [unused], director_instance.remove_unused_shared_roots())
+            self.assertTrue(os.path.exists(in_use))
+
+            os.remove(vehicle_root)
+            self.assertEqual(
+                [in_use], director_instance.remove_unused_shared_roots())
+
+        finally:
+            shutil.rmtree(shared_root_dir)
+
+
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
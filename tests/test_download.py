@@ -0,0 +1,213 @@
+"""
+<Program Name>
+  test_download.py
+
+<Purpose>
+  Unit testing for uptane/clients/download.py, using a local HTTP server that
+  supports Range requests.
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.clients.download as download
+import tuf
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer
+
+IMAGE = b''.join(bytes(bytearray([i % 251])) for i in range(200000))
+IMAGE_HASHES = {
+    'sha256': hashlib.sha256(IMAGE).hexdigest(),
+    'sha512': hashlib.sha512(IMAGE).hexdigest()}
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves IMAGE at any path, honoring Range requests of the form 'bytes=N-'
+  unless the server's honor_ranges is False. If the server's cut_after is not
+  None, the connection is closed after that many bytes of the body are sent.
+  """
+
+  def do_GET(self):
+    self.server.requests.append(self.headers.get('Range'))
+
+    start = 0
+    range_header = self.headers.get('Range')
+    if range_header and self.server.honor_ranges:
+      start = int(range_header[len('bytes='):].split('-')[0])
+
+    body = self.server.image[start:]
+
+    if start:
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes ' + str(start) + '-' +
+          str(len(self.server.image) - 1) + '/' + str(len(self.server.image)))
+    else:
+      self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+
+    if self.server.cut_after is not None:
+      body = body[:self.server.cut_after]
+      self.close_connection = True
+    self.wfile.write(body)
+
+
+  def log_message(self, *args):
+    pass
+
+
+
+
+
+class TestDownload(unittest.TestCase):
+  """
+  "unittest"-style test class for the download module in the reference
+  implementation
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = BaseHTTPServer.HTTPServer(
+        ('localhost', 0), RangeRequestHandler)
+    cls.url = 'http://localhost:' + str(cls.server.server_port) + '/image.img'
+    cls.thread = threading.Thread(target=cls.server.serve_forever)
+    cls.thread.daemon = True
+    cls.thread.start()
+
+
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+
+
+  def setUp(self):
+    self.server.image = IMAGE
+    self.server.honor_ranges = True
+    self.server.cut_after = None
+    self.server.requests = []
+    self.temp_dir = tempfile.mkdtemp()
+    self.fname = os.path.join(self.temp_dir, 'image.img')
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+
+
+  def test_01_init(self):
+
+    with self.assertRaises(tuf.FormatError):
+      download.ResumableDownload(self.fname, -1, IMAGE_HASHES)
+
+    with self.assertRaises(tuf.UnsupportedAlgorithmError):
+      download.ResumableDownload(self.fname, len(IMAGE), {'nohash': 'ab'})
+
+    # A partial file longer than the file cannot be resumed.
+    with open(self.fname + '.partial', 'wb') as fobj:
+      fobj.write(IMAGE + b'x')
+    d = download.ResumableDownload(self.fname, len(IMAGE), IMAGE_HASHES)
+    self.assertEqual(0, d.received)
+    self.assertFalse(os.path.exists(self.fname + '.partial'))
+
+
+
+
+
+  def test_05_interrupted_download_resumes(self):
+
+    # The connection is lost part-way through the download.
+    self.server.cut_after = 70000
+    d = download.ResumableDownload(self.fname, len(IMAGE), IMAGE_HASHES)
+    d.fetch(self.url)
+    self.assertEqual(70000, d.received)
+    with self.assertRaises(tuf.DownloadLengthMismatchError):
+      d.finish()
+    self.assertFalse(os.path.exists(self.fname))
+    self.assertEqual(70000, os.path.getsize(self.fname + '.partial'))
+
+    # A new download (as after a restart) picks up where that one stopped, and
+    # requests only the rest of the file.
+    self.server.cut_after = None
+    d = download.ResumableDownload(self.fname, len(IMAGE), IMAGE_HASHES)
+    self.assertEqual(70000, d.received)
+    d.fetch(self.url)
+    d.finish()
+
+    self.assertEqual([None, 'bytes=70000-'], self.server.requests)
+    self.assertFalse(os.path.exists(self.fname + '.partial'))
+    with open(self.fname, 'rb') as fobj:
+      self.assertEqual(IMAGE, fobj.read())
+
+
+
+
+
+  def test_10_server_ignores_range(self):
+
+    with open(self.fname + '.partial', 'wb') as fobj:
+      fobj.write(IMAGE[:1000])
+
+    self.server.honor_ranges = False
+    download.download_resumably(
+        self.fname, len(IMAGE), IMAGE_HASHES, [self.url])
+
+    with open(self.fname, 'rb') as fobj:
+      self.assertEqual(IMAGE, fobj.read())
+
+
+
+
+
+  def test_15_bad_files_are_rejected(self):
+
+    # A partial file that does not match the image.
+    with open(self.fname + '.partial', 'wb') as fobj:
+      fobj.write(b'x' * 1000)
+
+    with self.assertRaises(tuf.NoWorkingMirrorError) as context:
+      download.download_resumably(
+          self.fname, len(IMAGE), IMAGE_HASHES, [self.url])
+
+    self.assertIsInstance(
+        context.exception.mirror_errors[self.url], tuf.BadHashError)
+    self.assertFalse(os.path.exists(self.fname))
+    self.assertFalse(os.path.exists(self.fname + '.partial'))
+
+    # A server providing more than the trusted length.
+    self.server.image = IMAGE + b'extra'
+    with self.assertRaises(tuf.NoWorkingMirrorError) as context:
+      download.download_resumably(
+          self.fname, len(IMAGE), IMAGE_HASHES, [self.url])
+    self.assertIsInstance(context.exception.mirror_errors[self.url],
+        tuf.DownloadLengthMismatchError)
+    self.assertFalse(os.path.exists(self.fname))
+    self.assertFalse(os.path.exists(self.fname + '.partial'))
+
+    # A mirror that is down is skipped in favor of the next.
+    self.server.image = IMAGE
+    bad_url = 'http://localhost:1/image.img'
+    download.download_resumably(
+        self.fname, len(IMAGE), IMAGE_HASHES, [bad_url, self.url])
+    self.assertTrue(os.path.exists(self.fname))
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,208 @@
+"""
+<Program Name>
+  test_formats.py
+
+<Purpose>
+  Unit testing for uptane/formats.py and the fast-path validation in
+  uptane/fastschema.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.formats
+import uptane.fastschema
+import tuf
+import tuf.schema as SCHEMA
+
+import copy
+import unittest
+
+
+def make_vehicle_manifest(n_ecus):
+  """
+  Returns a signable Vehicle Manifest (with dummy signatures) containing one
+  ECU Manifest for each of n_ecus ECUs.
+  """
+  signature = {'keyid': 'ab' * 32, 'method': 'ed25519', 'sig': 'cd' * 64}
+
+  ecu_manifests = {}
+  for i in range(n_ecus):
+    serial = 'ecu' + str(i)
+    ecu_manifests[serial] = [{
+        'signed': {
+            'ecu_serial': serial,
+            'installed_image': {
+                'filepath': '/firmware_' + str(i) + '.img',
+                'fileinfo': {
+                    'length': 1024 + i,
+                    'hashes': {'sha256': '%064x' % i}}},
+            'timeserver_time': '2017-03-03T17:16:30Z',
+            'previous_timeserver_time': '2017-03-03T17:16:00Z',
+            'attacks_detected': ''},
+        'signatures': [signature]}]
+
+  return {
+      'signed': {
+          'vin': '111',
+          'primary_ecu_serial': 'ecu0',
+          'ecu_version_manifests': ecu_manifests},
+      'signatures': [signature]}
+
+
+
+
+
+class TestFormats(unittest.TestCase):
+  """
+  "unittest"-style test class for the formats module in the reference
+  implementation
+  """
+
+  def tearDown(self):
+    uptane.fastschema.set_fast_validation(True)
+
+
+
+
+
+  def check_same_result(self, schema, object):
+    """
+    Asserts that schema accepts or rejects object the same way (with the same
+    error message, if rejected) with and without fast validation.
+    """
+    results = []
+
+    for fast in [False, True]:
+      uptane.fastschema.set_fast_validation(fast)
+
+      try:
+        schema.check_match(object)
+      except tuf.FormatError as e:
+        results.append(str(e))
+      else:
+        results.append(None)
+
+      self.assertEqual(results[-1] is None, schema.matches(object))
+
+    self.assertEqual(results[0], results[1])
+    return results[1]
+
+
+
+
+
+  def test_01_fast_validation(self):
+
+    schema = uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA
+    manifest = make_vehicle_manifest(3)
+
+    self.assertIsNone(self.check_same_result(schema, manifest))
+
+    # Each of these breaks the manifest in a different part of the schema.
+    def break_vin(m): m['signed']['vin'] = 5
+    def remove_signatures(m): del m['signatures']
+    def break_keyid(m): m['signatures'][0]['keyid'] = 'not hex'
+    def bool_length(m): m['signed']['ecu_version_manifests']['ecu1'][0][
+        'signed']['installed_image']['fileinfo']['length'] = True
+    def negative_length(m): m['signed']['ecu_version_manifests']['ecu1'][0][
+        'signed']['installed_image']['fileinfo']['length'] = -1
+    def break_time(m): m['signed']['ecu_version_manifests']['ecu2'][0][
+        'signed']['timeserver_time'] = '2017-03-03 17:16:30'
+    def ecu_manifest_not_list(m): m['signed']['ecu_version_manifests'][
+        'ecu1'] = m['signed']['ecu_version_manifests']['ecu1'][0]
+    def ecu_serial_not_string(m): m['signed']['ecu_version_manifests'][
+        5] = []
+
+    for breaker in [break_vin, remove_signatures, break_keyid, bool_length,
+        negative_length, break_time, ecu_manifest_not_list,
+        ecu_serial_not_string]:
+      bad_manifest = copy.deepcopy(manifest)
+      breaker(bad_manifest)
+      self.assertIsNotNone(self.check_same_result(schema, bad_manifest),
+          breaker.__name__)
+
+    # Optional keys and other schemas.
+    assignment = {
+        'ecu_serial': 'ecu0',
+        'previous_time': '2017-03-03T17:16:00Z',
+        'current_time': '2017-03-03T17:16:30Z',
+        'installed_image': manifest['signed']['ecu_version_manifests']['ecu0'][
+            0]['signed']['installed_image']}
+    self.assertIsNone(self.check_same_result(
+        uptane.formats.ECU_SOFTWARE_ASSIGNMENT_SCHEMA, assignment))
+    assignment['security_attack'] = 5
+    self.assertIsNotNone(self.check_same_result(
+        uptane.formats.ECU_SOFTWARE_ASSIGNMENT_SCHEMA, assignment))
+
+    self.assertIsNotNone(self.check_same_result(schema, 'not a manifest'))
+
+
+
+
+
+  def test_05_compile_schema(self):
+
+    schema = SCHEMA.OneOf([
+        SCHEMA.String('a'), SCHEMA.LengthBytes(2),
+        SCHEMA.AllOf([SCHEMA.Integer(lo=0, hi=10), SCHEMA.Any()]),
+        SCHEMA.DictOf(SCHEMA.AnyString(), SCHEMA.Boolean()),
+        SCHEMA.Struct([SCHEMA.AnyString()])])
+    matches = uptane.fastschema.compile_schema(schema)
+
+    for object in ['a', 'b', b'ab', b'a', 5, 11, True, {'x': True},
+        {'x': 1}, ['x'], [5], None]:
+      self.assertEqual(schema.matches(object), matches(object), repr(object))
+
+
+
+
+
+  def test_10_validation_session(self):
+
+    schema = uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA
+    ecu_schema = uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA
+    manifest = make_vehicle_manifest(2)
+    ecu_manifest = manifest['signed']['ecu_version_manifests']['ecu1'][0]
+
+    # Outside of a session, nothing is remembered.
+    schema.check_match(manifest)
+    ecu_manifest['signed']['attacks_detected'] = None
+    with self.assertRaises(tuf.FormatError):
+      ecu_schema.check_match(ecu_manifest)
+
+    ecu_manifest['signed']['attacks_detected'] = ''
+
+    with uptane.fastschema.validation_session():
+      schema.check_match(manifest)
+
+      # The signed contents of the manifest and of the ECU Manifests in it are
+      # marked as validated...
+      validated = uptane.fastschema._session.validated
+      self.assertIn((id(uptane.formats.VEHICLE_VERSION_MANIFEST_SCHEMA),
+          id(manifest['signed'])), validated)
+      self.assertIn((id(uptane.formats.ECU_VERSION_MANIFEST_SCHEMA),
+          id(ecu_manifest['signed'])), validated)
+
+      # ... but signables are not, so their signatures are always checked.
+      self.assertNotIn((id(ecu_schema), id(ecu_manifest)), validated)
+      ecu_manifest['signatures'].append('not a signature')
+      with self.assertRaises(tuf.FormatError):
+        ecu_schema.check_match(ecu_manifest)
+      ecu_manifest['signatures'].pop()
+
+      with uptane.fastschema.validation_session():
+        ecu_schema.check_match(ecu_manifest)
+
+      # Nested sessions do not end the outermost one.
+      self.assertIs(validated, uptane.fastschema._session.validated)
+
+    self.assertIsNone(uptane.fastschema._session.validated)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
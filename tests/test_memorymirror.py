@@ -0,0 +1,178 @@
+"""
+<Program Name>
+  test_memorymirror.py
+
+<Purpose>
+  Unit testing for uptane/clients/memorymirror.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.clients.memorymirror as memorymirror
+import tuf
+import tuf.conf
+import tuf.download
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import six
+
+ROOT_METADATA = b'{"signed": {"_type": "Root"}}'
+
+
+class TestMemoryMirror(unittest.TestCase):
+  """
+  "unittest"-style test class for the memorymirror module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.mirror_dir = os.path.join(self.temp_dir, 'unverified')
+    self.root_fname = os.path.join(self.mirror_dir, 'director', 'metadata',
+        'root.json')
+
+    # Secondaries' mirrors are local (see demo/pinned_secondary_template.json).
+    self.supported_uri_schemes = tuf.conf.SUPPORTED_URI_SCHEMES
+    tuf.conf.SUPPORTED_URI_SCHEMES = self.supported_uri_schemes + ['file']
+
+
+
+  def tearDown(self):
+    tuf.conf.SUPPORTED_URI_SCHEMES = self.supported_uri_schemes
+    shutil.rmtree(self.temp_dir)
+
+
+
+  def url(self, fname):
+    return 'file://' + six.moves.urllib.request.pathname2url(fname)
+
+
+
+  def download(self, fname, length):
+    """
+    Returns the contents of the file fname, of the given length, downloaded by
+    TUF.
+    """
+    temp_file = tuf.download.unsafe_download(self.url(fname), length)
+    temp_file.seek(0)
+    return temp_file.read()
+
+
+
+  def write(self, fname, data):
+    if not os.path.exists(os.path.dirname(fname)):
+      os.makedirs(os.path.dirname(fname))
+    with open(fname, 'wb') as fobj:
+      fobj.write(data)
+
+
+
+
+
+  def test_01_serves_files_from_memory(self):
+
+    with self.assertRaises(tuf.FormatError):
+      memorymirror.MemoryMirror(self.mirror_dir,
+          {os.path.join(self.temp_dir, 'elsewhere.json'): b''})
+
+    outside_fname = os.path.join(self.temp_dir, 'outside.json')
+    self.write(outside_fname, b'on disk')
+    self.write(os.path.join(self.mirror_dir, 'on_disk.json'), b'on disk')
+
+    with memorymirror.MemoryMirror(
+        self.mirror_dir, {self.root_fname: ROOT_METADATA}):
+
+      # Files in the mirror are read from memory by TUF.
+      self.assertEqual(ROOT_METADATA,
+          self.download(self.root_fname, len(ROOT_METADATA)))
+      self.assertFalse(os.path.exists(self.root_fname))
+
+      # Files under the mirror directory that are not in memory are missing,
+      # even if they are on disk; files elsewhere are read from disk.
+      with self.assertRaises(six.moves.urllib.error.URLError):
+        self.download(os.path.join(self.mirror_dir, 'on_disk.json'), 7)
+      self.assertEqual(b'on disk', self.download(outside_fname, 7))
+
+      # urllib itself, and other threads, are unaffected.
+      self.assertEqual(b'on disk', six.moves.urllib.request.urlopen(
+          self.url(os.path.join(self.mirror_dir, 'on_disk.json'))).read())
+      downloads = []
+      thread = threading.Thread(target=lambda: downloads.append(
+          self.download(os.path.join(self.mirror_dir, 'on_disk.json'), 7)))
+      thread.start()
+      thread.join()
+      self.assertEqual([b'on disk'], downloads)
+
+    # Afterwards, files are read from disk again.
+    self.assertEqual(b'on disk',
+        self.download(os.path.join(self.mirror_dir, 'on_disk.json'), 7))
+    with self.assertRaises(six.moves.urllib.error.URLError):
+      self.download(self.root_fname, len(ROOT_METADATA))
+
+
+
+
+
+  def test_05_mirrors_in_several_threads(self):
+
+    fnames = [os.path.join(self.mirror_dir, str(i), 'root.json')
+        for i in range(4)]
+    results = []
+    barrier = threading.Barrier(len(fnames), timeout=10)
+
+    def found(fname):
+      try:
+        return self.download(fname, 4) == b'mine'
+      except six.moves.urllib.error.URLError:
+        return False
+
+    def use_mirror(fname):
+      with memorymirror.MemoryMirror(self.mirror_dir, {fname: b'mine'}):
+        # All the mirrors are in use at once.
+        barrier.wait()
+        results.append([found(fname) for fname in fnames].count(True))
+        barrier.wait()
+
+    threads = [threading.Thread(target=use_mirror, args=[fname])
+        for fname in fnames]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    # Each thread found only its own mirror's file.
+    self.assertEqual([1] * len(fnames), results)
+    self.assertIs(tuf.download._get_opener, memorymirror._original_get_opener)
+
+
+
+
+
+
+  def test_10_requires_tuf_get_opener(self):
+
+    # A TUF without the function that MemoryMirror replaces, or with one that
+    # takes other arguments, is refused on import.
+    try:
+      for get_opener in [None, lambda url: None]:
+        with mock.patch.object(tuf.download, '_get_opener', get_opener):
+          with self.assertRaises(uptane.Error):
+            six.moves.reload_module(memorymirror)
+
+    finally:
+      six.moves.reload_module(memorymirror)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,105 @@
+"""
+<Program Name>
+  test_merkle.py
+
+<Purpose>
+  Unit testing for uptane/merkle.py and the batched time attestations built
+  with it (uptane.services.timeserver.get_signed_time_batch and
+  uptane.common.get_attested_nonces)
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import uptane.merkle as merkle
+import uptane.services.timeserver as timeserver
+import tuf
+import tuf.keys
+
+import copy
+import unittest
+
+
+class TestMerkle(unittest.TestCase):
+  """
+  "unittest"-style test class for the merkle module in the reference
+  implementation
+  """
+
+  def test_01_build_tree(self):
+
+    with self.assertRaises(tuf.FormatError):
+      merkle.build_tree([])
+    with self.assertRaises(tuf.FormatError):
+      merkle.hash_leaf([-1])
+
+    # A single leaf is the root.
+    leaf = merkle.hash_leaf([1, 2])
+    root, proofs = merkle.build_tree([leaf])
+    self.assertEqual([[]], proofs)
+    self.assertEqual(root, merkle.root_from_proof(leaf, []))
+
+    # Every leaf of trees of various shapes is proven to be in the tree, and
+    # no other.
+    for n_leaves in [2, 3, 4, 7, 8, 33]:
+      nonce_lists = [[i, i + 1000] for i in range(n_leaves)]
+      leaves = [merkle.hash_leaf(nonces) for nonces in nonce_lists]
+      root, proofs = merkle.build_tree(leaves)
+
+      for leaf, proof in zip(leaves, proofs):
+        self.assertEqual(root, merkle.root_from_proof(leaf, proof))
+        self.assertNotEqual(root, merkle.root_from_proof(
+            merkle.hash_leaf([5000]), proof))
+
+    # The order of the nonces in a leaf matters.
+    self.assertNotEqual(merkle.hash_leaf([1, 2]), merkle.hash_leaf([2, 1]))
+
+    with self.assertRaises(tuf.FormatError):
+      merkle.root_from_proof(leaf, [{'side': 'up', 'hash': '00'}])
+
+
+
+
+
+  def test_05_batched_time_attestations(self):
+
+    key = tuf.keys.generate_ed25519_key()
+    timeserver.set_timeserver_key(key)
+
+    nonce_lists = [[1, 2], [3], [], [4, 5, 6]]
+    attestations = timeserver.get_signed_time_batch(nonce_lists)
+
+    self.assertEqual(len(nonce_lists), len(attestations))
+
+    for nonces, attestation in zip(nonce_lists, attestations):
+      self.assertEqual(attestations[0]['signed'], attestation['signed'])
+      self.assertTrue(uptane.common.verify_signature(
+          key, attestation['signatures'][0], attestation['signed']))
+      self.assertEqual(nonces, uptane.common.get_attested_nonces(attestation))
+
+    # Nonces not in the signed tree are not attested to.
+    attestation = copy.deepcopy(attestations[0])
+    attestation['nonces'].append(3)
+    with self.assertRaises(uptane.BadTimeAttestation):
+      uptane.common.get_attested_nonces(attestation)
+
+    attestation = copy.deepcopy(attestations[0])
+    attestation['merkle_proof'] = attestations[1]['merkle_proof']
+    with self.assertRaises(uptane.BadTimeAttestation):
+      uptane.common.get_attested_nonces(attestation)
+
+    # Unbatched attestations attest to their signed nonces.
+    self.assertEqual([7, 8], uptane.common.get_attested_nonces(
+        timeserver.get_signed_time([7, 8])))
+
+    with self.assertRaises(tuf.FormatError):
+      uptane.common.get_attested_nonces({'signed': {}, 'signatures': []})
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
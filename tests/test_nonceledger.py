@@ -0,0 +1,89 @@
+"""
+<Program Name>
+  test_nonceledger.py
+
+<Purpose>
+  Unit testing for uptane/clients/nonceledger.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.clients.nonceledger as nonceledger
+import tuf
+
+import unittest
+
+TIME = '2017-03-03T17:16:30Z'
+DAY_LATER = '2017-03-04T17:16:30Z'
+
+
+class TestNonceLedger(unittest.TestCase):
+  """
+  "unittest"-style test class for the nonceledger module in the reference
+  implementation
+  """
+
+  def test_01_add_and_rotate(self):
+
+    ledger = nonceledger.NonceLedger()
+    self.assertEqual([], ledger.to_send)
+    self.assertEqual([], ledger.sent)
+
+    with self.assertRaises(tuf.FormatError):
+      ledger.add(-1, TIME)
+    with self.assertRaises(tuf.FormatError):
+      ledger.add(5, 'not a time')
+
+    # A nonce added again is listed once, in the place of the latest addition.
+    for nonce in [5, 6, 5, 7]:
+      ledger.add(nonce, TIME)
+    self.assertEqual([6, 5, 7], ledger.to_send)
+
+    self.assertEqual([6, 5, 7], ledger.rotate())
+    self.assertEqual([6, 5, 7], ledger.sent)
+    self.assertEqual([], ledger.to_send)
+
+    self.assertEqual([], ledger.missing([1, 7, 6, 5]))
+    self.assertEqual([6, 7], ledger.missing([5]))
+
+    self.assertEqual([], ledger.rotate())
+    self.assertEqual([], ledger.missing([]))
+
+
+
+
+
+  def test_05_bounds(self):
+
+    ledger = nonceledger.NonceLedger(max_nonces=3, max_age=60)
+
+    for nonce in range(5):
+      ledger.add(nonce, TIME)
+    self.assertEqual([2, 3, 4], ledger.to_send)
+
+    # Nonces are dropped once they are too old by a Timeserver time.
+    ledger.add(5, DAY_LATER)
+    ledger.expire(TIME)
+    self.assertEqual([3, 4, 5], ledger.to_send)
+    ledger.expire(DAY_LATER)
+    self.assertEqual([5], ledger.to_send)
+
+
+
+
+
+  def test_10_missing_nonces(self):
+
+    self.assertEqual([], nonceledger.missing_nonces([], [1, 2]))
+    self.assertEqual([3, 1], nonceledger.missing_nonces([3, 2, 1], [2]))
+    self.assertEqual([], nonceledger.missing_nonces(
+        range(1000), reversed(range(1000))))
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -19,12 +19,16 @@ import tuf
 import tuf.formats
 import tuf.client.updater # to test one of the fields in the Primary object
 import tuf.keys # to validate a signature
+import tuf.util # for target path hashes
 
 import unittest
 import os.path
 import time
 import copy
 import shutil
+import io
+import json
+import zipfile
 
 # For temporary convenience:
 import demo # for generate_key, import_public_key, import_private_key
@@ -243,6 +247,18 @@ class TestPrimary(unittest.TestCase):
           timeserver_public_key=clock, # INVALID
           my_secondaries=[])
 
+    # Invalid number of download threads
+    with self.assertRaises(tuf.FormatError):
+      p = primary.Primary(
+          full_client_dir=os.path.join(TEST_DATA_DIR, client_directory_name),
+          director_repo_name=demo.DIRECTOR_REPO_NAME,
+          vin=vin,
+          ecu_serial=primary_ecu_serial,
+          primary_key=primary_ecu_key, time=clock,
+          timeserver_public_key=key_timeserver_pub,
+          my_secondaries=[],
+          download_threads=-1) # INVALID
+
 
 
     # Try creating a Primary, expecting it to work.
@@ -274,6 +290,11 @@ class TestPrimary(unittest.TestCase):
     self.assertIsInstance(primary_instance.updater, tuf.client.updater.Updater)
     tuf.formats.ANYKEY_SCHEMA.check_match(primary_instance.timeserver_public_key)
     self.assertEqual([], primary_instance.my_secondaries)
+    self.assertEqual(1, primary_instance.download_threads)
+    self.assertEqual({}, primary_instance.download_timings)
+    self.assertIsNone(primary_instance.get_metadata_fingerprint())
+    self.assertTrue(primary_instance.metadata_changed_since(None))
+    self.assertFalse(primary_instance.per_ecu_metadata_archives)
 
 
 
@@ -289,6 +310,12 @@ class TestPrimary(unittest.TestCase):
 
     self.assertIn('1352', primary_instance.my_secondaries)
 
+    # There is no metadata to distribute to it before an update cycle.
+    with self.assertRaises(uptane.UnknownECU):
+      primary_instance.get_metadata_archive_for_ecu('unknown')
+    with self.assertRaises(uptane.Error):
+      primary_instance.get_metadata_archive_for_ecu('1352')
+
 
 
 
@@ -522,7 +549,125 @@ class TestPrimary(unittest.TestCase):
 
 
   def test_50_get_metadata_for_ecu(self):
-    pass
+
+    global primary_instance
+
+    target_filepath = 'firmware/ecu.img'
+    target_hash = tuf.util.get_target_hash(target_filepath)
+    other_prefix = '0' if target_hash[0] != '0' else '1'
+
+    def role(*delegated_roles):
+      return json.dumps({'signed': {'delegations': {
+          'roles': list(delegated_roles)}}}).encode('utf-8')
+
+    # The OEM repository delegates by paths (including globs), with a further
+    # delegation beneath, and by path hash prefixes.
+    full_roles = {
+        'director/metadata/root.json': b'{}',
+        'director/metadata/timestamp.json': b'{}',
+        'director/metadata/snapshot.json': b'{}',
+        'director/metadata/targets.json': role(),
+        'mainrepo/metadata/root.json': b'{}',
+        'mainrepo/metadata/timestamp.json': b'{}',
+        'mainrepo/metadata/snapshot.json': b'{}',
+        'mainrepo/metadata/targets.json': role(
+            {'name': 'firmware', 'paths': ['firmware/']},
+            {'name': 'maps', 'paths': ['maps/*']},
+            {'name': 'hashed', 'path_hash_prefixes': [target_hash[:2]]},
+            {'name': 'other_hashed', 'path_hash_prefixes': [other_prefix]}),
+        'mainrepo/metadata/firmware.json': role(
+            {'name': 'ecu_images', 'paths': ['*.img']},
+            {'name': 'other_images', 'paths': ['firmware/other.img']}),
+        'mainrepo/metadata/maps.json': role(),
+        'mainrepo/metadata/hashed.json': role(),
+        'mainrepo/metadata/other_hashed.json': role(),
+        'mainrepo/metadata/ecu_images.json': role(),
+        'mainrepo/metadata/other_images.json': role(),
+        'mainrepo/metadata/undelegated.json': role()}
+
+    def write_full_archive(roles):
+      archive_fname = primary_instance.distributable_full_metadata_archive_fname
+      if not os.path.exists(os.path.dirname(archive_fname)):
+        os.makedirs(os.path.dirname(archive_fname))
+      with zipfile.ZipFile(archive_fname, 'w') as archive:
+        for name, data in roles.items():
+          archive.writestr(name, data)
+
+    def archived_roles(ecu_serial):
+      archive = zipfile.ZipFile(io.BytesIO(
+          primary_instance.get_metadata_archive_for_ecu(ecu_serial)))
+      return dict((name, archive.read(name)) for name in archive.namelist())
+
+    write_full_archive(full_roles)
+
+    # Without per-ECU archives, the full archive is distributed.
+    self.assertEqual(full_roles, archived_roles('1352'))
+
+    primary_instance.per_ecu_metadata_archives = True
+    primary_instance.assigned_targets['1352'] = {
+        'filepath': target_filepath, 'fileinfo': {}}
+
+    try:
+      # Only the delegated roles that may list the ECU's target are kept,
+      # unmodified, along with each repository's top-level roles.
+      relevant_roles = ['firmware', 'ecu_images', 'hashed']
+      expected_roles = dict((name, data)
+          for name, data in full_roles.items()
+          if name.split('/metadata/')[1][:-len('.json')] in
+          ['root', 'timestamp', 'snapshot', 'targets'] + relevant_roles)
+      self.assertEqual(expected_roles, archived_roles('1352'))
+
+      # The archive is kept until the update cycle replaces the metadata or
+      # target assignments.
+      del primary_instance.assigned_targets['1352']
+      self.assertEqual(expected_roles, archived_roles('1352'))
+
+      write_full_archive(full_roles)
+      primary_instance._ecu_metadata_archives = dict()
+      self.assertEqual(
+          sorted(name for name in full_roles if name.split('/metadata/')[1]
+          in ['root.json', 'timestamp.json', 'snapshot.json', 'targets.json']),
+          sorted(archived_roles('1352')))
+
+    finally:
+      primary_instance.per_ecu_metadata_archives = False
+      primary_instance.assigned_targets.pop('1352', None)
+      primary_instance._ecu_metadata_archives = dict()
+      os.remove(primary_instance.distributable_full_metadata_archive_fname)
+
+
+
+
+
+  def test_55_role_may_list_target(self):
+
+    target_filepath = 'firmware/ecu.img'
+    target_hash = tuf.util.get_target_hash(target_filepath)
+    other_prefix = '0' if target_hash[0] != '0' else '1'
+
+    # By paths: directories, files and glob patterns.
+    for paths in [['firmware/'], [target_filepath], ['firmware/*.img'],
+        ['maps/', '*.img']]:
+      self.assertTrue(primary._role_may_list_target(
+          {'name': 'role1', 'paths': paths}, target_filepath))
+
+    for paths in [[], ['maps/'], ['firmware/other.img'], ['*.zip']]:
+      self.assertFalse(primary._role_may_list_target(
+          {'name': 'role1', 'paths': paths}, target_filepath))
+
+    # By path hash prefixes, which take precedence over any paths.
+    for prefixes in [[target_hash[:1]], [target_hash[:8]],
+        [other_prefix, target_hash[:4]]]:
+      self.assertTrue(primary._role_may_list_target({'name': 'role1',
+          'path_hash_prefixes': prefixes, 'paths': []}, target_filepath))
+
+    for prefixes in [[], [other_prefix]]:
+      self.assertFalse(primary._role_may_list_target({'name': 'role1',
+          'path_hash_prefixes': prefixes, 'paths': ['firmware/']},
+          target_filepath))
+
+    self.assertFalse(primary._role_may_list_target(
+        {'name': 'role1'}, target_filepath))
 
 
 
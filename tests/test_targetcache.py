@@ -0,0 +1,164 @@
+"""
+<Program Name>
+  test_targetcache.py
+
+<Purpose>
+  Unit testing for uptane/clients/targetcache.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.clients.targetcache as targetcache
+import tuf
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+IMAGE = b'firmware image ' * 1000
+IMAGE_HASHES = {
+    'sha256': hashlib.sha256(IMAGE).hexdigest(),
+    'sha512': hashlib.sha512(IMAGE).hexdigest()}
+
+
+class TestTargetCache(unittest.TestCase):
+  """
+  "unittest"-style test class for the targetcache module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.index_fname = os.path.join(self.temp_dir, 'target_cache.json')
+    self.fname = os.path.join(self.temp_dir, 'targets', 'image.img')
+    os.makedirs(os.path.dirname(self.fname))
+    with open(self.fname, 'wb') as fobj:
+      fobj.write(IMAGE)
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+
+
+  def test_01_matches(self):
+
+    cache = targetcache.TargetCache(self.index_fname)
+
+    with self.assertRaises(tuf.FormatError):
+      cache.matches(self.fname, -1, IMAGE_HASHES)
+
+    self.assertTrue(cache.matches(self.fname, len(IMAGE), IMAGE_HASHES))
+    self.assertFalse(cache.matches(self.fname, len(IMAGE) + 1, IMAGE_HASHES))
+    self.assertFalse(cache.matches(self.fname, len(IMAGE),
+        {'sha256': hashlib.sha256(b'other').hexdigest()}))
+    self.assertFalse(cache.matches(self.fname, len(IMAGE), {'nohash': 'ab'}))
+    self.assertFalse(cache.matches(
+        self.fname + '.missing', len(IMAGE), IMAGE_HASHES))
+
+    # The hashes are indexed, and persisted once saved.
+    entry = cache.index[os.path.abspath(self.fname)]
+    self.assertEqual(IMAGE_HASHES, entry['hashes'])
+    self.assertFalse(os.path.exists(self.index_fname))
+    cache.save()
+    self.assertEqual(
+        cache.index, targetcache.TargetCache(self.index_fname).index)
+
+
+
+
+
+  def test_05_index_is_used_until_file_changes(self):
+
+    cache = targetcache.TargetCache(self.index_fname)
+    cache.record(self.fname, IMAGE_HASHES)
+
+    # An unchanged file is not hashed again: the indexed hashes are used, even
+    # if (as here, contrived) they are not those of the file's contents.
+    fake_hashes = {'sha256': hashlib.sha256(b'other').hexdigest()}
+    cache.index[os.path.abspath(self.fname)]['hashes'] = fake_hashes
+    self.assertTrue(cache.matches(self.fname, len(IMAGE), fake_hashes))
+
+    # A change in modification time causes the file to be hashed again.
+    stat = os.stat(self.fname)
+    os.utime(self.fname, (stat.st_atime, stat.st_mtime + 10))
+    self.assertFalse(cache.matches(self.fname, len(IMAGE), fake_hashes))
+    self.assertTrue(cache.matches(self.fname, len(IMAGE), IMAGE_HASHES))
+
+
+
+
+
+  def test_10_find(self):
+
+    cache = targetcache.TargetCache(self.index_fname)
+    self.assertIsNone(cache.find(len(IMAGE), IMAGE_HASHES))
+
+    cache.record(self.fname, IMAGE_HASHES)
+    self.assertEqual(os.path.abspath(self.fname),
+        cache.find(len(IMAGE), {'sha256': IMAGE_HASHES['sha256']}))
+    self.assertIsNone(cache.find(len(IMAGE) - 1, IMAGE_HASHES))
+
+    # A file that has since changed is not found.
+    with open(self.fname, 'wb') as fobj:
+      fobj.write(b'changed')
+    self.assertIsNone(cache.find(len(IMAGE), IMAGE_HASHES))
+
+
+
+
+
+  def test_15_saving(self):
+
+    cache = targetcache.TargetCache(self.index_fname)
+    cache.record(self.fname, IMAGE_HASHES)
+    cache.save()
+
+    # The index is not written again unless it has changed.
+    os.remove(self.index_fname)
+    cache.save()
+    self.assertFalse(os.path.exists(self.index_fname))
+
+    cache.forget(self.fname)
+    cache.forget(self.fname + '.missing')
+    cache.save()
+    self.assertEqual({}, targetcache.TargetCache(self.index_fname).index)
+
+
+
+
+
+  def test_20_unusable_index(self):
+
+    for contents in ['not json', '[]', '{"file": []}', '{"file": {}}',
+        '{"file": {"length": 5, "mtime": 1.5}}',
+        '{"file": {"length": -1, "mtime": 1.5, "hashes": {}}}',
+        '{"file": {"length": 5, "mtime": "1", "hashes": {}}}',
+        '{"file": {"length": 5, "mtime": 1.5, "hashes": []}}']:
+      with open(self.index_fname, 'w') as fobj:
+        fobj.write(contents)
+
+      # The cache starts over, and works as usual.
+      cache = targetcache.TargetCache(self.index_fname)
+      self.assertEqual({}, cache.index)
+      self.assertIsNone(cache.find(len(IMAGE), IMAGE_HASHES))
+      self.assertTrue(cache.matches(self.fname, len(IMAGE), IMAGE_HASHES))
+
+    with open(self.index_fname, 'w') as fobj:
+      fobj.write('{"file": {"length": 5, "mtime": 1.5, "hashes": {}}}')
+    self.assertEqual({'file': {'length': 5, 'mtime': 1.5, 'hashes': {}}},
+        targetcache.TargetCache(self.index_fname).index)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,126 @@
+"""
+<Program Name>
+  test_timehistory.py
+
+<Purpose>
+  Unit testing for uptane/clients/timehistory.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.clients.timehistory as timehistory
+import tuf
+
+import os
+import shutil
+import tempfile
+import unittest
+
+TIMES = ['2017-03-03T17:16:' + str(second) + 'Z' for second in range(10, 30)]
+
+
+class TestTimeHistory(unittest.TestCase):
+  """
+  "unittest"-style test class for the timehistory module in the reference
+  implementation
+  """
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.fname = os.path.join(self.temp_dir, 'timeserver_times.json')
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+
+
+
+
+  def test_01_bounded_like_a_list(self):
+
+    with self.assertRaises(tuf.FormatError):
+      timehistory.TimeHistory([])
+    with self.assertRaises(tuf.FormatError):
+      timehistory.TimeHistory(TIMES[:3], depth=2)
+    with self.assertRaises(tuf.FormatError):
+      timehistory.TimeHistory(['not a time'])
+
+    times = timehistory.TimeHistory(TIMES[:2], depth=3)
+    self.assertEqual(TIMES[:2], times)
+    self.assertEqual(TIMES[1], times[-1])
+
+    with self.assertRaises(tuf.FormatError):
+      times.append('not a time')
+
+    for time in TIMES[2:]:
+      times.append(time)
+
+    # Only the latest depth times are kept.
+    self.assertEqual(TIMES[-3:], times)
+    self.assertEqual(3, len(times))
+    self.assertEqual(TIMES[-2], times[-2])
+    self.assertIn(TIMES[-1], times)
+    self.assertNotIn(TIMES[0], times)
+    self.assertNotEqual(TIMES[:3], times)
+
+    # Nothing is saved unless a file is given.
+    self.assertFalse(os.listdir(self.temp_dir))
+
+
+
+
+
+  def test_05_persistence(self):
+
+    times = timehistory.TimeHistory(TIMES[:2], depth=4, fname=self.fname)
+    # Nothing is saved until a time is added.
+    self.assertFalse(os.path.exists(self.fname))
+
+    for time in TIMES[2:7]:
+      times.append(time)
+
+    # A history made with the same file resumes from the saved times rather
+    # than the initial times.
+    reloaded = timehistory.TimeHistory(TIMES[:2], depth=4, fname=self.fname)
+    self.assertEqual(TIMES[3:7], reloaded)
+
+    # A shallower history keeps only the latest saved times.
+    reloaded = timehistory.TimeHistory(TIMES[:2], depth=2, fname=self.fname)
+    self.assertEqual(TIMES[5:7], reloaded)
+
+    # If fewer times were saved than given initially, the earliest saved time
+    # is repeated in their place.
+    os.remove(self.fname)
+    times = timehistory.TimeHistory([TIMES[0]], depth=4, fname=self.fname)
+    times.append(TIMES[10])
+    reloaded = timehistory.TimeHistory(TIMES[:3], depth=4, fname=self.fname)
+    self.assertEqual([TIMES[0], TIMES[0], TIMES[10]], reloaded)
+
+
+
+
+
+  def test_10_unreadable_file(self):
+
+    for contents in ['not json', '{"a": 1}', '["not a time"]', '[5]']:
+      with open(self.fname, 'w') as fobj:
+        fobj.write(contents)
+
+      times = timehistory.TimeHistory(TIMES[:2], fname=self.fname)
+      self.assertEqual(TIMES[:2], times)
+
+      # The file is replaced once a time is added.
+      times.append(TIMES[2])
+      self.assertEqual(TIMES[:3],
+          timehistory.TimeHistory(TIMES[:2], fname=self.fname))
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
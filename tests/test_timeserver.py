@@ -0,0 +1,85 @@
+"""
+<Program Name>
+  test_timeserver.py
+
+<Purpose>
+  Unit testing for uptane/services/timeserver.py
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import uptane.formats
+import uptane.services.timeserver as timeserver
+import tuf
+import tuf.keys
+
+import unittest
+
+
+class TestTimeserver(unittest.TestCase):
+  """
+  "unittest"-style test class for the timeserver module in the reference
+  implementation
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.key = tuf.keys.generate_ed25519_key()
+    timeserver.set_timeserver_key(cls.key)
+
+
+
+  def tearDown(self):
+    timeserver.set_tick_mode(False)
+
+
+
+
+
+  def test_01_get_signed_time(self):
+
+    for tick_mode in [False, True]:
+      timeserver.set_tick_mode(tick_mode)
+
+      for nonces in [[], [5], [0, 1, uptane.formats.NONCE_UPPER_BOUND]]:
+        attestation = timeserver.get_signed_time(nonces)
+        uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+            attestation)
+        self.assertEqual(nonces, attestation['signed']['nonces'])
+        self.assertTrue(uptane.common.verify_signature(
+            self.key, attestation['signatures'][0], attestation['signed']))
+
+      for bad_nonces in [5, [True], ['5'], [-1]]:
+        with self.assertRaises(tuf.FormatError):
+          timeserver.get_signed_time(bad_nonces)
+
+
+
+
+
+  def test_05_tick_mode_gives_same_attestations(self):
+
+    nonces = [17, 2, 3000]
+
+    # ed25519 signatures are deterministic, so attestations made in the same
+    # second are identical with and without tick mode. (Retry if the second
+    # changes in between.)
+    for attempt in range(5):
+      timeserver.set_tick_mode(False)
+      attestation = timeserver.get_signed_time(nonces)
+      timeserver.set_tick_mode(True)
+      tick_attestation = timeserver.get_signed_time(nonces)
+      if attestation['signed']['time'] == tick_attestation['signed']['time']:
+        break
+
+    self.assertEqual(attestation, tick_attestation)
+
+
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
@@ -47,6 +47,13 @@ class BadTimeAttestation(Error):
   """
   pass
 
+class BadDelta(Error):
+  """
+  Received an image delta (see uptane/delta.py) that is malformed or that does
+  not apply to the image it is applied to.
+  """
+  pass
+
 
 # Logging configuration
 
@@ -0,0 +1,418 @@
+"""
+<Program Name>
+  asyncxmlrpc.py
+
+<Purpose>
+  An XML-RPC server on asyncio, for Uptane services that must handle many
+  clients at once. It speaks the same protocol as the SimpleXMLRPCServer the
+  demo services otherwise use, so clients (xmlrpc_client.ServerProxy) need no
+  change, but requests are handled concurrently: a function registered as a
+  coroutine function runs on the event loop, and any other function runs in
+  a thread pool, so a slow request does not hold up the others.
+
+  Requests are HTTP POSTs to one of the server's RPC paths (by default,
+  '/RPC2'). Connections are kept alive between requests (as ServerProxy
+  expects), and closed if the client takes longer than request_timeout to
+  send a request, or to receive any part of a response. Errors raised by the
+  registered functions are returned to the client as XML-RPC faults, as
+  SimpleXMLRPCServer does.
+
+  Registered functions may return StreamedBinary values (also inside lists,
+  tuples and dicts) in place of xmlrpc_client.Binary values, to send the
+  contents of a file without reading it all into memory: the file is read and
+  sent a chunk at a time, only as quickly as the client receives it. The
+  client receives an ordinary xmlrpc_client.Binary.
+
+  Requires Python 3.7 or later.
+
+  Use:
+    server = AsyncXMLRPCServer('localhost', 30701)
+    server.register_function(get_signed_time, 'get_signed_time')
+    server.serve_forever()
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+
+import os
+import re
+import base64
+import asyncio
+import concurrent.futures
+
+from six.moves import xmlrpc_client
+
+log = uptane.logging.getLogger('asyncxmlrpc')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# The longest a client may take to send a request (or, between requests on a
+# connection kept alive, to start the next one), in seconds.
+REQUEST_TIMEOUT = 30
+
+# The largest request body accepted, in bytes.
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+# The largest number of threads running registered functions that are not
+# coroutine functions at once.
+MAX_THREADS = 16
+
+# The number of bytes of a StreamedBinary's file read and sent at a time (a
+# multiple of 3, so that each chunk is base64-encoded on its own).
+STREAM_CHUNK_SIZE = 3 * 64 * 1024
+
+# Stands in for a StreamedBinary's data in a marshalled response. (As '<' is
+# always escaped in marshalled data, this cannot appear in it otherwise.)
+_STREAM_MARKER = re.compile('<stream:([0-9]+)/>')
+
+_STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+    413: 'Request Entity Too Large'}
+
+
+
+class AsyncXMLRPCServer(object):
+  """
+  An XML-RPC server on asyncio. See the module docstring.
+
+  Fields:
+
+    host, port
+      The address the server listens on.
+
+    rpc_paths
+      The HTTP paths at which XML-RPC requests are accepted.
+
+    request_timeout
+      The longest a client may take to send a request, in seconds.
+
+    functions
+      A dict mapping the name of each function clients can call to the
+      function.
+
+    executor
+      The concurrent.futures.Executor that registered functions that are not
+      coroutine functions are run in.
+
+    allow_none
+      Whether None may be sent in responses (an XML-RPC extension, as with
+      SimpleXMLRPCServer's allow_none).
+  """
+
+  def __init__(self, host, port, rpc_paths=('/RPC2',),
+      request_timeout=REQUEST_TIMEOUT, max_threads=MAX_THREADS,
+      allow_none=False):
+
+    self.host = host
+    self.port = port
+    self.rpc_paths = rpc_paths
+    self.request_timeout = request_timeout
+    self.allow_none = allow_none
+    self.functions = {}
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_threads)
+
+
+
+  def register_function(self, function, name=None):
+    """
+    Lets clients call the given function (a coroutine function or a regular
+    one) by the given name (by default, the function's name).
+    """
+    self.functions[name or function.__name__] = function
+
+
+
+  async def start(self):
+    """
+    Starts listening, returning the asyncio server.
+    """
+    return await asyncio.start_server(
+        self._handle_connection, self.host, self.port)
+
+
+
+  def serve_forever(self):
+    """
+    Runs an event loop that serves requests until interrupted.
+    """
+    async def serve():
+      server = await self.start()
+      async with server:
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+
+  async def call(self, name, params):
+    """
+    Calls the registered function with the given name and parameters (a
+    tuple), returning its result.
+    """
+    if name not in self.functions:
+      raise Exception('method "' + name + '" is not supported')
+
+    function = self.functions[name]
+
+    if asyncio.iscoroutinefunction(function):
+      return await function(*params)
+
+    return await asyncio.get_running_loop().run_in_executor(
+        self.executor, function, *params)
+
+
+
+  async def _handle_connection(self, reader, writer):
+    """
+    Serves the requests on one connection, until the client closes it, a
+    request is malformed, or the client times out.
+    """
+    try:
+      while True:
+        try:
+          request = await asyncio.wait_for(
+              self._read_request(reader), self.request_timeout)
+        except asyncio.TimeoutError:
+          log.debug('Closing idle XML-RPC connection.')
+          break
+
+        if request is None:
+          break
+
+        status, keep_alive, body = request
+
+        if status == 200:
+          parts = await self._dispatch(body)
+        else:
+          keep_alive = False
+          parts = [b'']
+
+        await self._write_response(writer, status, keep_alive, parts)
+
+        if not keep_alive:
+          break
+
+    except asyncio.TimeoutError:
+      log.debug('Closing XML-RPC connection to a client too slow to receive '
+          'its response.')
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+
+    finally:
+      writer.close()
+
+
+
+  async def _read_request(self, reader):
+    """
+    Reads an HTTP request, returning (status, keep_alive, body), where status
+    is the HTTP status to respond with if not 200, or None if the connection
+    was closed before a request began.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+      return None
+
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+
+    try:
+      method, path, version = request_line.decode('latin-1').split()
+      length = int(headers.get('content-length', '0'))
+    except ValueError:
+      return 400, False, b''
+
+    keep_alive = version == 'HTTP/1.1' and \
+        headers.get('connection', '').lower() != 'close'
+
+    if length > MAX_REQUEST_SIZE:
+      return 413, False, b''
+
+    body = await reader.readexactly(length)
+
+    if method != 'POST' or path not in self.rpc_paths:
+      return 404, keep_alive, b''
+
+    return 200, keep_alive, body
+
+
+
+  async def _dispatch(self, body):
+    """
+    Returns the XML-RPC response to the given XML-RPC request, as a list of
+    parts to send in order: bytes, and the StreamedBinary values in the
+    response, in place of their data.
+    """
+    try:
+      params, name = xmlrpc_client.loads(body)
+      return self._marshal((await self.call(name, params),))
+
+    except xmlrpc_client.Fault as fault:
+      return self._marshal(fault)
+
+    except Exception as e:
+      # As SimpleXMLRPCServer reports errors.
+      return self._marshal(xmlrpc_client.Fault(1, '%s:%s' % (type(e), e)))
+
+
+
+  def _marshal(self, response):
+    """
+    Returns the given response (a tuple of one result, or an
+    xmlrpc_client.Fault) as a list of parts, as _dispatch does.
+    """
+    marshaller = _StreamingMarshaller('utf-8', self.allow_none)
+
+    try:
+      data = marshaller.dumps(response)
+
+    except Exception as e:
+      for stream in marshaller.streams:
+        stream.close()
+      return self._marshal(xmlrpc_client.Fault(1, '%s:%s' % (type(e), e)))
+
+    pieces = _STREAM_MARKER.split("<?xml version='1.0'?>\n"
+        '<methodResponse>\n' + data + '</methodResponse>\n')
+
+    # The pieces alternate between marshalled data and stream indices.
+    parts = []
+    for i, piece in enumerate(pieces):
+      if i % 2:
+        parts.append(marshaller.streams[int(piece)])
+      else:
+        parts.append(piece.encode('utf-8'))
+
+    return parts
+
+
+
+  async def _write_response(self, writer, status, keep_alive, parts):
+    """
+    Writes an HTTP response with the given status and body (a list of parts,
+    as returned by _dispatch) to the client, streaming the data of any
+    StreamedBinary parts.
+    """
+    streams = [part for part in parts if isinstance(part, StreamedBinary)]
+
+    try:
+      length = sum(part.encoded_size() if isinstance(part, StreamedBinary)
+          else len(part) for part in parts)
+
+      headers = [
+          'HTTP/1.1 ' + str(status) + ' ' + _STATUS_TEXT[status],
+          'Content-Type: text/xml',
+          'Content-Length: ' + str(length),
+          'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+
+      writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+
+      for part in parts:
+        if isinstance(part, StreamedBinary):
+          await self._write_stream(writer, part)
+        else:
+          writer.write(part)
+          await asyncio.wait_for(writer.drain(), self.request_timeout)
+
+    finally:
+      for stream in streams:
+        stream.close()
+
+
+
+  async def _write_stream(self, writer, stream):
+    """
+    Writes the base64-encoded data of the given StreamedBinary to the client,
+    a chunk at a time.
+    """
+    loop = asyncio.get_running_loop()
+    remaining = stream.size
+
+    while remaining:
+      # Files are read in the event loop's default executor rather than in
+      # self.executor, so that reads are not held up by slow functions.
+      chunk = await loop.run_in_executor(None, stream.fobj.read,
+          min(STREAM_CHUNK_SIZE, remaining))
+
+      if not chunk:
+        # The response's length has already been sent, so the client can
+        # only be told of the error by closing the connection.
+        raise ConnectionError('File to send is shorter than expected.')
+
+      remaining -= len(chunk)
+      writer.write(base64.b64encode(chunk))
+      await asyncio.wait_for(writer.drain(), self.request_timeout)
+
+
+
+
+
+class StreamedBinary(object):
+  """
+  Binary data in an XML-RPC response, read from a file while it is sent. See
+  the module docstring. The file is closed once sent (or once the response
+  fails).
+
+  Fields:
+
+    fobj
+      The file (open in binary mode) the data is read from, starting at its
+      current position.
+
+    size
+      The number of bytes to send. By default, the rest of the file.
+  """
+
+  def __init__(self, fobj, size=None):
+
+    if size is None:
+      size = os.fstat(fobj.fileno()).st_size - fobj.tell()
+
+    self.fobj = fobj
+    self.size = size
+
+
+
+  def encoded_size(self):
+    """
+    Returns the length of the data once base64-encoded.
+    """
+    return (self.size + 2) // 3 * 4
+
+
+
+  def close(self):
+    self.fobj.close()
+
+
+
+
+
+class _StreamingMarshaller(xmlrpc_client.Marshaller):
+  """
+  Marshals StreamedBinary values as base64 values whose data is a marker
+  (see _STREAM_MARKER), noting the values in self.streams.
+  """
+
+  dispatch = dict(xmlrpc_client.Marshaller.dispatch)
+
+  def __init__(self, encoding=None, allow_none=False):
+    xmlrpc_client.Marshaller.__init__(self, encoding, allow_none)
+    self.streams = []
+
+
+
+  def dump_streamed_binary(self, value, write):
+    write('<value><base64>\n<stream:' + str(len(self.streams)) +
+        '/>\n</base64></value>\n')
+    self.streams.append(value)
+
+  dispatch[StreamedBinary] = dump_streamed_binary
@@ -0,0 +1,254 @@
+"""
+<Program Name>
+  asyncprimary.py
+
+<Purpose>
+  An asyncio server offering a Primary's interface to Secondaries over
+  XML-RPC (see uptane.asyncxmlrpc), in place of a SimpleXMLRPCServer that
+  handles one request at a time. Requests from many Secondaries are handled
+  concurrently, so a slow Secondary does not hold up the others:
+
+    - Images and metadata files are streamed to Secondaries a chunk at a
+      time, as quickly as each Secondary receives them, rather than read
+      whole into memory inside the request.
+
+    - A Secondary that takes longer than request_timeout to send a request or
+      to receive any part of a response is disconnected.
+
+  Each request is handled holding a lock (PrimaryService.lock), so that
+  requests do not interleave with each other or with other changes to the
+  Primary's state: anything else that changes that state while the service
+  runs (e.g. rotating nonces, validating a time attestation, generating the
+  Vehicle Manifest) must hold the same lock. The lock is never held across
+  network I/O, or a slow mirror or Timeserver would hold up every Secondary.
+  In particular, the Primary's update cycle (primary_update_cycle) is run
+  without the lock: it downloads images to a staging directory, then moves
+  each into place by rename and puts the new target assignments and metadata
+  for distribution in place, each in one step, and resets the Primary's
+  caches under locks of their own. Files being streamed are opened while
+  holding the lock, and as the Primary replaces them only by rename, a
+  Secondary always receives a complete file, even if it is replaced while
+  being sent. (An image replaced in the moment before the new target
+  assignments are put in place may not match the metadata the Secondary
+  has, in which case the Secondary rejects it and asks again.)
+
+  The interface offered is:
+    submit_ecu_manifest(vin, ecu_serial, nonce, signed_ecu_manifest)
+    register_new_secondary(ecu_serial)
+    get_last_timeserver_attestation()
+    update_exists_for_ecu(ecu_serial)
+    get_metadata(ecu_serial, force_partial_verification=False)
+    get_image(ecu_serial)
+    get_image_delta(ecu_serial)
+  with the same arguments and results as the Primary methods (or, for
+  get_metadata, get_image and get_image_delta, the demo Primary's functions)
+  of the same names, for Full-Verification Secondaries.
+
+  Requires Python 3.7 or later.
+
+  Use:
+    service = PrimaryService(primary_ecu, 'localhost', 30701)
+    service.serve_forever()
+
+    # Elsewhere, e.g. in another thread:
+    primary_ecu.primary_update_cycle()
+    with service.lock:
+      vehicle_manifest = primary_ecu.generate_signed_vehicle_manifest()
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import uptane.asyncxmlrpc
+
+import os
+import functools
+import threading
+
+from six.moves import xmlrpc_client
+
+log = uptane.logging.getLogger('asyncprimary')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+
+
+class PrimaryService(object):
+  """
+  Serves a Primary's interface to Secondaries. See the module docstring.
+
+  Fields:
+
+    primary
+      The uptane.clients.primary.Primary served.
+
+    lock
+      The lock (a threading.RLock unless one is given) held while the Primary
+      is accessed.
+
+    server
+      The uptane.asyncxmlrpc.AsyncXMLRPCServer the interface is served with.
+  """
+
+  def __init__(self, primary, host, port, lock=None,
+      request_timeout=uptane.asyncxmlrpc.REQUEST_TIMEOUT,
+      max_threads=uptane.asyncxmlrpc.MAX_THREADS):
+
+    self.primary = primary
+    self.lock = threading.RLock() if lock is None else lock
+    self.server = uptane.asyncxmlrpc.AsyncXMLRPCServer(host, port,
+        request_timeout=request_timeout, max_threads=max_threads,
+        allow_none=True)
+
+    self.register_function(
+        primary.register_ecu_manifest, 'submit_ecu_manifest')
+    self.register_function(
+        primary.register_new_secondary, 'register_new_secondary')
+    self.register_function(
+        primary.get_last_timeserver_attestation,
+        'get_last_timeserver_attestation')
+    self.register_function(
+        primary.update_exists_for_ecu, 'update_exists_for_ecu')
+    self.register_function(self.get_metadata, 'get_metadata')
+    self.register_function(self.get_image, 'get_image')
+    self.register_function(self.get_image_delta, 'get_image_delta')
+
+
+
+  def register_function(self, function, name=None):
+    """
+    Lets Secondaries call the given function (not a coroutine function) by
+    the given name (by default, the function's name). The function is run in
+    a thread, holding self.lock.
+    """
+    @functools.wraps(function)
+    def locked_function(*args):
+      with self.lock:
+        return function(*args)
+
+    self.server.register_function(locked_function, name)
+
+
+
+  async def start(self):
+    """
+    Starts listening, returning the asyncio server.
+    """
+    return await self.server.start()
+
+
+
+  def serve_forever(self):
+    """
+    Runs an event loop that serves Secondaries until interrupted.
+    """
+    self.server.serve_forever()
+
+
+
+  def get_metadata(self, ecu_serial, force_partial_verification=False):
+    """
+    Returns the metadata for the given Full-Verification Secondary to
+    validate its image: a zip archive (see
+    uptane.clients.primary.Primary.get_metadata_archive_for_ecu), or, if
+    force_partial_verification is True, the Director's targets metadata
+    (see get_partial_metadata_fname), as an xmlrpc_client.Binary (or,
+    when sent from a file, an uptane.asyncxmlrpc.StreamedBinary).
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with the Primary
+
+      uptane.Error
+        if the Primary does not have any metadata to distribute yet
+    """
+    self.primary._check_ecu_serial(ecu_serial)
+
+    if force_partial_verification:
+      fname = self.primary.get_partial_metadata_fname()
+
+    elif not self.primary.per_ecu_metadata_archives:
+      fname = self.primary.get_full_metadata_archive_fname()
+
+    else:
+      # Per-ECU archives are built in memory (and kept there).
+      return xmlrpc_client.Binary(
+          self.primary.get_metadata_archive_for_ecu(ecu_serial))
+
+    if not os.path.exists(fname):
+      raise uptane.Error('This Primary does not have a collection of metadata '
+          'to distribute to Secondaries.')
+
+    log.debug('Distributing metadata to ECU ' + repr(ecu_serial))
+
+    return uptane.asyncxmlrpc.StreamedBinary(open(fname, 'rb'))
+
+
+
+  def get_image(self, ecu_serial):
+    """
+    Returns, for the given Full-Verification Secondary:
+     - the filename of the image assigned to it, relative to the Primary's
+       targets directory
+     - the image, as an uptane.asyncxmlrpc.StreamedBinary
+    or (None, None) if there is no image for it.
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with the Primary
+    """
+    self.primary._check_ecu_serial(ecu_serial)
+
+    image_fname = self.primary.get_image_fname_for_ecu(ecu_serial)
+
+    if image_fname is None:
+      log.info('ECU Serial ' + repr(ecu_serial) + ' requested an image, but '
+          'this Primary has no update for that ECU.')
+      return None, None
+
+    log.debug('Distributing image to ECU ' + repr(ecu_serial))
+
+    relative_fname = os.path.relpath(
+        image_fname, os.path.join(self.primary.full_client_dir, 'targets'))
+
+    return relative_fname, uptane.asyncxmlrpc.StreamedBinary(
+        open(image_fname, 'rb'))
+
+
+
+  def get_image_delta(self, ecu_serial):
+    """
+    Returns, for the given Full-Verification Secondary:
+     - the filename of the image assigned to it, relative to the Primary's
+       targets directory, or None if there is no image for it
+     - a delta from which to reconstruct the image from the image the
+       Secondary has installed (see
+       uptane.clients.primary.Primary.get_image_delta_fname_for_ecu), as an
+       uptane.asyncxmlrpc.StreamedBinary, or None if there is no delta, in
+       which case the Secondary should call get_image instead
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with the Primary
+    """
+    self.primary._check_ecu_serial(ecu_serial)
+
+    image_fname = self.primary.get_image_fname_for_ecu(ecu_serial)
+
+    if image_fname is None:
+      return None, None
+
+    relative_fname = os.path.relpath(
+        image_fname, os.path.join(self.primary.full_client_dir, 'targets'))
+
+    delta_fname = self.primary.get_image_delta_fname_for_ecu(ecu_serial)
+
+    if delta_fname is None:
+      return relative_fname, None
+
+    log.debug('Distributing image delta to ECU ' + repr(ecu_serial))
+
+    return relative_fname, uptane.asyncxmlrpc.StreamedBinary(
+        open(delta_fname, 'rb'))
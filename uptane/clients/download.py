@@ -0,0 +1,255 @@
+"""
+<Program Name>
+  download.py
+
+<Purpose>
+  Resumable download of target files (e.g. large firmware images) for Uptane
+  clients, using HTTP Range requests against repository mirrors.
+
+  A download in progress is kept in <filename>.partial, and survives
+  interruptions (lost connections, restarts of the client); the next attempt
+  requests only the remaining bytes. The file is hashed as it is received
+  (with uptane.common.FileValidator), so that checking the finished file
+  against its trusted length and hashes does not require reading it again.
+  The hash state itself cannot be saved, so if the client is restarted, the
+  partial file (which is local) is read and hashed once when the download
+  resumes.
+
+  The finished file is only moved into place if it matches the trusted
+  length and hashes. The download never writes more than the trusted length.
+
+  Use:
+    download = ResumableDownload(full_fname, trusted_length, trusted_hashes)
+    download.fetch(url)    # may raise, leaving the partial file to resume
+    download.finish()      # checks length and hashes, moves file into place
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import tuf
+import tuf.formats
+
+import os
+
+import six
+from six.moves import urllib
+
+log = uptane.logging.getLogger('download')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# The number of bytes read from the network at once.
+CHUNK_SIZE = 64 * 1024
+
+# The number of seconds to wait for a mirror to respond.
+TIMEOUT = 30
+
+
+
+class ResumableDownload(object):
+  """
+  A download of a single file of known length and hashes, which can be
+  interrupted and resumed. See the module docstring.
+
+  Fields:
+
+    fname
+      The filename the finished file is moved to.
+
+    partial_fname
+      The filename of the partial file, fname + '.partial'.
+
+    length, hashes
+      The trusted length and hashes of the file (tuf.formats.LENGTH_SCHEMA,
+      tuf.formats.HASHDICT_SCHEMA).
+
+    validator
+      The uptane.common.FileValidator the file is fed into as it is
+      received.
+  """
+
+  def __init__(self, fname, length, hashes):
+
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+    tuf.formats.LENGTH_SCHEMA.check_match(length)
+    tuf.formats.HASHDICT_SCHEMA.check_match(hashes)
+
+    self.fname = fname
+    self.partial_fname = fname + '.partial'
+    self.length = length
+    self.hashes = hashes
+
+    # This also checks that all the hash algorithms are available before
+    # anything is downloaded.
+    self._resume()
+
+
+
+  @property
+  def received(self):
+    """
+    The number of bytes of the file received so far.
+    """
+    return self.validator.received
+
+
+
+  def _resume(self):
+    """
+    Picks up from the partial file, if there is a usable one, hashing what has
+    been received so far.
+    """
+    self.validator = uptane.common.FileValidator(self.length, self.hashes)
+
+    if not os.path.exists(self.partial_fname):
+      return
+
+    if os.path.getsize(self.partial_fname) > self.length:
+      # This cannot be the start of the file we want.
+      os.remove(self.partial_fname)
+      return
+
+    with open(self.partial_fname, 'rb') as fobj:
+      self.validator.update_from_file(fobj)
+
+    log.debug('Resuming download of ' + repr(self.fname) + ' from byte ' +
+        str(self.received) + ' of ' + str(self.length) + '.')
+
+
+
+  def _restart(self):
+    """
+    Discards what has been received so far.
+    """
+    if os.path.exists(self.partial_fname):
+      os.remove(self.partial_fname)
+
+    self._resume()
+
+
+
+  def fetch(self, url):
+    """
+    Requests the remainder of the file from the given URL and appends it to
+    the partial file. If the server does not honor the Range request, the
+    download starts over from the first byte.
+
+    Errors (e.g. the connection being lost) are raised, leaving what has been
+    received so far in the partial file, so that a later call (for this or
+    another ResumableDownload object for the same file) resumes from there.
+
+    Raises tuf.DownloadLengthMismatchError (discarding what was received) if
+    the server provides more than the trusted length of the file.
+    """
+    if self.received == self.length:
+      return
+
+    request = urllib.request.Request(url)
+    if self.received:
+      request.add_header('Range', 'bytes=' + str(self.received) + '-')
+
+    response = urllib.request.urlopen(request, timeout=TIMEOUT)
+
+    try:
+      if self.received and not self._is_continuation(response):
+        log.debug('Mirror ' + repr(url) + ' did not resume the download; '
+            'starting over.')
+        self._restart()
+
+      with open(self.partial_fname, 'ab') as fobj:
+        while self.received < self.length:
+          chunk = response.read(min(CHUNK_SIZE, self.length - self.received))
+          if not chunk:
+            break
+          self.validator.update(chunk)
+          fobj.write(chunk)
+
+        # Do not accept more data than the trusted length, or trust what was
+        # received from a server that provides it.
+        overlong = self.received == self.length and response.read(1)
+
+      if overlong:
+        self._restart()
+        raise tuf.DownloadLengthMismatchError(self.length, self.length + 1)
+
+    finally:
+      response.close()
+
+
+
+  def _is_continuation(self, response):
+    """
+    Returns True if the given response to a Range request provides the file
+    from the first byte not yet received.
+    """
+    if response.getcode() != 206:
+      return False
+
+    # e.g. 'bytes 1000-1999/2000'
+    content_range = response.info().get('Content-Range', '')
+
+    try:
+      first_byte = int(content_range.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+      return False
+
+    return first_byte == self.received
+
+
+
+  def finish(self):
+    """
+    Checks the received file against the trusted length and hashes and, if it
+    matches, moves it into place at self.fname. If not, the partial file is
+    discarded and tuf.DownloadLengthMismatchError or tuf.BadHashError raised.
+    """
+    try:
+      self.validator.check()
+
+    except tuf.BadHashError:
+      self._restart()
+      raise
+
+    os.rename(self.partial_fname, self.fname)
+
+
+
+
+
+def download_resumably(fname, length, hashes, urls):
+  """
+  <Purpose>
+    Downloads the file with the given trusted length and hashes to fname,
+    trying each of the given URLs (e.g. the same target on several mirrors) in
+    turn, and resuming from wherever the previous attempt (in this call or an
+    earlier one) stopped.
+
+  <Exceptions>
+    tuf.NoWorkingMirrorError
+      if no URL provided the rest of a file matching the trusted length and
+      hashes. Its mirror_errors maps each URL tried to the error it caused.
+      Bytes received are kept for a later attempt, unless they were found not
+      to match the trusted hashes.
+  """
+  download = ResumableDownload(fname, length, hashes)
+  mirror_errors = {}
+
+  for url in urls:
+    try:
+      download.fetch(url)
+      download.finish()
+
+    except (EnvironmentError, tuf.Error, six.moves.http_client.HTTPException) \
+        as e:
+      log.debug('Failed to download ' + repr(fname) + ' from ' + repr(url) +
+          ': ' + repr(e))
+      mirror_errors[url] = e
+
+    else:
+      return
+
+  raise tuf.NoWorkingMirrorError(mirror_errors)
@@ -0,0 +1,212 @@
+"""
+<Program Name>
+  memorymirror.py
+
+<Purpose>
+  Lets a TUF updater read the metadata of a local ("file://") mirror from
+  memory instead of from disk, so that a Secondary can validate the metadata
+  archive it receives from its Primary without first extracting the archive
+  to storage. Only the metadata that the updater validates is then written
+  (to the updater's metadata directories, as usual).
+
+  TUF opens URLs with the urllib openers built by tuf.download. While a
+  MemoryMirror is in use, file:// URLs that the thread using it opens with
+  tuf.download are opened with an opener whose file handler serves files under
+  the mirror's directory from the in-memory files given. A file under that
+  directory that is not among them is treated as missing, whether or not it
+  is on disk. Other URLs, and the downloads of other threads, are opened as
+  usual. urllib itself is not changed.
+
+  Several MemoryMirrors can be in use at once, each by a different thread.
+
+  This relies on a private function of TUF's, tuf.download._get_opener(scheme),
+  through which tuf.download obtains every opener (as in TUF 0.10 and the
+  Uptane fork of TUF). Importing this module raises uptane.Error if the
+  installed TUF does not have it, rather than leaving the updater to read
+  metadata from disk instead of from memory.
+
+  Use:
+    with MemoryMirror(full_client_dir + '/unverified', {fname: data, ...}):
+      updater.refresh()
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import tuf.formats
+import tuf.download
+
+import io
+import os
+import email
+import email.utils
+import inspect
+import threading
+import mimetypes
+
+import six
+
+log = uptane.logging.getLogger('memorymirror')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# See the module docstring.
+def _takes_scheme(function):
+  try:
+    argspec = inspect.getfullargspec(function)
+  except AttributeError: # Python 2
+    argspec = inspect.getargspec(function)
+  return 'scheme' in argspec.args
+
+if not callable(getattr(tuf.download, '_get_opener', None)) or \
+    not _takes_scheme(tuf.download._get_opener):
+  raise uptane.Error('The installed version of TUF does not provide '
+      'tuf.download._get_opener(scheme), which MemoryMirror requires. Use '
+      'TUF 0.10 or the Uptane fork of TUF.')
+
+# The MemoryMirror in use by each thread, if any.
+_thread_mirror = threading.local()
+
+# While any MemoryMirror is in use, tuf.download._get_opener is replaced by
+# _get_opener, and the original kept here. Access is protected by
+# _get_opener_lock.
+_original_get_opener = None
+_mirrors_in_use = 0
+_get_opener_lock = threading.Lock()
+
+
+
+class MemoryMirror(object):
+  """
+  A local TUF mirror held in memory. See the module docstring.
+
+  Fields:
+
+    root_dir
+      The absolute path of the directory the mirror's files would be in on
+      disk (e.g. the directory a pinned.json "file://" mirror points to).
+
+    files
+      A dict mapping the absolute path of each file in the mirror (under
+      root_dir) to its contents (bytes).
+  """
+
+  def __init__(self, root_dir, files):
+
+    tuf.formats.PATH_SCHEMA.check_match(root_dir)
+
+    self.root_dir = os.path.abspath(root_dir)
+    self.files = {}
+
+    for fname, data in six.iteritems(files):
+      fname = os.path.abspath(fname)
+      if not fname.startswith(os.path.join(self.root_dir, '')):
+        raise tuf.FormatError('File ' + repr(fname) + ' is not under the '
+            'mirror directory ' + repr(self.root_dir))
+      self.files[fname] = bytes(data)
+
+    # The MemoryMirror the thread using this one was using before, if any.
+    self._previous_mirror = None
+
+
+
+  def __enter__(self):
+
+    global _original_get_opener, _mirrors_in_use
+
+    log.debug('Serving ' + str(len(self.files)) + ' files under ' +
+        repr(self.root_dir) + ' from memory.')
+
+    with _get_opener_lock:
+      if _mirrors_in_use == 0:
+        _original_get_opener = tuf.download._get_opener
+        tuf.download._get_opener = _get_opener
+      _mirrors_in_use += 1
+
+    self._previous_mirror = getattr(_thread_mirror, 'mirror', None)
+    _thread_mirror.mirror = self
+
+    return self
+
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+
+    global _mirrors_in_use
+
+    _thread_mirror.mirror = self._previous_mirror
+    self._previous_mirror = None
+
+    with _get_opener_lock:
+      _mirrors_in_use -= 1
+      if _mirrors_in_use == 0:
+        # _original_get_opener is kept, for calls to _get_opener that are
+        # already under way.
+        tuf.download._get_opener = _original_get_opener
+
+
+
+  def _open(self, req, file_handler):
+    """
+    Opens the file:// URL of the request from memory if it is under root_dir,
+    or with the given file handler's usual behavior otherwise.
+    """
+    # Request.get_selector is gone in Python 3.4; selector is not in Python 2.
+    selector = req.selector if hasattr(req, 'selector') else req.get_selector()
+    fname = os.path.abspath(six.moves.urllib.request.url2pathname(selector))
+
+    if not fname.startswith(os.path.join(self.root_dir, '')):
+      return six.moves.urllib.request.FileHandler.open_local_file(
+          file_handler, req)
+
+    if fname not in self.files:
+      raise six.moves.urllib.error.URLError(
+          'File not in memory mirror: ' + repr(fname))
+
+    data = self.files[fname]
+    headers = email.message_from_string(
+        'Content-type: %s\nContent-length: %d\nLast-modified: %s\n' % (
+        mimetypes.guess_type(fname)[0] or 'text/plain', len(data),
+        email.utils.formatdate(usegmt=True)))
+
+    return six.moves.urllib.response.addinfourl(
+        io.BytesIO(data), headers, req.get_full_url())
+
+
+
+
+
+class _MemoryFileHandler(six.moves.urllib.request.FileHandler):
+  """
+  A urllib file handler that opens file:// URLs with the given MemoryMirror.
+  """
+
+  def __init__(self, mirror):
+    six.moves.urllib.request.FileHandler.__init__(self)
+    self.mirror = mirror
+
+
+
+  def open_local_file(self, req):
+    return self.mirror._open(req, self)
+
+
+
+
+
+def _get_opener(scheme=None):
+  """
+  Replaces tuf.download._get_opener while MemoryMirrors are in use. Returns an
+  opener that uses the calling thread's MemoryMirror for file:// URLs, or, if
+  the thread is not using one, the opener tuf.download would build.
+  """
+  mirror = getattr(_thread_mirror, 'mirror', None)
+
+  if mirror is None or scheme != 'file':
+    return _original_get_opener(scheme=scheme)
+
+  # Given a subclass of a default handler, build_opener uses it in place of
+  # the default.
+  return six.moves.urllib.request.build_opener(_MemoryFileHandler(mirror))
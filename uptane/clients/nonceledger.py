@@ -0,0 +1,197 @@
+"""
+<Program Name>
+  nonceledger.py
+
+<Purpose>
+  Keeps track of the nonces an Uptane client must see in a Timeserver
+  attestation: for a Primary, the nonces its Secondaries have sent it to
+  include in its next request for the time, and those it included in its
+  last request; for a Secondary, the nonce it last sent.
+
+  Nonces are kept in insertion-ordered dicts, so adding a nonce that is
+  already waiting to be sent (e.g. from a Secondary that sends the same nonce
+  with each ECU Manifest until it sees it attested) does not add it twice,
+  and checking the nonces of an attestation takes time linear in the number
+  of nonces rather than quadratic. The number of nonces waiting to be sent
+  is bounded (the oldest are dropped first), and nonces that have waited
+  longer than a given time, by the Timeserver's clock, are dropped when a
+  newer Timeserver time is validated.
+
+  Use:
+    ledger = NonceLedger()
+    ledger.add(nonce, <latest validated Timeserver time>)
+    ...
+    nonces = ledger.rotate() # <request an attestation for these nonces>
+    if ledger.missing(<nonces attested>):
+      <reject the attestation>
+    ledger.expire(<time attested>)
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import uptane.formats
+import tuf.formats
+
+import time
+import calendar
+import threading
+import collections
+
+log = uptane.logging.getLogger('nonceledger')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# The most nonces kept waiting to be sent.
+MAX_NONCES = 10000
+
+# The longest a nonce is kept waiting to be sent, in seconds of Timeserver
+# time.
+MAX_NONCE_AGE = 24 * 60 * 60
+
+
+
+def missing_nonces(expected_nonces, attested_nonces):
+  """
+  Returns a list of those of the expected nonces (an iterable) that are not
+  among the attested nonces (an iterable, e.g. from
+  uptane.common.get_attested_nonces), in the order given.
+  """
+  attested_nonces = set(attested_nonces)
+
+  return [nonce for nonce in expected_nonces if nonce not in attested_nonces]
+
+
+
+
+
+class NonceLedger(object):
+  """
+  The nonces waiting to be sent to the Timeserver and those last sent. See
+  the module docstring. Safe to use from several threads at once.
+
+  Fields:
+
+    max_nonces
+      The most nonces kept waiting to be sent.
+
+    max_age
+      The longest a nonce is kept waiting to be sent, in seconds of Timeserver
+      time.
+
+    to_send
+      A list of the nonces waiting to be sent, oldest first.
+
+    sent
+      A list of the nonces last sent (returned by rotate).
+  """
+
+  def __init__(self, max_nonces=MAX_NONCES, max_age=MAX_NONCE_AGE):
+
+    tuf.formats.LENGTH_SCHEMA.check_match(max_nonces)
+    tuf.formats.LENGTH_SCHEMA.check_match(max_age)
+
+    self.max_nonces = max_nonces
+    self.max_age = max_age
+
+    # Map each nonce to the Timeserver time (a UNIX timestamp) at which it
+    # was last added.
+    self._to_send = collections.OrderedDict()
+    self._sent = collections.OrderedDict()
+
+    self._lock = threading.Lock()
+
+
+
+  @property
+  def to_send(self):
+    with self._lock:
+      return list(self._to_send)
+
+
+
+  @property
+  def sent(self):
+    with self._lock:
+      return list(self._sent)
+
+
+
+  def add(self, nonce, timeserver_time):
+    """
+    Adds the given nonce to those waiting to be sent, noting that it was
+    added as of the given Timeserver time (the latest validated, conforming
+    to tuf.formats.ISO8601_DATETIME_SCHEMA). A nonce that is already waiting
+    is not added again, but is kept as if it had just been added.
+    """
+    uptane.formats.NONCE_SCHEMA.check_match(nonce)
+    added = _to_timestamp(timeserver_time)
+
+    with self._lock:
+      self._to_send.pop(nonce, None)
+      self._to_send[nonce] = added
+
+      while len(self._to_send) > self.max_nonces:
+        dropped, dropped_time = self._to_send.popitem(last=False)
+        log.warning('Too many nonces are waiting to be sent to the '
+            'Timeserver; dropping the oldest, ' + repr(dropped))
+
+
+
+  def rotate(self):
+    """
+    Returns a list of the nonces waiting to be sent, which become those last
+    sent, replacing those previously sent. No nonces are then waiting.
+    """
+    with self._lock:
+      self._sent = self._to_send
+      self._to_send = collections.OrderedDict()
+      return list(self._sent)
+
+
+
+  def missing(self, attested_nonces):
+    """
+    Returns a list of those of the nonces last sent that are not among the
+    attested nonces (see missing_nonces).
+    """
+    with self._lock:
+      sent = list(self._sent)
+
+    return missing_nonces(sent, attested_nonces)
+
+
+
+  def expire(self, timeserver_time):
+    """
+    Drops the nonces waiting to be sent that were added more than max_age
+    seconds before the given Timeserver time (conforming to
+    tuf.formats.ISO8601_DATETIME_SCHEMA).
+    """
+    oldest = _to_timestamp(timeserver_time) - self.max_age
+
+    with self._lock:
+      expired = [nonce for nonce, added in self._to_send.items()
+          if added < oldest]
+
+      for nonce in expired:
+        del self._to_send[nonce]
+
+    if expired:
+      log.debug('Dropped ' + str(len(expired)) + ' nonces that were not sent '
+          'to the Timeserver in time.')
+
+
+
+
+
+def _to_timestamp(timeserver_time):
+  """
+  Returns the UNIX timestamp for the given time (conforming to
+  tuf.formats.ISO8601_DATETIME_SCHEMA).
+  """
+  tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(timeserver_time)
+
+  return calendar.timegm(time.strptime(timeserver_time, '%Y-%m-%dT%H:%M:%SZ'))
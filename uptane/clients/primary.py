@@ -12,26 +12,48 @@ from __future__ import unicode_literals
 
 import uptane.formats
 import tuf.formats
+import tuf.util
 #import uptane.ber_encoder as ber_encoder
+import uptane.common
+import uptane.fastschema
+import uptane.clients.download
+import uptane.clients.targetcache
+import uptane.clients.nonceledger
+import uptane.clients.timehistory
+import uptane.delta
 from uptane.common import sign_signable
 
 import uptane.services.director as director
 import uptane.services.timeserver as timeserver
 
 import os # For paths and makedirs
+import time # For download timings
+import fnmatch # For matching targets to repositories in pinned.json
+import threading
+import collections # for the bounded history of time attestations
+import multiprocessing.pool # For parallel downloads
 import shutil # For copyfile
+import tempfile # For image delta files
 import tuf.client.updater
 import tuf.repository_tool as rt
 import tuf.keys
 import random # for nonces
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
+import io # for per-ECU metadata archives
+import json # to read delegations for per-ECU metadata archives
 import zipfile
+import hashlib # for image chunk hashes
+import six
 
 log = uptane.logging.getLogger('primary')
 log.addHandler(uptane.file_handler)
 log.addHandler(uptane.console_handler)
 log.setLevel(uptane.logging.DEBUG)
 
+# The size of the chunks in which images are provided to Secondaries by
+# get_image_chunk, and the most that can be requested at once.
+IMAGE_CHUNK_SIZE = 256 * 1024
+
 
 
 class Primary(object): # Consider inheriting from Secondary and refactoring.
@@ -87,11 +109,17 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
     assigned_targets:
       A dict mapping ECU Serial to the target file info that the Director has
-      instructed that ECU to install.
+      instructed that ECU to install. primary_update_cycle replaces the dict,
+      rather than changing it, once it has downloaded the targets.
+
+    nonce_ledger:
+      A uptane.clients.nonceledger.NonceLedger keeping the nonces below.
 
     nonces_to_send:
       The list of nonces sent to us from Secondaries and not yet sent to the
-      Timeserver.
+      Timeserver (each listed once, however many times it was sent to us).
+      Nonces that wait too long (by Timeserver time) to be sent, or in too
+      great a number, are dropped; see uptane/clients/nonceledger.py.
 
     nonces_sent:
       The list of nonces sent to the Timeserver by our Secondaries, which we
@@ -99,14 +127,20 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       Timeserver's response.
 
     all_valid_timeserver_attestations:
-      A list of all attestations received from Timeservers that have been
-      validated by validate_time_attestation.
+      A collections.deque of the latest attestations received from
+      Timeservers that have been validated by validate_time_attestation (at
+      most time_history_depth of them).
       Items are appended to the end.
 
     all_valid_timeserver_times:
-      A list of all times extracted from all Timeserver attestations that have
-      been validated by validate_time_attestation.
-      Items are appended to the end.
+      A uptane.clients.timehistory.TimeHistory, which reads like a list, of
+      the latest times (at most time_history_depth of them) extracted from
+      Timeserver attestations that have been validated by
+      validate_time_attestation, starting with the time given to __init__.
+      Items are appended to the end. If persist_time is True, the times are
+      also saved to <full_client_dir>/timeserver_times.json, and the saved
+      times are used in place of the time given to __init__ when a Primary is
+      created with the same client directory.
 
     distributable_full_metadata_archive_fname:
       The filename at which the full metadata archive is stored after each
@@ -114,6 +148,59 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       moved into place (renamed) after it has been fully written, to avoid
       race conditions.
 
+    per_ecu_metadata_archives:
+      If True, get_metadata_archive_for_ecu provides each Full-Verification
+      Secondary with an archive of only the metadata it needs to validate the
+      target assigned to it, rather than of all the metadata this Primary
+      has. If False (the default), it provides the full metadata archive.
+
+    metadata_fingerprint:
+      A string identifying the set of metadata in the distributable metadata
+      files (see get_metadata_fingerprint), or None if they have not been
+      written yet.
+
+    download_threads:
+      The number of targets that primary_update_cycle downloads at once. If
+      1 (the default), targets are downloaded one at a time.
+
+    resumable_downloads:
+      If True, primary_update_cycle downloads targets itself from the mirrors
+      in pinned.json, with HTTP Range requests, keeping partially downloaded
+      targets so that a later update cycle resumes rather than restarts them
+      (see uptane/clients/download.py). If False (the default), TUF downloads
+      each target whole.
+
+    target_cache:
+      A uptane.clients.targetcache.TargetCache indexing the target files this
+      Primary has downloaded, kept in <full_client_dir>/target_cache.json.
+      primary_update_cycle does not download a target again if a file
+      matching the trusted length and hashes is already in place (or
+      elsewhere in the cache, in which case it is copied into place). The
+      index is saved once per update cycle.
+
+    image_deltas:
+      If True, this Primary can provide Secondaries with deltas against the
+      images they report as installed, rather than whole images (see
+      get_image_delta_fname_for_ecu). Images that are replaced by new
+      versions are then kept (in <full_client_dir>/previous_targets, named by
+      hash) for as long as a Secondary reports having them installed.
+
+    installed_images:
+      A dict mapping the ECU Serial of each Secondary that has sent this
+      Primary an ECU Manifest to the installed_image (target info) reported
+      in the latest one. This information is not validated.
+
+    max_downloads_per_mirror:
+      (argument to __init__) If not None, the most downloads that are in
+      progress at once from any one mirror listed in pinned.json. Because TUF
+      chooses among the mirrors for a target itself, each download counts
+      against every mirror of the repositories it may be downloaded from.
+
+    download_timings:
+      A dict mapping the filepath of each target that the last
+      primary_update_cycle tried to download to the time, in seconds, spent
+      downloading it (whether or not the download succeeded).
+
     distributable_partial_metadata_fname:
       The filename at which the Director's targets metadata file is stored after
       each update cycle, once it is safe to use. This is atomically moved into
@@ -143,8 +230,14 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       get_last_timeserver_attestation()
       update_exists_for_ecu(ecu_serial)
       get_image_fname_for_ecu(ecu_serial)
+      get_image_delta_fname_for_ecu(ecu_serial)
+      get_image_chunk_manifest(ecu_serial)
+      get_image_chunk(ecu_serial, offset, length)
       get_full_metadata_archive_fname()
+      get_metadata_archive_for_ecu(ecu_serial)
       get_partial_metadata_fname()
+      get_metadata_fingerprint()
+      metadata_changed_since(fingerprint)
       register_new_secondary(ecu_serial)
 
     Private methods:
@@ -189,7 +282,14 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     primary_key,
     time,
     timeserver_public_key,
-    my_secondaries=[]):
+    my_secondaries=[],
+    download_threads=1,
+    max_downloads_per_mirror=None,
+    resumable_downloads=False,
+    image_deltas=False,
+    per_ecu_metadata_archives=False,
+    time_history_depth=uptane.clients.timehistory.DEFAULT_DEPTH,
+    persist_time=False):
 
     """
     See class docstring.
@@ -202,18 +302,38 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
     tuf.formats.ANYKEY_SCHEMA.check_match(timeserver_public_key)
     tuf.formats.ANYKEY_SCHEMA.check_match(primary_key)
+    tuf.formats.LENGTH_SCHEMA.check_match(download_threads)
+    if max_downloads_per_mirror is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(max_downloads_per_mirror)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(resumable_downloads)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(image_deltas)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(per_ecu_metadata_archives)
+    tuf.formats.LENGTH_SCHEMA.check_match(time_history_depth)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(persist_time)
     # TODO: Should also check that primary_key is a private key, not a
     # public key.
 
     self.vin = vin
     self.ecu_serial = ecu_serial
     self.full_client_dir = full_client_dir
-    self.all_valid_timeserver_times = [time]
-    self.all_valid_timeserver_attestations = []
+    self.all_valid_timeserver_times = uptane.clients.timehistory.TimeHistory(
+        [time], time_history_depth, os.path.join(
+        full_client_dir, 'timeserver_times.json') if persist_time else None)
+    self.all_valid_timeserver_attestations = collections.deque(
+        maxlen=time_history_depth)
     self.timeserver_public_key = timeserver_public_key
     self.primary_key = primary_key
     self.my_secondaries = my_secondaries
     self.director_repo_name = director_repo_name
+    self.download_threads = download_threads
+    self.resumable_downloads = resumable_downloads
+    self.target_cache = uptane.clients.targetcache.TargetCache(
+        os.path.join(full_client_dir, 'target_cache.json'))
+    self.image_deltas = image_deltas
+    self.previous_targets_dir = os.path.join(
+        full_client_dir, 'previous_targets')
+    self.image_deltas_dir = os.path.join(full_client_dir, 'image_deltas')
+    self.download_timings = {}
 
     self.temp_full_metadata_archive_fname = os.path.join(
         full_client_dir, 'metadata', 'temp_full_metadata_archive.zip')
@@ -225,10 +345,30 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     self.distributable_partial_metadata_fname = os.path.join(
         full_client_dir, 'metadata', 'director_targets.json')
 
+    self.per_ecu_metadata_archives = per_ecu_metadata_archives
+    self.metadata_fingerprint = None
+
     # Initializations not directly related to arguments.
-    self.nonces_to_send = []
-    self.nonces_sent = []
+    self.nonce_ledger = uptane.clients.nonceledger.NonceLedger()
     self.assigned_targets = dict()
+    self.installed_images = dict()
+
+    # The filenames of deltas already computed this update cycle, by (image
+    # filename, length and hashes of the installed image), and a count of the
+    # update cycles that have reset them.
+    self._image_deltas = dict()
+    self._image_deltas_generation = 0
+    self._image_deltas_lock = threading.Lock()
+
+    # Image chunk manifests already computed this update cycle, by image
+    # filename.
+    self._image_chunk_manifests = dict()
+    self._image_chunk_manifests_lock = threading.Lock()
+
+    # Per-ECU metadata archives already built from the current full metadata
+    # archive and target assignments, by ECU Serial.
+    self._ecu_metadata_archives = dict()
+    self._ecu_metadata_archives_lock = threading.Lock()
 
     # Initialize the dictionary of manifests. This is a dictionary indexed
     # by ECU serial and with value being a list of manifests from that ECU, to
@@ -245,6 +385,28 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
       raise uptane.Error('Given name for the Director repository is not a '
           'known repository, according to the pinned metadata from pinned.json')
 
+    # Limit the number of simultaneous downloads from each mirror.
+    self._mirror_semaphores = {}
+    if max_downloads_per_mirror is not None:
+      for repository in self.updater.pinned_metadata['repositories'].values():
+        for mirror in repository['mirrors']:
+          self._mirror_semaphores[mirror] = threading.BoundedSemaphore(
+              max(max_downloads_per_mirror, 1))
+
+
+
+
+
+  @property
+  def nonces_to_send(self):
+    return self.nonce_ledger.to_send
+
+
+
+  @property
+  def nonces_sent(self):
+    return self.nonce_ledger.sent
+
 
 
 
@@ -389,6 +551,18 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     reference implementation, but in this case, it is the most convenient way
     to maintain the existing interfaces with TUF and with demonstration code.)
 
+    The methods Secondaries use (register_ecu_manifest, get_image_fname_for_ecu,
+    get_metadata_archive_for_ecu, etc.) may be called while this runs, from
+    other threads: targets are downloaded to <full_client_dir>/targets.staged
+    and each is then moved into place by rename, so that a target being sent
+    to a Secondary is never missing or incomplete; the new target assignments
+    and metadata for distribution are put in place only once complete; and
+    the caches built from them are reset under their own locks. A Secondary
+    that requests its image while the targets are being put in place may
+    receive a version that does not match its metadata, which it will reject
+    as it would any other, and request again. Do not run two update cycles
+    at once.
+
 
     <Exceptions>
       uptane.Error
@@ -471,6 +645,23 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         repr(verified_target_filepaths))
 
 
+    full_targets_directory = os.path.abspath(os.path.join(
+        self.full_client_dir, 'targets'))
+
+    # Targets are downloaded here, and only moved into the targets directory
+    # once all downloads are done, since Secondaries may be receiving the
+    # targets currently in place meanwhile.
+    staged_targets_directory = os.path.abspath(os.path.join(
+        self.full_client_dir, 'targets.staged'))
+
+    # The targets to download, as (target info, filepath, full filename,
+    # staged filename).
+    downloads = []
+
+    # The new target assignments, put in place (self.assigned_targets) only
+    # once the targets have been downloaded.
+    assigned_targets = dict(self.assigned_targets)
+
     # For each target for which we have verified metadata:
     for target in verified_targets:
 
@@ -504,85 +695,80 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         continue
 
       # Save the target info as an update assigned to that ECU.
-      self.assigned_targets[assigned_ecu_serial] = target
+      assigned_targets[assigned_ecu_serial] = target
 
 
       # Make sure the resulting filename is actually in the client directory.
       # (In other words, enforce a jail.)
       # TODO: Do a proper review of this, and determine if it's necessary and
       # how to do it properly.
-      full_targets_directory = os.path.abspath(os.path.join(
-          self.full_client_dir, 'targets'))
       filepath = target['filepath']
       if filepath[0] == '/':
         filepath = filepath[1:]
       full_fname = os.path.join(full_targets_directory, filepath)
       enforce_jail(filepath, full_targets_directory)
 
-      # TODO: Remove this. It's here for convenience during dev & testing.
-      # Considerations on the ground by implementers / users of the reference
-      # implementation will decide what to do with target files after they've
-      # been used.
-      # Delete existing targets.
-      if os.path.exists(full_fname):
-        os.remove(full_fname)
-
-      # Download each target.
-      # Now that we have fileinfo for all targets listed by both the Director and
-      # the Supplier (mainrepo) -- which should include file2.txt in this test --
-      # we can download the target files and only keep each if it matches the
-      # verified fileinfo. This call will try every mirror on every repository
-      # within the appropriate delegation in pinned.json until one of them works.
-      # In this case, both the Director and OEM Repo are hosting the
-      # file, just for my convenience in setup. If you remove the file from the
-      # Director before calling this, it will still work (assuming OEM still
-      # has it). (The second argument here is just where to put the files.)
-      # This should include file2.txt.
+      # If we already have this exact target, in place or elsewhere, there is
+      # no need to download it again.
+      if self._reuse_local_target(target, full_fname):
+        log.info('Target ' + repr(filepath) + ' is already present and '
+            'matches the validated metadata; not downloading it again.')
+        continue
+
+      downloads.append((target, filepath, full_fname,
+          os.path.join(staged_targets_directory, filepath)))
+
+
+    # Download each target, in parallel if so configured. Each download is
+    # timed, and the timings kept in self.download_timings.
+    self.download_timings = {}
+
+    if self.download_threads > 1 and len(downloads) > 1:
+      pool = multiprocessing.pool.ThreadPool(
+          min(self.download_threads, len(downloads)))
       try:
-        self.updater.download_target(target, full_targets_directory)
-
-      except tuf.NoWorkingMirrorError as e:
-        print('')
-        print(YELLOW + 'In downloading target ' + repr(filepath) + ', am unable '
-            'to find a mirror providing a trustworthy file.\nChecking the mirrors'
-            ' resulted in these errors:')
-        for mirror in e.mirror_errors:
-          print('    ' + type(e.mirror_errors[mirror]).__name__ + ' from ' + mirror)
-        print(ENDCOLORS)
-
-        # If this was our firmware, notify that we're not installing.
-        if filepath.startswith('/') and filepath[1:] == firmware_filename or \
-          not filepath.startswith('/') and filepath == firmware_filename:
-
-          print()
-          print(YELLOW + ' While the Director and OEM provided consistent metadata'
-              ' for new firmware,')
-          print(' mirrors we contacted provided only untrustworthy images. ')
-          print(GREEN + 'We have rejected these. Firmware not updated.\n' + ENDCOLORS)
-
-      else:
-        assert(os.path.exists(full_fname)), 'Programming error: no download ' + \
-            'error, but file still does not exist.'
-        print(GREEN + 'Successfully downloaded a trustworthy ' + repr(filepath) +
-            ' image.' + ENDCOLORS)
-
-
-        # TODO: <~> There is an attack vector here, potentially, for a minor
-        # attack, but it's pretty strange. Finish thinking through it with a
-        # test case later. If the Director specifies two target files with the
-        # same path (which shouldn't really be possible with TUF, but people
-        # will be reimplementing things), the second one to be downloaded can
-        # replace the first file, and then we may distribute that to both
-        # Secondaries (which will still validate the files and catch the
-        # mistake, but... we will still potentially have disrupted one of them
-        # if it receives an update that wasn't right in the first place.... It
-        # may perhaps end up in limp-home mode or something....)
-
-        # In any case, there may also be race conditions. The point is that
-        # we are storing a downloaded file and we are also, separately storing
-        # the verified file info. Perhaps we should check the file against the
-        # fileinfo at the last moment, before we send it on to the Secondary.
-        # That should provide some prophylaxis?
+        downloaded = pool.map(self._download_target, downloads)
+      finally:
+        pool.close()
+        pool.join()
+
+    else:
+      downloaded = [self._download_target(download) for download in downloads]
+
+    if downloads:
+      log.info('Target download times (seconds): ' +
+          repr(self.download_timings))
+
+    # Move the downloaded targets into place, each replacing the previous
+    # version (if any) by rename, so that a Secondary being sent a target
+    # meanwhile still receives a complete file; then put the new assignments
+    # in place.
+    for download, success in zip(downloads, downloaded):
+      if success:
+        self._put_target_in_place(download)
+
+    self.assigned_targets = assigned_targets
+
+    # Images may have changed, so deltas computed so far may be out of date.
+    # Delta files still being sent to Secondaries remain readable. Any delta
+    # still being computed is removed by get_image_delta_fname_for_ecu when
+    # it is done, so the directory itself is left in place.
+    with self._image_deltas_lock:
+      for delta_fname in six.itervalues(self._image_deltas):
+        if delta_fname is not None and os.path.exists(delta_fname):
+          os.remove(delta_fname)
+      self._image_deltas = dict()
+      self._image_deltas_generation += 1
+    with self._image_chunk_manifests_lock:
+      self._image_chunk_manifests = dict()
+    with self._ecu_metadata_archives_lock:
+      self._ecu_metadata_archives = dict()
+
+    if self.image_deltas:
+      self._prune_previous_targets()
+
+    # Persist what the target cache learned this cycle, once.
+    self.target_cache.save()
 
 
 
@@ -611,6 +797,260 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def _download_target(self, download):
+    """
+    Downloads a target for primary_update_cycle, given as (target info,
+    filepath, full filename, staged filename), to its staged filename,
+    reporting (not raising) a failure to find a trustworthy copy of it, and
+    recording the time taken in self.download_timings. Returns True if the
+    target was downloaded, else False.
+    """
+    target, filepath, full_fname, staged_fname = download
+
+    staged_targets_directory = os.path.abspath(os.path.join(
+        self.full_client_dir, 'targets.staged'))
+
+    # Download the target.
+    # Now that we have fileinfo for all targets listed by both the Director and
+    # the Supplier (mainrepo) -- which should include file2.txt in this test --
+    # we can download the target files and only keep each if it matches the
+    # verified fileinfo. This call will try every mirror on every repository
+    # within the appropriate delegation in pinned.json until one of them works.
+    # In this case, both the Director and OEM Repo are hosting the
+    # file, just for my convenience in setup. If you remove the file from the
+    # Director before calling this, it will still work (assuming OEM still
+    # has it). (The second argument here is just where to put the files.)
+    # This should include file2.txt.
+    start_time = time.time()
+
+    try:
+      # Hold a connection slot at each mirror this download may use (TUF
+      # chooses among them), in a consistent order, to avoid deadlock.
+      semaphores = [self._mirror_semaphores[mirror]
+          for mirror in sorted(self._get_mirrors_for_target(filepath))
+          if mirror in self._mirror_semaphores]
+      for semaphore in semaphores:
+        semaphore.acquire()
+      try:
+        if self.resumable_downloads:
+          self._download_target_resumably(target, filepath, staged_fname)
+        else:
+          self.updater.download_target(target, staged_targets_directory)
+      finally:
+        for semaphore in reversed(semaphores):
+          semaphore.release()
+
+    except tuf.NoWorkingMirrorError as e:
+      print('')
+      print(YELLOW + 'In downloading target ' + repr(filepath) + ', am unable '
+          'to find a mirror providing a trustworthy file.\nChecking the mirrors'
+          ' resulted in these errors:')
+      for mirror in e.mirror_errors:
+        print('    ' + type(e.mirror_errors[mirror]).__name__ + ' from ' + mirror)
+      print(ENDCOLORS)
+
+      # If this was our firmware, notify that we're not installing.
+      if filepath.startswith('/') and filepath[1:] == firmware_filename or \
+        not filepath.startswith('/') and filepath == firmware_filename:
+
+        print()
+        print(YELLOW + ' While the Director and OEM provided consistent metadata'
+            ' for new firmware,')
+        print(' mirrors we contacted provided only untrustworthy images. ')
+        print(GREEN + 'We have rejected these. Firmware not updated.\n' + ENDCOLORS)
+
+      return False
+
+    else:
+      assert(os.path.exists(staged_fname)), 'Programming error: no ' + \
+          'download error, but file still does not exist.'
+      print(GREEN + 'Successfully downloaded a trustworthy ' + repr(filepath) +
+          ' image.' + ENDCOLORS)
+
+
+      # TODO: <~> There is an attack vector here, potentially, for a minor
+      # attack, but it's pretty strange. Finish thinking through it with a
+      # test case later. If the Director specifies two target files with the
+      # same path (which shouldn't really be possible with TUF, but people
+      # will be reimplementing things), the second one to be downloaded can
+      # replace the first file, and then we may distribute that to both
+      # Secondaries (which will still validate the files and catch the
+      # mistake, but... we will still potentially have disrupted one of them
+      # if it receives an update that wasn't right in the first place.... It
+      # may perhaps end up in limp-home mode or something....)
+
+      # In any case, there may also be race conditions. The point is that
+      # we are storing a downloaded file and we are also, separately storing
+      # the verified file info. Perhaps we should check the file against the
+      # fileinfo at the last moment, before we send it on to the Secondary.
+      # That should provide some prophylaxis?
+
+      return True
+
+    finally:
+      self.download_timings[filepath] = time.time() - start_time
+
+
+
+
+
+  def _put_target_in_place(self, download):
+    """
+    Moves a target downloaded by _download_target, given as (target info,
+    filepath, full filename, staged filename), from its staged filename to
+    its full filename, replacing any previous version by rename. (If
+    providing deltas, the previous version is kept, as it may be what a
+    Secondary has installed.)
+    """
+    target, filepath, full_fname, staged_fname = download
+
+    if self.image_deltas and os.path.exists(full_fname):
+      self._retire_target(full_fname)
+
+    if not os.path.exists(os.path.dirname(full_fname)):
+      os.makedirs(os.path.dirname(full_fname))
+    os.rename(staged_fname, full_fname)
+
+    # The download was checked against the trusted hashes, so these can be
+    # recorded without hashing the file again.
+    self.target_cache.record(full_fname, target['fileinfo']['hashes'])
+
+
+
+
+
+  def _reuse_local_target(self, target, full_fname):
+    """
+    Returns True if full_fname already holds the given target (validated
+    target info), copying a matching file from elsewhere in the target cache
+    into place first if necessary, and False if it must be downloaded.
+    """
+    length = target['fileinfo']['length']
+    hashes = target['fileinfo']['hashes']
+
+    if self.target_cache.matches(full_fname, length, hashes):
+      return True
+
+    cached_fname = self.target_cache.find(length, hashes)
+    if cached_fname is None:
+      return False
+
+    if self.image_deltas and os.path.exists(full_fname):
+      self._retire_target(full_fname)
+
+    if not os.path.exists(os.path.dirname(full_fname)):
+      os.makedirs(os.path.dirname(full_fname))
+    temp_fname = full_fname + '.tmp'
+    shutil.copyfile(cached_fname, temp_fname)
+    os.rename(temp_fname, full_fname)
+
+    # Check the copy, which also indexes it.
+    return self.target_cache.matches(full_fname, length, hashes)
+
+
+
+
+
+  def _retire_target(self, full_fname):
+    """
+    Keeps a copy of a target file that is about to be replaced in
+    self.previous_targets_dir, named by its hash, so that deltas against it
+    can still be made. The file itself is left in place until it is replaced.
+    If its hashes are not known, no copy is kept.
+    """
+    hashes = self.target_cache.get_hashes(full_fname)
+
+    if not hashes:
+      return
+
+    algorithm = 'sha256' if 'sha256' in hashes else sorted(hashes)[0]
+    retired_fname = os.path.join(
+        self.previous_targets_dir, algorithm + '.' + hashes[algorithm])
+
+    if os.path.exists(retired_fname):
+      return
+
+    if not os.path.exists(self.previous_targets_dir):
+      os.makedirs(self.previous_targets_dir)
+
+    # A hard link costs no copying, where the filesystem allows it.
+    try:
+      os.link(full_fname, retired_fname)
+    except OSError:
+      temp_fname = retired_fname + '.tmp'
+      shutil.copyfile(full_fname, temp_fname)
+      os.rename(temp_fname, retired_fname)
+
+    self.target_cache.record(retired_fname, hashes)
+
+
+
+
+
+  def _prune_previous_targets(self):
+    """
+    Removes the images kept in self.previous_targets_dir that no Secondary
+    reports having installed.
+    """
+    if not os.path.exists(self.previous_targets_dir):
+      return
+
+    # Secondaries may report installed images meanwhile.
+    installed_fileinfos = [installed_image['fileinfo']
+        for installed_image in list(self.installed_images.values())]
+
+    for fname in os.listdir(self.previous_targets_dir):
+      fname = os.path.join(self.previous_targets_dir, fname)
+      if not any(self.target_cache.matches(
+          fname, fileinfo['length'], fileinfo['hashes'])
+          for fileinfo in installed_fileinfos):
+        os.remove(fname)
+        self.target_cache.forget(fname)
+
+
+
+
+
+  def _download_target_resumably(self, target, filepath, full_fname):
+    """
+    Downloads the given target (validated target info) to full_fname from the
+    mirrors that TUF would use, resuming any earlier, interrupted download of
+    it. Raises tuf.NoWorkingMirrorError if no mirror provides a file matching
+    the trusted length and hashes.
+    """
+    if not os.path.exists(os.path.dirname(full_fname)):
+      os.makedirs(os.path.dirname(full_fname))
+
+    urls = [mirror.rstrip('/') + '/targets/' + six.moves.urllib.parse.quote(
+        filepath) for mirror in sorted(self._get_mirrors_for_target(filepath))]
+
+    uptane.clients.download.download_resumably(full_fname,
+        target['fileinfo']['length'], target['fileinfo']['hashes'], urls)
+
+
+
+
+
+  def _get_mirrors_for_target(self, filepath):
+    """
+    Returns the mirrors (per pinned.json) of the repositories from which TUF
+    may download the given target: those of the first delegation in
+    pinned.json whose paths match the target.
+    """
+    for delegation in self.updater.pinned_metadata['delegations']:
+      for pattern in delegation['paths']:
+        if fnmatch.fnmatch(filepath, pattern.lstrip('/')):
+          return set(mirror
+              for repo_name in delegation['repositories']
+              for mirror in self.updater.pinned_metadata['repositories'][
+                  repo_name]['mirrors'])
+
+    return set()
+
+
+
+
+
   def get_image_fname_for_ecu(self, ecu_serial):
     """
     Given an ECU serial, returns:
@@ -634,6 +1074,175 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def get_image_delta_fname_for_ecu(self, ecu_serial):
+    """
+    <Purpose>
+      Returns the filename of a delta (see uptane/delta.py) from which the
+      given Secondary can reconstruct the image assigned to it
+      (get_image_fname_for_ecu) from the image it last reported as installed,
+      or None if there is no such delta to provide, in which case the whole
+      image should be sent instead.
+
+      There is no delta if this Primary was not configured to provide them
+      (image_deltas), there is no update for the ECU, the ECU has not reported
+      an installed image, this Primary does not have a copy of that image, or
+      the delta would be no smaller than the image.
+
+      Deltas are computed once per update cycle for each pair of images, and
+      written to files in <full_client_dir>/image_deltas, which the next
+      update cycle removes. The Secondary must validate the reconstructed
+      image as it would any other.
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with this Primary
+    """
+    self._check_ecu_serial(ecu_serial)
+
+    image_fname = self.get_image_fname_for_ecu(ecu_serial)
+
+    if not self.image_deltas or image_fname is None or \
+        ecu_serial not in self.installed_images:
+      return None
+
+    installed_fileinfo = self.installed_images[ecu_serial]['fileinfo']
+
+    key = (image_fname, installed_fileinfo['length'],
+        tuple(sorted(installed_fileinfo['hashes'].items())))
+
+    with self._image_deltas_lock:
+      if key in self._image_deltas:
+        return self._image_deltas[key]
+
+      generation = self._image_deltas_generation
+
+      if not os.path.exists(self.image_deltas_dir):
+        os.makedirs(self.image_deltas_dir)
+      fd, delta_fname = tempfile.mkstemp(
+          suffix='.delta', dir=self.image_deltas_dir)
+      os.close(fd)
+
+    installed_image_fname = self.target_cache.find(
+        installed_fileinfo['length'], installed_fileinfo['hashes'])
+
+    if installed_image_fname is None:
+      os.remove(delta_fname)
+      delta_fname = None
+
+    elif uptane.delta.create_delta(installed_image_fname, image_fname,
+        delta_fname, max_length=max(os.path.getsize(image_fname) - 1, 0)) \
+        is None:
+      delta_fname = None
+
+    with self._image_deltas_lock:
+      if generation != self._image_deltas_generation:
+        # An update cycle started meanwhile, and may have replaced the image.
+        if delta_fname is not None and os.path.exists(delta_fname):
+          os.remove(delta_fname)
+        return None
+
+      self._image_deltas[key] = delta_fname
+
+    return delta_fname
+
+
+
+
+
+  def get_image_chunk_manifest(self, ecu_serial):
+    """
+    <Purpose>
+      For Secondaries that obtain their images in chunks (with
+      get_image_chunk), so that neither side need hold a whole image in
+      memory.
+
+      Returns None if there is no image to be distributed to the given ECU,
+      or else a description of the image and of its chunks, conforming to
+      uptane.formats.IMAGE_CHUNK_MANIFEST_SCHEMA. The chunk hashes are
+      computed once per update cycle for each image.
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with this Primary
+    """
+    self._check_ecu_serial(ecu_serial)
+
+    image_fname = self.get_image_fname_for_ecu(ecu_serial)
+
+    if image_fname is None:
+      return None
+
+    with self._image_chunk_manifests_lock:
+      if image_fname in self._image_chunk_manifests:
+        return self._image_chunk_manifests[image_fname]
+
+    chunk_hashes = []
+    length = 0
+    with open(image_fname, 'rb') as fobj:
+      while True:
+        chunk = fobj.read(IMAGE_CHUNK_SIZE)
+        if not chunk:
+          break
+        chunk_hashes.append(hashlib.sha256(chunk).hexdigest())
+        length += len(chunk)
+
+    chunk_manifest = {
+        'filepath': os.path.relpath(
+            image_fname, os.path.join(self.full_client_dir, 'targets')),
+        'length': length,
+        'chunk_size': IMAGE_CHUNK_SIZE,
+        'chunk_hashes': chunk_hashes}
+
+    uptane.formats.IMAGE_CHUNK_MANIFEST_SCHEMA.check_match(chunk_manifest)
+
+    with self._image_chunk_manifests_lock:
+      self._image_chunk_manifests[image_fname] = chunk_manifest
+
+    return chunk_manifest
+
+
+
+
+
+  def get_image_chunk(self, ecu_serial, offset, length):
+    """
+    <Purpose>
+      Returns (as bytes) length bytes, starting at offset, of the image to be
+      distributed to the given ECU (fewer at the end of the image), reading
+      only those bytes from disk. See get_image_chunk_manifest.
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with this Primary
+
+      uptane.Error
+        if there is no image to be distributed to the given ECU
+
+      tuf.FormatError
+        if offset or length is not a non-negative integer, or length is
+        greater than IMAGE_CHUNK_SIZE
+    """
+    self._check_ecu_serial(ecu_serial)
+    tuf.formats.LENGTH_SCHEMA.check_match(offset)
+    tuf.formats.LENGTH_SCHEMA.check_match(length)
+
+    if length > IMAGE_CHUNK_SIZE:
+      raise tuf.FormatError('Requested ' + str(length) + ' bytes of an image; '
+          'at most ' + str(IMAGE_CHUNK_SIZE) + ' can be requested at once.')
+
+    image_fname = self.get_image_fname_for_ecu(ecu_serial)
+
+    if image_fname is None:
+      raise uptane.Error('There is no image for ECU ' + repr(ecu_serial) + '.')
+
+    with open(image_fname, 'rb') as fobj:
+      fobj.seek(offset)
+      return fobj.read(length)
+
+
+
+
+
   def get_full_metadata_archive_fname(self):
     """
     Returns the absolute-path filename of an archive file (currently zip)
@@ -656,6 +1265,117 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def get_metadata_archive_for_ecu(self, ecu_serial):
+    """
+    <Purpose>
+      Returns (as bytes) a zip archive, like that at
+      get_full_metadata_archive_fname, of the metadata the given
+      Full-Verification Secondary needs to validate the target assigned to it.
+
+      If this Primary was configured with per_ecu_metadata_archives, the
+      archive includes, from each repository, the root, timestamp, snapshot
+      and top-level targets metadata, but only those delegated targets roles
+      that may list the target assigned to the ECU (by their paths or path
+      hash prefixes, followed down the delegation tree), which is all the
+      ECU's TUF updater reads to validate that target. The metadata is not
+      modified, so its signatures still hold. Otherwise, the full metadata
+      archive is returned.
+
+      Archives are built from the full metadata archive, once for each ECU
+      each time it or the target assignments change.
+
+    <Exceptions>
+      uptane.UnknownECU
+        if the given ecu_serial is not registered with this Primary
+
+      uptane.Error
+        if this Primary does not have any metadata to distribute yet
+    """
+    self._check_ecu_serial(ecu_serial)
+
+    if not self.per_ecu_metadata_archives:
+      return self._read_full_metadata_archive()
+
+    # The archive is built holding the lock, so that the update cycle cannot
+    # replace the full metadata archive or target assignments, and clear the
+    # archives built, between the reading of them and the caching of the
+    # result.
+    with self._ecu_metadata_archives_lock:
+      if ecu_serial not in self._ecu_metadata_archives:
+        self._ecu_metadata_archives[ecu_serial] = \
+            self._build_metadata_archive_for_ecu(ecu_serial)
+
+      return self._ecu_metadata_archives[ecu_serial]
+
+
+
+
+
+  def _read_full_metadata_archive(self):
+    """
+    Returns the distributable full metadata archive (bytes).
+    """
+    if not os.path.exists(self.distributable_full_metadata_archive_fname):
+      raise uptane.Error('This Primary does not have a collection of metadata '
+          'to distribute to Secondaries.')
+
+    with open(self.distributable_full_metadata_archive_fname, 'rb') as fobj:
+      return fobj.read()
+
+
+
+
+
+  def _build_metadata_archive_for_ecu(self, ecu_serial):
+    """
+    Returns the per-ECU metadata archive for the given ECU (see
+    get_metadata_archive_for_ecu), built from the full metadata archive.
+    """
+    full_archive = self._read_full_metadata_archive()
+
+    target_filepaths = []
+    if ecu_serial in self.assigned_targets:
+      target_filepaths.append(self.assigned_targets[ecu_serial]['filepath'])
+
+    archive_data = io.BytesIO()
+
+    with zipfile.ZipFile(io.BytesIO(full_archive)) as full, \
+        zipfile.ZipFile(archive_data, 'w', zipfile.ZIP_DEFLATED) as archive:
+
+      # The roles in the full archive, by repository.
+      roles = {}
+      for name in full.namelist():
+        repo_name, role_fname = name.split('/metadata/', 1)
+        roles.setdefault(repo_name, {})[role_fname[:-len('.json')]] = name
+
+      for repo_name, repo_roles in six.iteritems(roles):
+        needed = ['root', 'timestamp', 'snapshot']
+        to_visit = ['targets']
+
+        while to_visit:
+          rolename = to_visit.pop()
+          if rolename not in repo_roles or rolename in needed:
+            continue
+          needed.append(rolename)
+
+          delegations = json.loads(full.read(repo_roles[rolename]).decode(
+              'utf-8'))['signed'].get('delegations', {})
+          for delegated_role in delegations.get('roles', []):
+            if any(_role_may_list_target(delegated_role, filepath)
+                for filepath in target_filepaths):
+              to_visit.append(delegated_role['name'])
+
+        for rolename in needed:
+          if rolename in repo_roles:
+            archive.writestr(repo_roles[rolename], full.read(
+                repo_roles[rolename]))
+
+    return archive_data.getvalue()
+
+
+
+
+
   def get_partial_metadata_fname(self):
     """
     Returns the absolute-path filename of the Director's targets.json metadata
@@ -673,6 +1393,72 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
 
 
 
+  def get_metadata_fingerprint(self):
+    """
+    Returns a string identifying the set of metadata currently in the files
+    returned by get_full_metadata_archive_fname and get_partial_metadata_fname
+    (or None if this Primary has never completed an update cycle). The
+    fingerprint changes whenever that metadata changes, so a Secondary that
+    has the metadata for a given fingerprint need not obtain it again until
+    the fingerprint changes. See metadata_changed_since.
+    """
+    return self.metadata_fingerprint
+
+
+
+
+
+  def metadata_changed_since(self, fingerprint):
+    """
+    Returns False if the given fingerprint (from get_metadata_fingerprint) is
+    that of the metadata this Primary currently distributes, and True if the
+    metadata has changed since (or the fingerprint is not one this Primary
+    provided).
+    """
+    return self.metadata_fingerprint is None or \
+        fingerprint != self.metadata_fingerprint
+
+
+
+
+
+  def _compute_metadata_fingerprint(self):
+    """
+    Returns a fingerprint (see get_metadata_fingerprint) of the current
+    metadata from all repositories in the client metadata directory, or None
+    if it cannot be determined.
+
+    In TUF, the timestamp metadata from a repository identifies (by version
+    and hash) its snapshot metadata, which identifies the versions of all
+    its targets metadata, so the root, timestamp and snapshot metadata from
+    each repository identify the whole set. Those files are small, so they
+    are hashed whole, rather than parsed for their versions.
+    """
+    metadata_base_dir = os.path.join(self.full_client_dir, 'metadata')
+    fingerprint = hashlib.sha256()
+
+    try:
+      for repo_dir in sorted(os.listdir(metadata_base_dir)):
+        abs_repo_dir = os.path.join(metadata_base_dir, repo_dir, 'current')
+        if not os.path.isdir(abs_repo_dir):
+          continue
+
+        for rolename in ['root', 'timestamp', 'snapshot']:
+          with open(os.path.join(abs_repo_dir, rolename + '.json'), 'rb') \
+              as fobj:
+            fingerprint.update(repo_dir.encode('utf-8') + b'/' +
+                rolename.encode('utf-8') + b':' +
+                hashlib.sha256(fobj.read()).digest())
+
+    except EnvironmentError:
+      return None
+
+    return fingerprint.hexdigest()
+
+
+
+
+
   def update_exists_for_ecu(self, ecu_serial):
     """
     Returns True if the Director has sent us instructions for the Secondary ECU
@@ -742,23 +1528,29 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         'ecu_version_manifests': self.ecu_manifests
     }
 
-    uptane.formats.VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(vehicle_manifest)
-
-    # Wrap the vehicle version manifest object into an
-    # uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA and check format.
-    # {
-    #     'signed': vehicle_manifest,
-    #     'signatures': []
-    # }
-    signable_vehicle_manifest = tuf.formats.make_signable(vehicle_manifest)
-    uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
-        signable_vehicle_manifest)
-
-    # Now sign with that key.
-    signed_vehicle_manifest = sign_signable(
-        signable_vehicle_manifest, [self.primary_key])
-    uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
-        signed_vehicle_manifest)
+    # The contents of the vehicle manifest are checked against their schema
+    # three times below; the validation session means they are only walked
+    # once. (Signing adds only to the signatures, which are always checked.)
+    with uptane.fastschema.validation_session():
+      uptane.formats.VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
+          vehicle_manifest)
+
+      # Wrap the vehicle version manifest object into an
+      # uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA and check
+      # format.
+      # {
+      #     'signed': vehicle_manifest,
+      #     'signatures': []
+      # }
+      signable_vehicle_manifest = tuf.formats.make_signable(vehicle_manifest)
+      uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
+          signable_vehicle_manifest)
+
+      # Now sign with that key.
+      signed_vehicle_manifest = sign_signable(
+          signable_vehicle_manifest, [self.primary_key])
+      uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
+          signed_vehicle_manifest)
 
     # Now that the ECU manifests have been incorporated into a vehicle manifest,
     # discard the ECU manifests.
@@ -861,9 +1653,15 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     else:
       self.ecu_manifests[ecu_serial] = [signed_ecu_manifest]
 
+    # Note what the ECU reports having installed, in case we can send it a
+    # delta against that image later.
+    installed_image = signed_ecu_manifest['signed'].get('installed_image')
+    if tuf.formats.TARGETFILE_SCHEMA.matches(installed_image):
+      self.installed_images[ecu_serial] = installed_image
+
     # And add the nonce the Secondary provided to the list of nonces to send
     # in the next Timeserver request.
-    self.nonces_to_send.append(nonce)
+    self.nonce_ledger.add(nonce, self.all_valid_timeserver_times[-1])
 
 
     log.debug(GREEN + ' Primary received an ECU manifest from ECU ' +
@@ -889,9 +1687,7 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
      - empties self.nonces_to_send, to be populated from new messages from
        Secondaries.
     """
-    self.nonces_sent = self.nonces_to_send
-    self.nonces_to_send = []
-    return self.nonces_sent
+    return self.nonce_ledger.rotate()
 
 
 
@@ -913,14 +1709,18 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     to Secondaries.
     """
 
-    # Check format.
-    uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
-        timeserver_attestation)
+    # Check format. The attestation may be a batched one, which covers the
+    # requests of many Primaries with one signature (see
+    # uptane.common.get_attested_nonces).
+    if not uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.\
+        matches(timeserver_attestation):
+      uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+          timeserver_attestation)
 
     # Assume there's only one signature.
     assert len(timeserver_attestation['signatures']) == 1
 
-    valid = tuf.keys.verify_signature(
+    valid = uptane.common.verify_signature(
         self.timeserver_public_key,
         timeserver_attestation['signatures'][0],
         timeserver_attestation['signed'])
@@ -930,17 +1730,20 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
           'Time is questionable, so not saved. If you see this persistently, '
           'it is possible that there is a Man in the Middle attack underway.')
 
-    for nonce in self.nonces_sent:
-      if nonce not in timeserver_attestation['signed']['nonces']:
-        # TODO: Determine whether or not to add something to self.attacks_detected
-        # to indicate this problem. It's probably not certain enough? But perhaps
-        # we should err on the side of reporting.
-        # TODO: Create a new class for this Exception in this file.
-        raise uptane.BadTimeAttestation('Timeserver returned a time attestation'
-            ' that did not include one of the expected nonces. This time is '
-            'questionable and will not be registered. If you see this '
-            'persistently, it is possible that there is a Man in the Middle '
-            'attack underway.')
+    # For a batched attestation, this checks that the nonces accompanying it
+    # are covered by the signature.
+    attested_nonces = uptane.common.get_attested_nonces(timeserver_attestation)
+
+    if self.nonce_ledger.missing(attested_nonces):
+      # TODO: Determine whether or not to add something to self.attacks_detected
+      # to indicate this problem. It's probably not certain enough? But perhaps
+      # we should err on the side of reporting.
+      # TODO: Create a new class for this Exception in this file.
+      raise uptane.BadTimeAttestation('Timeserver returned a time attestation'
+          ' that did not include one of the expected nonces. This time is '
+          'questionable and will not be registered. If you see this '
+          'persistently, it is possible that there is a Man in the Middle '
+          'attack underway.')
 
 
     # Extract actual time from the timeserver's signed attestation.
@@ -953,17 +1756,34 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
     # not trust us).
     self.all_valid_timeserver_attestations.append(timeserver_attestation)
 
+    # Forget nonces that Secondaries sent long ago (by this time) and that
+    # have still not been sent to the Timeserver.
+    self.nonce_ledger.expire(new_timeserver_time)
+
 
 
 
 
   def save_distributable_metadata_files(self):
     """
-    # TODO: Docstring.
+    Writes the distributable metadata files for Secondaries (see
+    get_full_metadata_archive_fname and get_partial_metadata_fname) from the
+    current metadata, unless the metadata has not changed since they were
+    last written (see get_metadata_fingerprint), in which case nothing is
+    done.
     """
 
     metadata_base_dir = os.path.join(self.full_client_dir, 'metadata')
 
+    fingerprint = self._compute_metadata_fingerprint()
+
+    if fingerprint is not None and fingerprint == self.metadata_fingerprint \
+        and os.path.exists(self.distributable_full_metadata_archive_fname) \
+        and os.path.exists(self.distributable_partial_metadata_fname):
+      log.debug('Metadata has not changed; not rebuilding the distributable '
+          'metadata files.')
+      return
+
 
     # Save a gzipped version of all of the metadata.
     # TODO: <~> Update this for ASN.1 / BER.
@@ -1022,6 +1842,31 @@ class Primary(object): # Consider inheriting from Secondary and refactoring.
         self.temp_full_metadata_archive_fname,
         self.distributable_full_metadata_archive_fname)
 
+    with self._ecu_metadata_archives_lock:
+      self._ecu_metadata_archives = dict()
+
+    self.metadata_fingerprint = fingerprint
+
+
+
+
+
+def _role_may_list_target(delegated_role, target_filepath):
+  """
+  Returns True if the given delegated role (an entry in the 'roles' of a
+  targets role's 'delegations') is trusted for the given target filepath, by
+  its path hash prefixes or its paths (each a directory or file path, as TUF
+  matches them, or a glob pattern). This may err on the side of True.
+  """
+  if 'path_hash_prefixes' in delegated_role:
+    target_hash = tuf.util.get_target_hash(target_filepath)
+    return any(target_hash.startswith(prefix)
+        for prefix in delegated_role['path_hash_prefixes'])
+
+  return any(target_filepath.startswith(path) or
+      fnmatch.fnmatch(target_filepath, path)
+      for path in delegated_role.get('paths', []))
+
 
 
 
@@ -15,6 +15,10 @@ from io import open
 import uptane
 import uptane.formats
 import uptane.common
+import uptane.delta
+import uptane.clients.memorymirror
+import uptane.clients.nonceledger
+import uptane.clients.timehistory
 
 import tuf.client.updater
 import tuf.formats
@@ -22,8 +26,13 @@ import tuf.keys
 import tuf.repository_tool as rt
 
 import os # For paths and makedirs
+import io # to read the metadata archive from memory
 import shutil # For copyfile
 import random # for nonces
+import json # to read metadata expiration dates
+import time # to check metadata expiration dates
+import calendar # to check metadata expiration dates
+import hashlib # for image chunk hashes
 import zipfile # to expand the metadata archive retrieved from the Primary
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
@@ -33,6 +42,10 @@ log.addHandler(uptane.file_handler)
 log.addHandler(uptane.console_handler)
 log.setLevel(uptane.logging.DEBUG)
 
+# How many times receive_image_in_chunks requests a chunk of an image that
+# arrives damaged before giving up.
+CHUNK_ATTEMPTS = 3
+
 
 
 class Secondary(object):
@@ -75,9 +88,18 @@ class Secondary(object):
       The latest nonce this ECU sent to the Timeserver (via the Primary).
 
     all_valid_timeserver_times:
-      A list of all times extracted from all Timeserver attestations that have
-      been validated by validate_time_attestation.
-      Items are appended to the end.
+      A uptane.clients.timehistory.TimeHistory, which reads like a list, of
+      the latest times (at most time_history_depth of them, which must be at
+      least 2) extracted from Timeserver attestations that have been validated
+      by validate_time_attestation, starting with the time given to __init__,
+      twice. Items are appended to the end. If persist_time is True, the times
+      are also saved to <full_client_dir>/timeserver_times.json, and the saved
+      times are used in place of the time given to __init__ when a Secondary
+      is created with the same client directory.
+
+    self.metadata_fingerprint:
+      The fingerprint (per the Primary) of the metadata last successfully
+      processed by process_metadata, or None. See process_metadata.
 
 
   Methods, as called: ("self" arguments excluded):
@@ -94,11 +116,13 @@ class Secondary(object):
 
     Metadata handling and validation of metadata and data
       validate_time_attestation(timeserver_attestation)
-      process_metadata(metadata_archive_fname)
+      process_metadata(metadata_archive_fname, fingerprint=None)
       _expand_metadata_archive(metadata_archive_fname)
       fully_validate_metadata()
       get_validated_target_info(target_filepath)
       validate_image(image_fname)
+      receive_image_in_chunks(image_fname, chunk_manifest, get_chunk)
+      reconstruct_image_from_delta(image_fname, delta, installed_image_fname)
 
 
 
@@ -115,7 +139,9 @@ class Secondary(object):
     timeserver_public_key,
     firmware_fileinfo=None,
     director_public_key=None,
-    partial_verifying=False):
+    partial_verifying=False,
+    time_history_depth=uptane.clients.timehistory.DEFAULT_DEPTH,
+    persist_time=False):
 
     # Check arguments:
     tuf.formats.PATH_SCHEMA.check_match(full_client_dir)
@@ -126,6 +152,8 @@ class Secondary(object):
     for key in [timeserver_public_key, director_public_key]:
       if key is not None:
         tuf.formats.ANYKEY_SCHEMA.check_match(key)
+    tuf.formats.LENGTH_SCHEMA.check_match(time_history_depth)
+    tuf.formats.BOOLEAN_SCHEMA.check_match(persist_time)
 
     self.director_repo_name = director_repo_name
     self.ecu_key = ecu_key
@@ -149,12 +177,21 @@ class Secondary(object):
     # each repository.
     self.updater = tuf.client.updater.Updater('updater')
 
-    # We load the given time twice for simplicity in later code.
-    self.all_valid_timeserver_times = [time, time]
+    # We load the given time twice for simplicity in later code. (ECU
+    # Manifests include the latest two times.)
+    self.all_valid_timeserver_times = uptane.clients.timehistory.TimeHistory(
+        [time, time], time_history_depth, os.path.join(
+        full_client_dir, 'timeserver_times.json') if persist_time else None)
 
     self.last_nonce_sent = None
     self.nonce_next = self._create_nonce()
 
+    self.metadata_fingerprint = None
+
+    # The earliest expiration date (a UNIX timestamp) of the metadata
+    # validated when self.metadata_fingerprint was set.
+    self._metadata_expiration = None
+
 
 
 
@@ -246,14 +283,18 @@ class Secondary(object):
 
     If validation is successful, switch to a new nonce for next time.
     """
-    # Check format.
-    uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
-        timeserver_attestation)
+    # Check format. The attestation may be a batched one, which covers the
+    # requests of many Primaries with one signature (see
+    # uptane.common.get_attested_nonces).
+    if not uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.\
+        matches(timeserver_attestation):
+      uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+          timeserver_attestation)
 
     # Assume there's only one signature.
     assert len(timeserver_attestation['signatures']) == 1
 
-    valid = tuf.keys.verify_signature(
+    valid = uptane.common.verify_signature(
         self.timeserver_public_key,
         timeserver_attestation['signatures'][0],
         timeserver_attestation['signed'])
@@ -274,7 +315,10 @@ class Secondary(object):
           'Version Manifest to the Primary.' + ENDCOLORS)
       return
 
-    elif self.last_nonce_sent not in timeserver_attestation['signed']['nonces']:
+    # For a batched attestation, this checks that the nonces accompanying it
+    # are covered by the signature.
+    elif uptane.clients.nonceledger.missing_nonces([self.last_nonce_sent],
+        uptane.common.get_attested_nonces(timeserver_attestation)):
       # TODO: Create a new class for this Exception in this file.
       raise uptane.BadTimeAttestation('Primary provided a time attestation '
           'that did not include any of the nonces this Secondary has sent '
@@ -396,22 +440,153 @@ class Secondary(object):
 
 
 
-  def process_metadata(self, metadata_archive_fname):
+  def process_metadata(self, metadata_archive_fname, fingerprint=None):
     """
     Expand the metadata archive using _expand_metadata_archive()
     Validate metadata files using fully_validate_metadata()
     Select the Director targets.json file
     Pick out the target file(s) with our ECU serial listed
     Fully validate the metadata for the target file(s)
+
+    If a fingerprint is given (from the Primary's get_metadata_fingerprint),
+    it is saved as self.metadata_fingerprint once the metadata is validated.
+    If it is the fingerprint of the metadata already processed, nothing is
+    done (the archive need not even exist): the metadata has not changed, so
+    the target info validated from it last time stands. That fast path is not
+    taken once any of the validated metadata has expired, so a Primary
+    cannot use it to keep this Secondary on stale metadata indefinitely (just
+    as it could not by withholding new metadata).
     """
     #
     tuf.formats.RELPATH_SCHEMA.check_match(metadata_archive_fname)
 
+    if self._metadata_unchanged(fingerprint):
+      return
+
+    self.metadata_fingerprint = None
+
     self._expand_metadata_archive(metadata_archive_fname)
 
     # This entails using the local metadata files as a repository.
     self.fully_validate_metadata()
 
+    self._set_metadata_fingerprint(fingerprint)
+
+
+
+
+
+  def process_metadata_from_memory(self, metadata_archive, fingerprint=None):
+    """
+    Like process_metadata, but takes the metadata archive itself (bytes, as
+    sent by the Primary) rather than the name of a file it has been saved to,
+    and validates the metadata in it without writing it to disk: TUF reads the
+    unverified metadata from memory (see uptane.clients.memorymirror), so the
+    only metadata written is what it validates and saves as current.
+
+    metadata_archive may be None if the fingerprint given is that of the
+    metadata already processed (as when the Primary does not send metadata
+    that has not changed); see process_metadata.
+    """
+    if self._metadata_unchanged(fingerprint):
+      return
+
+    if metadata_archive is None:
+      raise uptane.Error('No metadata archive was given, and the metadata '
+          'fingerprint given is not that of the metadata already validated.')
+
+    self.metadata_fingerprint = None
+
+    unverified_dir = os.path.abspath(
+        os.path.join(self.full_client_dir, 'unverified'))
+
+    with uptane.clients.memorymirror.MemoryMirror(unverified_dir,
+        self._read_metadata_archive(metadata_archive, unverified_dir)):
+      self.fully_validate_metadata()
+
+    self._set_metadata_fingerprint(fingerprint)
+
+
+
+
+
+  def _metadata_unchanged(self, fingerprint):
+    """
+    Returns True if the given metadata fingerprint (which may be None) is that
+    of the metadata already processed and none of it has expired, in which
+    case it need not be processed again. See process_metadata.
+    """
+    if fingerprint is not None and fingerprint == self.metadata_fingerprint \
+        and not self._metadata_expired():
+      log.debug('Metadata from Primary has not changed; not processing it '
+          'again.')
+      return True
+
+    return False
+
+
+
+
+
+  def _set_metadata_fingerprint(self, fingerprint):
+    """
+    Records the given fingerprint (if not None) as that of the metadata just
+    validated, along with when that metadata expires.
+    """
+    if fingerprint is not None:
+      self._metadata_expiration = self._get_earliest_metadata_expiration()
+      self.metadata_fingerprint = fingerprint
+
+
+
+
+
+  def _get_earliest_metadata_expiration(self):
+    """
+    Returns the earliest expiration date (as a UNIX timestamp) of the current
+    (validated) metadata from all repositories, or None if it cannot be
+    determined.
+    """
+    metadata_base_dir = os.path.join(self.full_client_dir, 'metadata')
+    expirations = []
+
+    try:
+      for repo_dir in os.listdir(metadata_base_dir):
+        abs_repo_dir = os.path.join(metadata_base_dir, repo_dir, 'current')
+        if not os.path.isdir(abs_repo_dir):
+          continue
+        for role_fname in os.listdir(abs_repo_dir):
+          if not role_fname.endswith('.json'):
+            continue
+          with open(os.path.join(abs_repo_dir, role_fname), 'rb') as fobj:
+            expires = json.loads(fobj.read().decode('utf-8'))['signed'][
+                'expires']
+          expirations.append(calendar.timegm(
+              time.strptime(expires, '%Y-%m-%dT%H:%M:%SZ')))
+
+    except (EnvironmentError, ValueError, KeyError, TypeError):
+      return None
+
+    return min(expirations) if expirations else None
+
+
+
+
+
+  def _metadata_expired(self):
+    """
+    Returns True if any of the metadata validated when
+    self.metadata_fingerprint was set has expired (or its expiration is not
+    known), by the system clock or by the latest validated Timeserver time.
+    """
+    if self._metadata_expiration is None:
+      return True
+
+    now = max(time.time(), calendar.timegm(time.strptime(
+        self.all_valid_timeserver_times[-1], '%Y-%m-%dT%H:%M:%SZ')))
+
+    return now >= self._metadata_expiration
+
 
 
 
@@ -432,6 +607,35 @@ class Secondary(object):
 
 
 
+  def _read_metadata_archive(self, metadata_archive, unverified_dir):
+    """
+    Returns a dict mapping the path each file in the given metadata archive
+    (bytes) would be extracted to, under unverified_dir, to its contents.
+    """
+    files = {}
+
+    try:
+      with zipfile.ZipFile(io.BytesIO(metadata_archive)) as z:
+        for name in z.namelist():
+          if name.endswith('/'): # a directory
+            continue
+
+          fname = os.path.normpath(os.path.join(unverified_dir, name))
+          if not fname.startswith(os.path.join(unverified_dir, '')):
+            raise uptane.Error('Metadata archive contains a file outside the '
+                'metadata directories: ' + repr(name))
+
+          files[fname] = z.read(name)
+
+    except zipfile.BadZipfile:
+      raise uptane.Error('Metadata archive from Primary is not a zip file.')
+
+    return files
+
+
+
+
+
   def validate_image(self, image_fname):
     """
 
@@ -483,7 +687,35 @@ class Secondary(object):
         self.full_client_dir, 'unverified_targets', image_fname)
 
     # Get target info by looking up fname (filepath).
+    relevant_targetinfo = self._get_validated_target_info_for_image(
+        image_fname)
+
+
+    # Check file length and hashes against trusted target info, in one read
+    # of the file.
+    uptane.common.validate_file(full_image_fname,
+        relevant_targetinfo['fileinfo']['length'],
+        relevant_targetinfo['fileinfo']['hashes'])
+
+
+    # If no error has been raised at this point, the image file is fully
+    # validated and we can return.
+    log.debug('Delivered target file has been fully validated: ' +
+        repr(full_image_fname))
+
+
+
+
+
+
+
 
+  def _get_validated_target_info_for_image(self, image_fname):
+    """
+    Returns the validated target info for this ECU whose filepath is
+    image_fname (without any leading '/'), raising uptane.Error if there is
+    none. See validate_image.
+    """
     relevant_targetinfo = None
 
     for targetinfo in self.validated_targets_for_this_ecu:
@@ -503,39 +735,166 @@ class Secondary(object):
           'for this is extremely small between two individually-atomic '
           'renames), or there has been a programming error....')
 
+    return relevant_targetinfo
 
-    # Check file length against trusted target info.
-    with open(full_image_fname, 'rb') as fobj:
-      tuf.client.updater.hard_check_file_length(
-          fobj,
-          relevant_targetinfo['fileinfo']['length'])
 
-      # # Read the entire contents of 'file_object', a 'tuf.util.TempFile' file-
-      # # like object that ensures the entire file is read.
-      # observed_length = len(fobj.read())
 
-      # trusted_file_length = relevant_targetinfo['fileinfo']['length']
 
-      # if observed_length != trusted_file_length:
-      #   raise tuf.DownloadLengthMismatchError(
-      #       trusted_file_length, observed_length)
 
-      # else:
-      #   log.debug('Observed length (' + repr(observed_length) +
-      #       ') == trusted length (' + repr(trusted_file_length) + ')')
+  def receive_image_in_chunks(self, image_fname, chunk_manifest, get_chunk):
+    """
+    Obtains the image with filename image_fname from the Primary in chunks,
+    writing each to disk (where validate_image expects an image received from
+    the Primary) and hashing it as it arrives, so that memory use does not
+    depend on the size of the image. The image is validated against the
+    validated target info for it as it is received: if this method completes
+    without raising an exception, the image file is valid, exactly as if
+    validate_image had been called on it. If it raises one (including any
+    raised by get_chunk), no image file is left behind.
+
+    Arguments:
 
-    # Check file hashes against trusted target info.
-    with open(full_image_fname, 'rb') as fobj:
-      tuf.client.updater.check_hashes(
-          fobj, # FIX
-          relevant_targetinfo['fileinfo']['hashes'],
-          reset_fpointer=True) # Important for multiple hashes
+      image_fname
+        The filename of the image, as for validate_image.
 
+      chunk_manifest
+        The Primary's description of the image's chunks, conforming to
+        uptane.formats.IMAGE_CHUNK_MANIFEST_SCHEMA.
+
+      get_chunk
+        A function that, given an offset and a length, returns (as bytes) that
+        part of the image from the Primary (e.g. calling the Primary's
+        get_image_chunk). A chunk that does not match its hash in the chunk
+        manifest is requested again, up to CHUNK_ATTEMPTS times in all.
+
+    Exceptions:
+
+      uptane.Error
+        if there is no validated target info for the given filename, or the
+        chunk manifest is for a different image.
+
+      tuf.DownloadLengthMismatchError
+        if the image (per the chunk manifest) does not have the expected
+        length based on validated target info, or a chunk is repeatedly of
+        the wrong length
+
+      tuf.BadHashError
+        if the image does not have the expected hashes based on validated
+        target info, or a chunk repeatedly does not match its hash in the
+        chunk manifest
+
+      tuf.FormatError
+        if the arguments are not correctly formatted.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(image_fname)
+    uptane.formats.IMAGE_CHUNK_MANIFEST_SCHEMA.check_match(chunk_manifest)
+
+    relevant_targetinfo = self._get_validated_target_info_for_image(
+        image_fname)
+    trusted_length = relevant_targetinfo['fileinfo']['length']
+    trusted_hashes = relevant_targetinfo['fileinfo']['hashes']
+
+    if chunk_manifest['filepath'] != image_fname:
+      raise uptane.Error('Chunk manifest from Primary is for image ' +
+          repr(chunk_manifest['filepath']) + ', not ' + repr(image_fname))
+
+    # Check the length before transferring anything.
+    if chunk_manifest['length'] != trusted_length:
+      raise tuf.DownloadLengthMismatchError(
+          trusted_length, chunk_manifest['length'])
+
+    chunk_size = chunk_manifest['chunk_size']
+    if len(chunk_manifest['chunk_hashes']) != \
+        (trusted_length + chunk_size - 1) // chunk_size:
+      raise tuf.FormatError('Chunk manifest lists the wrong number of chunks '
+          'for the image length.')
+
+    validator = uptane.common.FileValidator(trusted_length, trusted_hashes)
+
+    full_image_fname = os.path.join(
+        self.full_client_dir, 'unverified_targets', image_fname)
+    if not os.path.exists(os.path.dirname(full_image_fname)):
+      os.makedirs(os.path.dirname(full_image_fname))
+
+    try:
+      with open(full_image_fname, 'wb') as fobj:
+        for index, chunk_hash in enumerate(chunk_manifest['chunk_hashes']):
+          offset = index * chunk_size
+          length = min(chunk_size, trusted_length - offset)
+
+          for attempt in range(CHUNK_ATTEMPTS):
+            chunk = bytes(get_chunk(offset, length))
+            if len(chunk) == length and \
+                hashlib.sha256(chunk).hexdigest() == chunk_hash:
+              break
+            log.debug('Chunk at offset ' + str(offset) + ' of ' +
+                repr(image_fname) + ' is damaged; requesting it again.')
+          else:
+            if len(chunk) != length:
+              raise tuf.DownloadLengthMismatchError(length, len(chunk))
+            raise tuf.BadHashError(
+                chunk_hash, hashlib.sha256(chunk).hexdigest())
+
+          validator.update(chunk)
+          fobj.write(chunk)
+
+      validator.check()
+
+    except Exception:
+      # Leave no partially received image, which validate_image would find.
+      if os.path.exists(full_image_fname):
+        os.remove(full_image_fname)
+      raise
 
-    # If no error has been raised at this point, the image file is fully
-    # validated and we can return.
     log.debug('Delivered target file has been fully validated: ' +
         repr(full_image_fname))
 
 
 
+
+
+  def reconstruct_image_from_delta(
+      self, image_fname, delta, installed_image_fname):
+    """
+    Reconstructs the image with filename image_fname from a delta (bytes, see
+    uptane/delta.py) provided by the Primary and the image this ECU has
+    installed, writing it where validate_image expects an image received
+    from the Primary: the 'unverified_targets' subdirectory of the client
+    directory. The reconstructed image must then be validated with
+    validate_image, exactly as an image received whole would be.
+
+    Arguments:
+
+      image_fname
+        The filename of the image to reconstruct, as for validate_image.
+
+      delta
+        The delta received from the Primary.
+
+      installed_image_fname
+        The full filename of the image this ECU has installed (described by
+        self.firmware_fileinfo), against which the Primary made the delta.
+
+    Exceptions:
+
+      uptane.BadDelta
+        if the delta is malformed or was not made against an image of the
+        installed image's length.
+
+      tuf.FormatError
+        if the given image_fname is not a path.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(image_fname)
+    tuf.formats.PATH_SCHEMA.check_match(installed_image_fname)
+
+    unverified_targets_dir = os.path.join(
+        self.full_client_dir, 'unverified_targets')
+    full_image_fname = os.path.join(unverified_targets_dir, image_fname)
+
+    if not os.path.exists(os.path.dirname(full_image_fname)):
+      os.makedirs(os.path.dirname(full_image_fname))
+
+    uptane.delta.apply_delta(installed_image_fname, delta, full_image_fname)
+
+    log.debug('Reconstructed image ' + repr(image_fname) + ' from a delta of '
+        + str(len(delta)) + ' bytes.')
@@ -0,0 +1,284 @@
+"""
+<Program Name>
+  targetcache.py
+
+<Purpose>
+  Lets an Uptane client reuse target files it already has on disk instead of
+  downloading them again, when they match the trusted length and hashes of
+  the target it is instructed to obtain.
+
+  To avoid re-hashing unchanged files (e.g. large firmware images) every
+  update cycle, the cache keeps an index of the hashes of the files it has
+  seen, keyed by filename, size and modification time, and persists it to a
+  JSON file. A file whose size or modification time has changed since it was
+  indexed is hashed again. The index also allows a file to be found by its
+  content (length and hashes), wherever it is.
+
+  Changes to the index are persisted only when save() is called (e.g. once
+  per update cycle), rather than on each change. As the index is only an
+  optimization, changes lost if the client stops before then only cost some
+  hashing later.
+
+  Use:
+    cache = TargetCache('<client dir>/target_cache.json')
+    if not cache.matches(full_fname, trusted_length, trusted_hashes):
+      <download the target to full_fname>
+      cache.record(full_fname, trusted_hashes)
+    cache.save()
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import uptane.common
+import tuf
+import tuf.formats
+
+import os
+import json
+import threading
+
+import six
+
+log = uptane.logging.getLogger('targetcache')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+
+
+class TargetCache(object):
+  """
+  An index of the hashes of target files on disk. See the module docstring.
+  Safe to use from several threads at once.
+
+  Fields:
+
+    index_fname
+      The filename of the JSON file the index is persisted to.
+
+    index
+      A dict mapping the absolute filename of each indexed file to a dict with
+      the file's 'length', 'mtime' (as of hashing) and 'hashes' (a dict
+      mapping hash algorithm to hex digest, conforming to
+      tuf.formats.HASHDICT_SCHEMA).
+  """
+
+  def __init__(self, index_fname):
+
+    tuf.formats.PATH_SCHEMA.check_match(index_fname)
+
+    self.index_fname = index_fname
+    self.index = {}
+    self._lock = threading.Lock()
+
+    # Whether the index has changed since it was last saved.
+    self._unsaved = False
+
+    if os.path.exists(index_fname):
+      try:
+        with open(index_fname, 'r') as fobj:
+          index = json.load(fobj)
+        _check_index(index)
+
+      except (EnvironmentError, ValueError, tuf.FormatError):
+        # The index is only an optimization: start over.
+        log.warning('Ignoring unreadable target cache index ' +
+            repr(index_fname))
+
+      else:
+        self.index = index
+
+
+
+  def matches(self, fname, length, hashes):
+    """
+    Returns True if the file fname exists and has the given length and hashes
+    (conforming to tuf.formats.LENGTH_SCHEMA and tuf.formats.HASHDICT_SCHEMA),
+    using the indexed hashes of the file if it has not changed since it was
+    indexed.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+    tuf.formats.LENGTH_SCHEMA.check_match(length)
+    tuf.formats.HASHDICT_SCHEMA.check_match(hashes)
+
+    fname = os.path.abspath(fname)
+
+    try:
+      stat = os.stat(fname)
+    except OSError:
+      return False
+
+    if stat.st_size != length:
+      return False
+
+    observed_hashes = self._get_hashes(fname, stat, list(hashes))
+
+    return observed_hashes is not None and all(
+        observed_hashes[algorithm] == hashes[algorithm] for algorithm in hashes)
+
+
+
+  def find(self, length, hashes):
+    """
+    Returns the filename of an indexed file that has the given length and
+    hashes and has not changed since it was indexed, or None if there is
+    none.
+    """
+    tuf.formats.LENGTH_SCHEMA.check_match(length)
+    tuf.formats.HASHDICT_SCHEMA.check_match(hashes)
+
+    with self._lock:
+      candidates = [fname for fname, entry in six.iteritems(self.index)
+          if entry['length'] == length and all(entry['hashes'].get(algorithm)
+          == hashes[algorithm] for algorithm in hashes)]
+
+    for fname in candidates:
+      if self.matches(fname, length, hashes):
+        return fname
+
+    return None
+
+
+
+  def record(self, fname, hashes):
+    """
+    Indexes the file fname as having the given hashes (which must already
+    have been checked, e.g. by the download of the file), so that it need not
+    be hashed to be checked later.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+    tuf.formats.HASHDICT_SCHEMA.check_match(hashes)
+
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+
+    with self._lock:
+      self.index[fname] = {'length': stat.st_size, 'mtime': stat.st_mtime,
+          'hashes': dict(hashes)}
+      self._unsaved = True
+
+
+
+  def get_hashes(self, fname):
+    """
+    Returns the indexed hashes of the file fname (a dict like that given to
+    record), or None if the file is not indexed or has changed since it was.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+
+    fname = os.path.abspath(fname)
+
+    try:
+      stat = os.stat(fname)
+    except OSError:
+      return None
+
+    with self._lock:
+      entry = self.index.get(fname)
+      if entry is None or entry['length'] != stat.st_size or \
+          entry['mtime'] != stat.st_mtime or not entry['hashes']:
+        return None
+      return dict(entry['hashes'])
+
+
+
+  def forget(self, fname):
+    """
+    Removes the file fname (which need not exist any more) from the index.
+    """
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+
+    with self._lock:
+      if self.index.pop(os.path.abspath(fname), None) is not None:
+        self._unsaved = True
+
+
+
+  def save(self):
+    """
+    Persists the index if it has changed since it was last saved, writing a
+    temporary file and moving it into place so that the index file is never
+    partially written.
+    """
+    with self._lock:
+      if not self._unsaved:
+        return
+
+      index_dir = os.path.dirname(os.path.abspath(self.index_fname))
+      if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+      temp_fname = self.index_fname + '.tmp'
+      with open(temp_fname, 'w') as fobj:
+        json.dump(self.index, fobj)
+      os.rename(temp_fname, self.index_fname)
+
+      self._unsaved = False
+
+
+
+  def _get_hashes(self, fname, stat, algorithms):
+    """
+    Returns a dict mapping each of the given hash algorithms to the hex digest
+    of the file fname (whose os.stat result is stat), hashing the file only
+    if the index does not have those hashes for the file as it is now. Returns
+    None if an algorithm is not supported.
+    """
+    with self._lock:
+      entry = self.index.get(fname)
+
+      if entry is None or entry['length'] != stat.st_size or \
+          entry['mtime'] != stat.st_mtime:
+        entry = {'length': stat.st_size, 'mtime': stat.st_mtime, 'hashes': {}}
+
+      missing = [algorithm for algorithm in algorithms
+          if algorithm not in entry['hashes']]
+
+    if missing:
+      log.debug('Hashing ' + repr(fname) + ' for the target cache.')
+      try:
+        new_hashes = uptane.common.hash_file(fname, missing)
+      except tuf.UnsupportedAlgorithmError:
+        return None
+
+      # If the file changed while it was hashed, do not index the result.
+      if os.stat(fname).st_mtime != stat.st_mtime:
+        return None
+
+      with self._lock:
+        entry = dict(entry, hashes=dict(entry['hashes']))
+        entry['hashes'].update(new_hashes)
+        self.index[fname] = entry
+        self._unsaved = True
+
+    return entry['hashes']
+
+
+
+
+
+def _check_index(index):
+  """
+  Raises tuf.FormatError if index (as loaded from an index file) is not a
+  dict like TargetCache.index.
+  """
+  if not isinstance(index, dict):
+    raise tuf.FormatError('Expected a dict of indexed files; got ' +
+        repr(type(index)))
+
+  for fname, entry in six.iteritems(index):
+    tuf.formats.PATH_SCHEMA.check_match(fname)
+
+    if not isinstance(entry, dict) or \
+        set(entry) != set(['length', 'mtime', 'hashes']):
+      raise tuf.FormatError('Unexpected target cache entry for ' +
+          repr(fname) + ': ' + repr(entry))
+
+    tuf.formats.LENGTH_SCHEMA.check_match(entry['length'])
+    tuf.formats.HASHDICT_SCHEMA.check_match(entry['hashes'])
+
+    if not isinstance(entry['mtime'], (six.integer_types, float)):
+      raise tuf.FormatError('Unexpected modification time for ' +
+          repr(fname) + ': ' + repr(entry['mtime']))
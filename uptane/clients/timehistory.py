@@ -0,0 +1,176 @@
+"""
+<Program Name>
+  timehistory.py
+
+<Purpose>
+  Keeps the latest Timeserver times an Uptane client has validated, for as
+  long as the client runs, without growing: only the last few are kept (a
+  client only ever reads the last one or two), in a ring buffer.
+
+  Optionally, the times kept are also saved to a file each time one is
+  added, so that a client that restarts resumes from the latest time it had
+  validated rather than from the initial time it is given. The file is
+  written to a temporary file and moved into place, so it is never partially
+  written.
+
+  A TimeHistory reads like a list of times (conforming to
+  tuf.formats.ISO8601_DATETIME_SCHEMA), oldest first, and compares equal to a
+  list of the same times.
+
+  Use:
+    times = TimeHistory([initial_time], depth=10,
+        fname='<client dir>/timeserver_times.json')
+    times.append(<newly validated time>)
+    latest = times[-1]
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import tuf
+import tuf.formats
+
+import os
+import json
+import collections
+
+log = uptane.logging.getLogger('timehistory')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# The number of times kept by default.
+DEFAULT_DEPTH = 10
+
+
+
+class TimeHistory(object):
+  """
+  The latest validated Timeserver times. See the module docstring.
+
+  Fields:
+
+    depth
+      The most times kept.
+
+    fname
+      The file the times are saved to, or None if they are not saved.
+  """
+
+  def __init__(self, initial_times, depth=DEFAULT_DEPTH, fname=None):
+    """
+    Starts with the times saved in fname if it is given and can be read, and
+    otherwise with initial_times (a non-empty list). If fewer times are saved
+    than are in initial_times, the earliest saved time is repeated in their
+    place, so that at least as many times are always available.
+    """
+    for time in initial_times:
+      tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(time)
+    tuf.formats.LENGTH_SCHEMA.check_match(depth)
+    if fname is not None:
+      tuf.formats.PATH_SCHEMA.check_match(fname)
+
+    if not initial_times or depth < len(initial_times):
+      raise tuf.FormatError('A time history must start with at least one '
+          'time, and be deep enough for the times it starts with.')
+
+    self.depth = depth
+    self.fname = fname
+    self._times = collections.deque(maxlen=depth)
+
+    times = self._load() if fname is not None else None
+
+    if times:
+      times = [times[0]] * (len(initial_times) - len(times)) + times
+    else:
+      times = initial_times
+
+    self._times.extend(times)
+
+
+
+  def append(self, time):
+    """
+    Adds the given time (the latest validated), dropping the oldest time if
+    depth times are already kept, and saves the times if so configured.
+    """
+    tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(time)
+
+    self._times.append(time)
+
+    if self.fname is not None:
+      self._save()
+
+
+
+  def __getitem__(self, index):
+    return self._times[index]
+
+
+
+  def __len__(self):
+    return len(self._times)
+
+
+
+  def __iter__(self):
+    return iter(self._times)
+
+
+
+  def __eq__(self, other):
+    try:
+      return list(self._times) == list(other)
+    except TypeError:
+      return NotImplemented
+
+
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+
+
+  def __repr__(self):
+    return 'TimeHistory(' + repr(list(self._times)) + ')'
+
+
+
+  def _load(self):
+    """
+    Returns the times saved in self.fname, or None if there are none or they
+    cannot be read.
+    """
+    if not os.path.exists(self.fname):
+      return None
+
+    try:
+      with open(self.fname, 'r') as fobj:
+        times = json.load(fobj)
+      for time in times:
+        tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(time)
+
+    except (EnvironmentError, ValueError, TypeError, tuf.FormatError):
+      log.warning('Ignoring unreadable saved Timeserver times in ' +
+          repr(self.fname))
+      return None
+
+    return times[-self.depth:]
+
+
+
+  def _save(self):
+    """
+    Saves the times to self.fname, writing a temporary file and moving it into
+    place.
+    """
+    times_dir = os.path.dirname(os.path.abspath(self.fname))
+    if not os.path.exists(times_dir):
+      os.makedirs(times_dir)
+
+    temp_fname = self.fname + '.tmp'
+    with open(temp_fname, 'w') as fobj:
+      json.dump(list(self._times), fobj)
+    os.rename(temp_fname, self.fname)
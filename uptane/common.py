@@ -5,15 +5,108 @@ the future.
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import uptane
+import uptane.formats
+import uptane.merkle
 import tuf
 import tuf.formats
+import tuf.keys
+import tuf.ed25519_keys
 import json
 import os
 import shutil
 import copy
+import binascii
+import collections
+import hashlib
+import mmap
+import threading
 
 SUPPORTED_KEY_TYPES = ['ed25519', 'rsa']
 
+# The maximum number of canonical JSON encodings kept by encode_canonical().
+CANONICAL_CACHE_SIZE = 4096
+
+# Maps a digest of an object's content (see _content_digest) to the canonical
+# JSON encoding of the object, as UTF-8 bytes, least recently used first.
+_canonical_cache = collections.OrderedDict()
+_canonical_cache_lock = threading.Lock()
+
+# Whether or not ed25519 signatures can be verified using PyNaCl (otherwise,
+# TUF's pure Python implementation is used).
+try:
+  import nacl.signing
+  _USE_PYNACL = True
+except ImportError: # pragma: no cover
+  _USE_PYNACL = False
+
+def _content_digest(obj):
+  """
+  Returns a digest identifying the content of the given JSON-compatible object
+  along with the serialization the digest is of, or None if the object cannot
+  be serialized. This uses the json module's C
+  encoder, which is much faster than producing canonical JSON, and maps
+  different objects to different strings (except that it converts non-string
+  dictionary keys, which canonical JSON does not allow, to strings).
+  """
+  try:
+    text = json.dumps(
+        obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+  except (TypeError, ValueError):
+    return None
+
+  return hashlib.sha256(text.encode('utf-8')).digest(), text
+
+
+
+
+
+def _cache_canonical(digest, encoding):
+  with _canonical_cache_lock:
+    _canonical_cache[digest] = encoding
+    while len(_canonical_cache) > CANONICAL_CACHE_SIZE:
+      _canonical_cache.popitem(last=False)
+
+
+
+
+
+def encode_canonical(obj):
+  """
+  Returns the canonical JSON encoding of the given object (as produced by
+  tuf.formats.encode_canonical), as UTF-8 bytes - the bytes that are signed
+  when the object is signed.
+
+  Encodings are memoized by the content of the object, in a least-recently-used
+  cache of CANONICAL_CACHE_SIZE entries, so an object that is signed or
+  verified repeatedly (or verified, stored and re-verified, or received again
+  unchanged) is only encoded once. Changing an object changes its content, so
+  a modified object is never given a stale encoding.
+
+  Raises tuf.FormatError if the object cannot be encoded as canonical JSON.
+  """
+  digest_and_text = _content_digest(obj)
+
+  if digest_and_text is not None:
+    digest = digest_and_text[0]
+    with _canonical_cache_lock:
+      if digest in _canonical_cache:
+        # Mark the entry as most recently used.
+        encoding = _canonical_cache.pop(digest)
+        _canonical_cache[digest] = encoding
+        return encoding
+
+  encoding = tuf.formats.encode_canonical(obj).encode('utf-8')
+
+  if digest_and_text is not None:
+    _cache_canonical(digest_and_text[0], encoding)
+
+  return encoding
+
+
+
+
+
 def sign_signable(signable, keys_to_sign_with):
   """
   Signs the given signable (e.g. an ECU manifest) with all the given keys.
@@ -63,7 +156,7 @@ def sign_signable(signable, keys_to_sign_with):
     # Else, all is well. Sign the signable with the given key, adding that
     # signature to the signatures list in the signable.
     signable['signatures'].append(
-        tuf.keys.create_signature(signing_key, signable['signed']))
+        create_signature(signing_key, signable['signed']))
 
 
   # Confirm that the formats match what is expected post-signing, including a
@@ -81,6 +174,156 @@ def sign_signable(signable, keys_to_sign_with):
 
 
 
+def create_signature(key, signed):
+  """
+  Equivalent to tuf.keys.create_signature, but using the memoized canonical
+  encoding of the signed object (see encode_canonical).
+  """
+  tuf.formats.ANYKEY_SCHEMA.check_match(key)
+
+  if key['keytype'] != 'ed25519':
+    return tuf.keys.create_signature(key, signed)
+
+  sig, method = tuf.ed25519_keys.create_signature(
+      binascii.unhexlify(key['keyval']['public'].encode('utf-8')),
+      binascii.unhexlify(key['keyval']['private'].encode('utf-8')),
+      encode_canonical(signed))
+
+  return {
+      'keyid': key['keyid'],
+      'method': method,
+      'sig': binascii.hexlify(sig).decode('utf-8')}
+
+
+
+
+
+def verify_signature(key, signature, signed):
+  """
+  Equivalent to tuf.keys.verify_signature, but using the memoized canonical
+  encoding of the signed object (see encode_canonical). Returns True if the
+  signature is valid and False otherwise.
+  """
+  return verify_signatures([(key, signature, signed)])[0]
+
+
+
+
+
+def verify_signatures(signatures_to_verify):
+  """
+  Verifies a batch of signatures, returning a list of booleans, True for each
+  signature that is valid, in the same order as the argument.
+
+  This gives the same results as calling tuf.keys.verify_signature on each
+  element, but does less work when many signatures are verified at once (e.g.
+  all the ECU Manifests in a Vehicle Manifest):
+
+    - each distinct signed object (by identity) is encoded as canonical JSON
+      only once, even if it has several signatures to check, and encodings
+      are memoized across calls (see encode_canonical)
+    - each distinct ed25519 public key is decoded only once
+    - ed25519 signatures are verified directly over the encoded bytes.
+
+  Neither PyNaCl nor TUF's pure Python ed25519 implementation offers batch
+  verification of ed25519 signatures, so each signature is still checked
+  individually. Other key types are handed to tuf.keys.verify_signature.
+
+  Arguments:
+
+    signatures_to_verify:
+      A list of (key, signature, signed) tuples, where key conforms to
+      tuf.formats.ANYKEY_SCHEMA, signature conforms to
+      tuf.formats.SIGNATURE_SCHEMA, and signed is the object (e.g. the 'signed'
+      element of a signable) that the signature is purportedly over.
+
+  Exceptions:
+
+    tuf.FormatError
+      if any key or signature is improperly formatted
+
+    tuf.UnknownMethodError
+      if a signature uses an unsupported signing method
+  """
+
+  encoded_data = {} # id(signed) -> canonical JSON bytes, see encode_canonical
+  decoded_keys = {} # public key hex string -> bytes
+  results = []
+
+  for key, signature, signed in signatures_to_verify:
+
+    tuf.formats.ANYKEY_SCHEMA.check_match(key)
+    tuf.formats.SIGNATURE_SCHEMA.check_match(signature)
+
+    if key['keytype'] != 'ed25519':
+      results.append(tuf.keys.verify_signature(key, signature, signed))
+      continue
+
+    # The objects in signatures_to_verify are all alive for the duration of
+    # this call, so ids are not reused among them.
+    if id(signed) not in encoded_data:
+      encoded_data[id(signed)] = encode_canonical(signed)
+
+    public = key['keyval']['public']
+    if public not in decoded_keys:
+      decoded_keys[public] = binascii.unhexlify(public.encode('utf-8'))
+
+    results.append(tuf.ed25519_keys.verify_signature(
+        decoded_keys[public],
+        signature['method'],
+        binascii.unhexlify(signature['sig'].encode('utf-8')),
+        encoded_data[id(signed)],
+        use_pynacl=_USE_PYNACL))
+
+  return results
+
+
+
+
+
+def get_attested_nonces(timeserver_attestation):
+  """
+  Returns the nonces that the given Timeserver attestation, whose signature
+  must already have been verified, attests to.
+
+  For an attestation conforming to
+  uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA, those are the signed
+  nonces. For one conforming to
+  uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA (from a
+  Timeserver that signs the time for a batch of requests at once), they are
+  the nonces accompanying the signable, once their inclusion proof is checked
+  against the signed Merkle root (see uptane/merkle.py).
+
+  Exceptions:
+
+    tuf.FormatError
+      if the attestation conforms to neither schema
+
+    uptane.BadTimeAttestation
+      if the nonces of a batched attestation are not shown by its inclusion
+      proof to be in the signed Merkle tree
+  """
+  if not uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.matches(
+      timeserver_attestation):
+    uptane.formats.SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+        timeserver_attestation)
+    return timeserver_attestation['signed']['nonces']
+
+  nonces = timeserver_attestation['nonces']
+
+  if uptane.merkle.root_from_proof(uptane.merkle.hash_leaf(nonces),
+      timeserver_attestation['merkle_proof']) != \
+      timeserver_attestation['signed']['merkle_root']:
+    raise uptane.BadTimeAttestation('The nonces in a batched time '
+        'attestation are not in the Merkle tree whose root the Timeserver '
+        'signed.')
+
+  return nonces
+
+
+
+
+
 def canonical_key_from_pub_and_pri(key_pub, key_pri):
   """
   Turn this into a canonical key matching tuf.formats.ANYKEY_SCHEMA, with
@@ -217,3 +460,234 @@ def scrub_filename(fname, expected_containing_dir):
         'Filename was: ' + fname)
 
   return abs_fname
+
+
+
+
+
+# The number of bytes read at once when validating or hashing a file that is
+# not memory-mapped.
+VALIDATION_CHUNK_SIZE = 64 * 1024
+
+# Files (or the rest of files) of at least this many bytes are validated or
+# hashed by memory-mapping them and feeding hashlib directly from the mapped
+# buffer, rather than by reading them. Mapping is not worth its cost for small
+# files. If None, files are never memory-mapped.
+MMAP_THRESHOLD = 1024 * 1024
+
+# The number of bytes of a memory-mapped file fed to the hashes at once.
+MMAP_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+
+def _feed_file(fobj, update):
+  """
+  Calls update with successive parts of the rest of the contents of the given
+  file object (as bytes or memoryviews), memory-mapping the file if it is
+  large enough (see MMAP_THRESHOLD) and reading it in chunks otherwise.
+  """
+  offset = fobj.tell()
+
+  try:
+    remaining = os.fstat(fobj.fileno()).st_size - offset
+  except (AttributeError, EnvironmentError, ValueError):
+    remaining = None # Not a regular file: read it.
+
+  if MMAP_THRESHOLD is not None and remaining is not None and \
+      remaining >= MMAP_THRESHOLD:
+    try:
+      mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+      mapped = None
+
+    if mapped is not None:
+      try:
+        end = len(mapped)
+        for start in range(offset, end, MMAP_CHUNK_SIZE):
+          _feed_mapped(mapped, start, min(start + MMAP_CHUNK_SIZE, end), update)
+      finally:
+        mapped.close()
+
+      fobj.seek(0, os.SEEK_END)
+      return
+
+  while True:
+    chunk = fobj.read(VALIDATION_CHUNK_SIZE)
+    if not chunk:
+      break
+    update(chunk)
+
+
+
+def _feed_mapped(mapped, start, end, update):
+  """
+  Calls update with bytes start to end of the given mmap object, without
+  copying them where possible.
+  """
+  try:
+    view = memoryview(mapped)
+  except TypeError: # Python 2's mmap objects do not support memoryview.
+    update(mapped[start:end])
+    return
+
+  chunk = view[start:end]
+  try:
+    update(chunk)
+  finally:
+    # The mapping cannot be closed while views of it exist.
+    chunk.release()
+    view.release()
+
+
+
+def hash_file(fname, algorithms):
+  """
+  Returns a dict mapping each of the given hash algorithms (e.g. 'sha256') to
+  the hex digest of the file fname, reading (or mapping) the file once.
+  Raises tuf.UnsupportedAlgorithmError if an algorithm is not supported.
+  """
+  tuf.formats.PATH_SCHEMA.check_match(fname)
+
+  hashers = {}
+  for algorithm in algorithms:
+    try:
+      hashers[algorithm] = hashlib.new(algorithm)
+    except ValueError:
+      raise tuf.UnsupportedAlgorithmError(algorithm)
+
+  def update(data):
+    for hasher in hashers.values():
+      hasher.update(data)
+
+  with open(fname, 'rb') as fobj:
+    _feed_file(fobj, update)
+
+  return dict((algorithm, hasher.hexdigest())
+      for algorithm, hasher in hashers.items())
+
+
+
+class FileValidator(object):
+  """
+  Checks a file (e.g. an image) against its trusted length and hashes in a
+  single pass over its contents, computing every hash at once. The contents
+  can be fed in as they arrive (update), e.g. while a file is being received
+  and written, or read from a file (update_from_file, or validate_file).
+
+  Use:
+    validator = FileValidator(trusted_length, trusted_hashes)
+    for chunk in <chunks of the file, in order>:
+      validator.update(chunk)
+    validator.check()
+
+  Fields:
+
+    expected_length, expected_hashes
+      The trusted length and hashes (tuf.formats.LENGTH_SCHEMA,
+      tuf.formats.HASHDICT_SCHEMA).
+
+    received
+      The number of bytes fed in so far.
+  """
+
+  def __init__(self, expected_length, expected_hashes):
+
+    tuf.formats.LENGTH_SCHEMA.check_match(expected_length)
+    tuf.formats.HASHDICT_SCHEMA.check_match(expected_hashes)
+
+    self.expected_length = expected_length
+    self.expected_hashes = expected_hashes
+    self.received = 0
+
+    self._hashers = {}
+    for algorithm in expected_hashes:
+      try:
+        self._hashers[algorithm] = hashlib.new(algorithm)
+      except ValueError:
+        raise tuf.UnsupportedAlgorithmError(algorithm)
+
+
+
+  def update(self, data):
+    """
+    Feeds in the next bytes of the file. Raises
+    tuf.DownloadLengthMismatchError as soon as more than the expected length
+    has been fed in (without adding the excess to the hashes).
+    """
+    if self.received + len(data) > self.expected_length:
+      raise tuf.DownloadLengthMismatchError(
+          self.expected_length, self.received + len(data))
+
+    for hasher in self._hashers.values():
+      hasher.update(data)
+    self.received += len(data)
+
+
+
+  def update_from_file(self, fobj):
+    """
+    Feeds in the rest of the contents of the given file object, reading it
+    once, in chunks, or memory-mapping it if it is large (see
+    MMAP_THRESHOLD).
+    """
+    _feed_file(fobj, self.update)
+
+
+
+  def hexdigests(self):
+    """
+    Returns a dict mapping each expected hash algorithm to the hex digest of
+    what has been fed in so far.
+    """
+    return dict((algorithm, hasher.hexdigest())
+        for algorithm, hasher in self._hashers.items())
+
+
+
+  def check(self):
+    """
+    Raises tuf.DownloadLengthMismatchError if what has been fed in does not
+    have the expected length, or tuf.BadHashError if it does not have every
+    expected hash.
+    """
+    if self.received != self.expected_length:
+      raise tuf.DownloadLengthMismatchError(
+          self.expected_length, self.received)
+
+    for algorithm, observed_hash in self.hexdigests().items():
+      if observed_hash != self.expected_hashes[algorithm]:
+        raise tuf.BadHashError(self.expected_hashes[algorithm], observed_hash)
+
+
+
+
+
+def validate_file(fname, expected_length, expected_hashes):
+  """
+  <Purpose>
+    Checks the file fname against its trusted length and hashes, reading it
+    once. See FileValidator.
+
+  <Exceptions>
+    tuf.DownloadLengthMismatchError
+      if the file does not have the expected length, in which case it is not
+      read at all.
+
+    tuf.BadHashError
+      if the file does not have every expected hash.
+
+    tuf.UnsupportedAlgorithmError
+      if an expected hash's algorithm is not supported.
+  """
+  tuf.formats.PATH_SCHEMA.check_match(fname)
+
+  validator = FileValidator(expected_length, expected_hashes)
+
+  with open(fname, 'rb') as fobj:
+    observed_length = os.fstat(fobj.fileno()).st_size
+    if observed_length != expected_length:
+      raise tuf.DownloadLengthMismatchError(expected_length, observed_length)
+
+    validator.update_from_file(fobj)
+
+  validator.check()
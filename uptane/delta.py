@@ -0,0 +1,262 @@
+"""
+<Program Name>
+  delta.py
+
+<Purpose>
+  Binary deltas between images, so that a Primary can send a Secondary only
+  what has changed between the image the Secondary has installed and the
+  image it is to install, rather than the whole new image.
+
+  Both images are split into blocks of a fixed size. Each block of the new
+  image that also appears (at a block boundary) anywhere in the old image is
+  sent as a reference to the block in the old image; the rest are sent
+  literally. Blocks are matched by their SHA-256 digests.
+
+  A delta is not trusted: the image reconstructed from it must still be
+  validated against the trusted target info (e.g. with
+  uptane.clients.secondary.Secondary.validate_image), just as an image
+  received whole would be.
+
+  Format of a delta (integers are unsigned, 8 bytes, big-endian):
+    DELTA_MAGIC, length of the old image, length of the new image
+    then any number of operations, each either:
+      b'C', offset, length: copy length bytes from the old image at offset
+      b'L', length, <length bytes>: literal bytes of the new image
+
+  Use:
+    create_delta(installed_image_fname, new_image_fname, delta_fname)
+    ...
+    apply_delta(installed_image_fname, delta, reconstructed_image_fname)
+
+"""
+from __future__ import unicode_literals
+
+import uptane
+import tuf.formats
+
+import os
+import struct
+import hashlib
+
+DELTA_MAGIC = b'UPTANEDELTA1'
+
+DEFAULT_BLOCK_SIZE = 4096
+
+# The longest literal operation create_delta writes; longer runs of literal
+# bytes are split into several operations, so that they are not held in
+# memory whole.
+MAX_LITERAL_LENGTH = 1024 * 1024
+
+_HEADER = struct.Struct('>QQ')
+_COPY = struct.Struct('>QQ')
+_LITERAL = struct.Struct('>Q')
+
+
+
+def create_delta(old_fname, new_fname, delta_fname,
+    block_size=DEFAULT_BLOCK_SIZE, max_length=None):
+  """
+  <Purpose>
+    Writes a delta from which the file new_fname can be reconstructed given
+    the file old_fname to the file delta_fname, and returns its length. See
+    the module docstring.
+
+    The delta is written as it is made, so neither it nor either image is held
+    in memory whole. If max_length is given and the delta would be longer
+    than that (e.g. no shorter than the new image, and so not worth sending),
+    None is returned instead. No file is left at delta_fname in that case, or
+    if an error occurs.
+
+  <Arguments>
+    old_fname
+      The image the delta is to be applied to (e.g. the installed image).
+
+    new_fname
+      The image the delta is to produce (e.g. the image to install).
+
+    delta_fname
+      The file to write the delta to. It is overwritten if it exists.
+
+    block_size
+      The size of the blocks matched between the two images. Smaller blocks
+      find more in common between the images, at the cost of a larger index
+      and more operations.
+
+    max_length
+      If not None, the greatest length of delta to write.
+  """
+  tuf.formats.PATH_SCHEMA.check_match(old_fname)
+  tuf.formats.PATH_SCHEMA.check_match(new_fname)
+  tuf.formats.PATH_SCHEMA.check_match(delta_fname)
+  tuf.formats.LENGTH_SCHEMA.check_match(block_size)
+  if block_size < 1:
+    raise tuf.FormatError('Block size must be positive.')
+  if max_length is not None:
+    tuf.formats.LENGTH_SCHEMA.check_match(max_length)
+
+  length = 0
+  complete = False
+
+  try:
+    with open(delta_fname, 'wb') as fobj:
+      for chunk in _generate_delta(old_fname, new_fname, block_size):
+        length += len(chunk)
+        if max_length is not None and length > max_length:
+          return None
+        fobj.write(chunk)
+
+    complete = True
+
+  finally:
+    if not complete and os.path.exists(delta_fname):
+      os.remove(delta_fname)
+
+  return length
+
+
+
+
+
+def _generate_delta(old_fname, new_fname, block_size):
+  """
+  Yields the delta from old_fname to new_fname (see create_delta) in pieces,
+  none much longer than MAX_LITERAL_LENGTH.
+  """
+  # Index the blocks of the old image by digest.
+  old_blocks = {}
+  with open(old_fname, 'rb') as fobj:
+    offset = 0
+    while True:
+      block = fobj.read(block_size)
+      if not block:
+        break
+      old_blocks.setdefault(hashlib.sha256(block).digest(), offset)
+      offset += len(block)
+    old_length = offset
+
+  yield DELTA_MAGIC + _HEADER.pack(old_length, os.path.getsize(new_fname))
+
+  # The operation being built: a copy (offset, length), or literal bytes
+  # (ended early, to start another, once MAX_LITERAL_LENGTH long).
+  copy = None
+  literal = []
+  literal_length = 0
+
+  with open(new_fname, 'rb') as fobj:
+    while True:
+      block = fobj.read(block_size)
+      if not block:
+        break
+
+      old_offset = old_blocks.get(hashlib.sha256(block).digest())
+
+      if old_offset is None:
+        if copy is not None:
+          yield b'C' + _COPY.pack(*copy)
+          copy = None
+        literal.append(block)
+        literal_length += len(block)
+
+        if literal_length >= MAX_LITERAL_LENGTH:
+          yield b'L' + _LITERAL.pack(literal_length) + b''.join(literal)
+          literal = []
+          literal_length = 0
+
+      elif copy is not None and copy[0] + copy[1] == old_offset:
+        # Extend the copy in progress.
+        copy = (copy[0], copy[1] + len(block))
+
+      else:
+        if copy is not None:
+          yield b'C' + _COPY.pack(*copy)
+        if literal:
+          yield b'L' + _LITERAL.pack(literal_length) + b''.join(literal)
+          literal = []
+          literal_length = 0
+        copy = (old_offset, len(block))
+
+  if copy is not None:
+    yield b'C' + _COPY.pack(*copy)
+  if literal:
+    yield b'L' + _LITERAL.pack(literal_length) + b''.join(literal)
+
+
+
+
+
+def apply_delta(old_fname, delta, new_fname):
+  """
+  <Purpose>
+    Writes the image reconstructed from the given delta (bytes, as written by
+    create_delta) and the file old_fname to new_fname. If an error occurs, no
+    file is left at new_fname.
+
+  <Exceptions>
+    uptane.BadDelta
+      if the delta is malformed, was not made for an image of the length of
+      old_fname, or does not produce an image of the length it indicates.
+  """
+  tuf.formats.PATH_SCHEMA.check_match(old_fname)
+  tuf.formats.PATH_SCHEMA.check_match(new_fname)
+
+  delta = bytes(delta)
+
+  if not delta.startswith(DELTA_MAGIC) or \
+      len(delta) < len(DELTA_MAGIC) + _HEADER.size:
+    raise uptane.BadDelta('Not an image delta.')
+
+  position = len(DELTA_MAGIC)
+  old_length, new_length = _HEADER.unpack_from(delta, position)
+  position += _HEADER.size
+
+  if os.path.getsize(old_fname) != old_length:
+    raise uptane.BadDelta('Delta was made for an image of length ' +
+        str(old_length) + ', not ' + repr(old_fname) + '.')
+
+  written = 0
+
+  try:
+    with open(old_fname, 'rb') as old_fobj, open(new_fname, 'wb') as new_fobj:
+
+      while position < len(delta):
+        operation = delta[position:position + 1]
+        position += 1
+
+        if operation == b'C':
+          if position + _COPY.size > len(delta):
+            raise uptane.BadDelta('Truncated delta.')
+          offset, length = _COPY.unpack_from(delta, position)
+          position += _COPY.size
+          if offset + length > old_length:
+            raise uptane.BadDelta('Delta refers beyond the end of the image.')
+          old_fobj.seek(offset)
+          data = old_fobj.read(length)
+
+        elif operation == b'L':
+          if position + _LITERAL.size > len(delta):
+            raise uptane.BadDelta('Truncated delta.')
+          length, = _LITERAL.unpack_from(delta, position)
+          position += _LITERAL.size
+          data = delta[position:position + length]
+          if len(data) != length:
+            raise uptane.BadDelta('Truncated delta.')
+          position += length
+
+        else:
+          raise uptane.BadDelta('Unknown delta operation: ' + repr(operation))
+
+        written += len(data)
+        if written > new_length:
+          raise uptane.BadDelta('Delta produces more than the ' +
+              str(new_length) + ' bytes it indicates.')
+        new_fobj.write(data)
+
+    if written != new_length:
+      raise uptane.BadDelta('Delta produces ' + str(written) + ' bytes, not ' +
+          'the ' + str(new_length) + ' it indicates.')
+
+  except Exception:
+    # Leave no partially reconstructed image.
+    if os.path.exists(new_fname):
+      os.remove(new_fname)
+    raise
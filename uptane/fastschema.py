@@ -0,0 +1,329 @@
+"""
+<Program Name>
+  fastschema.py
+
+<Purpose>
+  Fast-path validation for the schemas in uptane.formats.
+
+  tuf.schema validates an object by walking the schema tree, one method call
+  (and, on the way out of nested schemas, one try/except) per schema node per
+  value. For large nested objects like a Vehicle Manifest with 100 ECU
+  Manifests, this is slow, and hot paths check the same object several times.
+
+  This module provides:
+
+    compile_schema(schema)
+      Generates, once, a single flat Python function that returns True if an
+      object matches the given tuf.schema schema and False otherwise, with
+      every nested schema inlined.
+
+    Object
+      A drop-in replacement for tuf.schema.Object, used by uptane.formats.
+      Its check_match() runs the compiled function instead of walking the
+      schema tree. If the object does not match, the original tuf.schema code
+      is run to raise tuf.FormatError with exactly the usual message.
+
+    validation_session()
+      Within a validation session, signed contents (e.g. an ECU Manifest's
+      'signed' field) that have been validated once, on their own or nested in
+      a larger object such as a Vehicle Manifest, are marked as validated and
+      not walked again when checked against the same schema in that session.
+      Marks are by identity, so callers must not modify those objects within
+      the session. Signables themselves are always checked, since signing
+      adds to their signatures.
+
+  Fast validation can be turned off (e.g. to compare against tuf.schema) with
+  set_fast_validation(False).
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import tuf
+import tuf.formats
+import tuf.schema as SCHEMA
+
+import contextlib
+import threading
+
+import six
+
+# Whether or not Object.check_match uses compiled validators.
+_fast_validation = True
+
+# Per thread, while in a validation session (see validation_session), maps
+# (id(schema), id(object)) to the object, for each object that has matched
+# that schema. Holding the objects keeps their ids from being reused.
+_session = threading.local()
+
+
+
+def set_fast_validation(enabled):
+  """
+  Turns fast-path validation on (the default) or off. When off, the schemas in
+  uptane.formats behave exactly like plain tuf.schema schemas.
+  """
+  global _fast_validation
+
+  tuf.formats.BOOLEAN_SCHEMA.check_match(enabled)
+
+  _fast_validation = enabled
+
+
+
+
+
+@contextlib.contextmanager
+def validation_session():
+  """
+  <Purpose>
+    Context manager within which signed contents that have matched a schema
+    from uptane.formats are not validated against it again. Sessions may be
+    nested; marks last until the outermost session ends.
+
+    The objects checked within the session must not be modified within it.
+
+  <Example>
+    with uptane.fastschema.validation_session():
+      SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(manifest)
+      # The 'signed' field of each ECU Manifest is not checked again.
+      for ecu_manifest in ...:
+        SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA.check_match(ecu_manifest)
+  """
+  outermost = getattr(_session, 'validated', None) is None
+
+  if outermost:
+    _session.validated = {}
+
+  try:
+    yield
+
+  finally:
+    if outermost:
+      _session.validated = None
+
+
+
+
+
+class _CodeGenerator(object):
+  """
+  Generates the source of a function validating an object against a schema.
+  Constants the function needs (compiled regular expressions, schemas whose
+  matches() it calls, etc.) are passed in its globals as c0, c1, ...
+  """
+
+  def __init__(self):
+    self.lines = []
+    self.namespace = {
+        'string_types': six.string_types,
+        'binary_type': six.binary_type,
+        'integer_types': six.integer_types,
+        'iteritems': six.iteritems,
+        'isinstance': isinstance,
+        'len': len}
+    self._n_variables = 0
+
+
+
+  def constant(self, value):
+    name = 'c' + str(len(self.namespace))
+    self.namespace[name] = value
+    return name
+
+
+
+  def variable(self):
+    self._n_variables += 1
+    return 'v' + str(self._n_variables)
+
+
+
+  def emit(self, indent, line):
+    self.lines.append('  ' * indent + line)
+
+
+
+  def fail_unless(self, indent, condition):
+    self.emit(indent, 'if not (' + condition + '): return False')
+
+
+
+  def generate(self, schema, var, indent, top=False):
+    """
+    Emits statements that return False from the generated function if the
+    object in variable var does not match schema, and fall through otherwise.
+    """
+    # Subclasses of the tuf.schema classes may behave differently, so only the
+    # exact classes are inlined; anything else is checked by calling it.
+    kind = type(schema)
+
+    if kind is Object and schema._object_name == 'object' and not top:
+      # Signed contents are validated by their schema, which remembers which
+      # objects it has validated in a validation session.
+      self.fail_unless(indent,
+          self.constant(schema._fast_matches) + '(' + var + ')')
+
+    elif kind in (Object, SCHEMA.Object):
+      self.fail_unless(indent, 'isinstance(' + var + ', dict)')
+
+      for key, subschema in schema._required:
+        item = self.variable()
+        if type(subschema) is SCHEMA.Optional:
+          self.emit(indent, 'if ' + repr(key) + ' in ' + var + ':')
+          self.emit(indent + 1, item + ' = ' + var + '[' + repr(key) + ']')
+          self.generate(subschema._schema, item, indent + 1)
+        else:
+          self.fail_unless(indent, repr(key) + ' in ' + var)
+          self.emit(indent, item + ' = ' + var + '[' + repr(key) + ']')
+          self.generate(subschema, item, indent)
+
+    elif kind is SCHEMA.Any:
+      pass
+
+    elif kind is SCHEMA.String:
+      self.fail_unless(indent,
+          self.constant(schema._string) + ' == ' + var)
+
+    elif kind is SCHEMA.AnyString:
+      self.fail_unless(indent, 'isinstance(' + var + ', string_types)')
+
+    elif kind is SCHEMA.AnyBytes:
+      self.fail_unless(indent, 'isinstance(' + var + ', binary_type)')
+
+    elif kind is SCHEMA.LengthString:
+      self.fail_unless(indent, 'isinstance(' + var + ', string_types) and '
+          'len(' + var + ') == ' + repr(schema._string_length))
+
+    elif kind is SCHEMA.LengthBytes:
+      self.fail_unless(indent, 'isinstance(' + var + ', binary_type) and '
+          'len(' + var + ') == ' + repr(schema._bytes_length))
+
+    elif kind is SCHEMA.Boolean:
+      self.fail_unless(indent, 'isinstance(' + var + ', bool)')
+
+    elif kind is SCHEMA.Integer:
+      self.fail_unless(indent, 'not isinstance(' + var + ', bool) and '
+          'isinstance(' + var + ', integer_types) and ' +
+          self.constant(schema._lo) + ' <= ' + var + ' <= ' +
+          self.constant(schema._hi))
+
+    elif kind is SCHEMA.RegularExpression:
+      self.fail_unless(indent, 'isinstance(' + var + ', string_types) and ' +
+          self.constant(schema._re_object.match) + '(' + var + ')')
+
+    elif kind is SCHEMA.ListOf:
+      self.fail_unless(indent, 'isinstance(' + var + ', (list, tuple))')
+      item = self.variable()
+      self.emit(indent, 'for ' + item + ' in ' + var + ':')
+      self.generate(schema._schema, item, indent + 1)
+      self.emit(indent + 1, 'pass')
+      self.fail_unless(indent, self.constant(schema._min_count) + ' <= len(' +
+          var + ') <= ' + self.constant(schema._max_count))
+
+    elif kind is SCHEMA.DictOf:
+      self.fail_unless(indent, 'isinstance(' + var + ', dict)')
+      key = self.variable()
+      value = self.variable()
+      self.emit(indent, 'for ' + key + ', ' + value + ' in iteritems(' +
+          var + '):')
+      self.generate(schema._key_schema, key, indent + 1)
+      self.generate(schema._value_schema, value, indent + 1)
+      self.emit(indent + 1, 'pass')
+
+    elif kind is SCHEMA.Optional:
+      self.generate(schema._schema, var, indent)
+
+    elif kind is SCHEMA.AllOf:
+      for subschema in schema._required_schemas:
+        self.generate(subschema, var, indent)
+
+    elif kind is SCHEMA.OneOf:
+      self.fail_unless(indent, ' or '.join(
+          self.constant(compile_schema(alternative)) + '(' + var + ')'
+          for alternative in schema._alternatives) or 'False')
+
+    else:
+      # e.g. Struct, or subclasses: use the schema's own code.
+      self.fail_unless(indent, self.constant(schema) + '.matches(' + var + ')')
+
+
+
+
+
+def compile_schema(schema):
+  """
+  Returns a function taking one argument that returns True if the argument
+  matches the given tuf.schema schema (i.e. if schema.check_match would not
+  raise tuf.FormatError), and False otherwise.
+  """
+  generator = _CodeGenerator()
+  generator.emit(0, 'def matches(v0):')
+  generator.generate(schema, 'v0', 1, top=True)
+  generator.emit(1, 'return True')
+
+  # Bind the names the function uses as default arguments, i.e. as locals,
+  # which are faster to look up than globals.
+  generator.lines[0] = 'def matches(v0, ' + ', '.join(
+      name + '=' + name for name in sorted(generator.namespace)) + '):'
+
+  source = '\n'.join(generator.lines)
+  exec(compile(source, '<compiled schema>', 'exec'), generator.namespace)
+
+  return generator.namespace['matches']
+
+
+
+
+
+class Object(SCHEMA.Object):
+  """
+  tuf.schema.Object with fast-path validation. See the module docstring.
+  """
+
+  def __init__(self, object_name='object', **required):
+    SCHEMA.Object.__init__(self, object_name, **required)
+    self._compiled = None
+
+
+
+  def check_match(self, object):
+    if _fast_validation and self._fast_matches(object):
+      return
+
+    # Produce the usual error.
+    SCHEMA.Object.check_match(self, object)
+
+
+
+  def matches(self, object):
+    if _fast_validation:
+      return self._fast_matches(object)
+
+    return SCHEMA.Object.matches(self, object)
+
+
+
+  def _fast_matches(self, object):
+
+    validated = None
+
+    # Signables are not marked, since their signatures are added to after
+    # their 'signed' fields are validated.
+    if self._object_name == 'object':
+      validated = getattr(_session, 'validated', None)
+
+    if validated is not None and (id(self), id(object)) in validated:
+      return True
+
+    # Compiled on first use, when all schemas this one refers to exist.
+    if self._compiled is None:
+      self._compiled = compile_schema(self)
+
+    if not self._compiled(object):
+      return False
+
+    if validated is not None:
+      validated[(id(self), id(object))] = object
+
+    return True
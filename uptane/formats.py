@@ -12,6 +12,10 @@ from __future__ import unicode_literals
 from tuf.formats import *
 import tuf.schema as SCHEMA
 
+# Object schemas defined here are validated by compiled validators. See
+# uptane.fastschema.
+import uptane.fastschema as FASTSCHEMA
+
 # Constitutes a nonce used by e.g. ECUs to help defend their validation of
 # responses from the timeserver against replay attacks.
 NONCE_LOWER_BOUND = 0
@@ -36,7 +40,7 @@ ECU_SERIAL_SCHEMA = SCHEMA.AnyString() # Instead, for now, we'll go with an ecu
 # Information specifying the target(s) installed on a given ECU.
 # This object corresponds to not "ECUVersionManifest" in the Uptane
 # Implementation Specification, but the signed contents of that object.
-ECU_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
+ECU_VERSION_MANIFEST_SCHEMA = FASTSCHEMA.Object(
     ecu_serial = ECU_SERIAL_SCHEMA,
     installed_image = TARGETFILE_SCHEMA,
     timeserver_time = ISO8601_DATETIME_SCHEMA,
@@ -45,7 +49,7 @@ ECU_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
 
 # This object corresponds to "ECUVersionManifest" in ASN.1 in the Uptane
 # Implementation Specification.
-SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
+SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA = FASTSCHEMA.Object(
     object_name = 'SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA',
     signed = ECU_VERSION_MANIFEST_SCHEMA,
     signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA))
@@ -55,7 +59,7 @@ SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
 # Uptane is responsible.
 # This object corresponds to not "VehicleVersionManifest" in the Uptane
 # Implementation Specification, but the signed contents of that object.
-VEHICLE_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
+VEHICLE_VERSION_MANIFEST_SCHEMA = FASTSCHEMA.Object(
     vin = VIN_SCHEMA, # Spec: vehicleIdentifier
     primary_ecu_serial = ECU_SERIAL_SCHEMA, # Spec: primaryIdentifier
     ecu_version_manifests = SCHEMA.DictOf(
@@ -64,7 +68,7 @@ VEHICLE_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
 
 # This object corresponds to "VehicleVersionManifest" in ASN.1 in the Uptane
 # Implementation Specification.
-SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
+SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA = FASTSCHEMA.Object(
     object_name = 'SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA',
     signed = VEHICLE_VERSION_MANIFEST_SCHEMA,
     signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA))
@@ -72,7 +76,7 @@ SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA = SCHEMA.Object(
 
 # Information sent to the director by the primary.
 # There probably will be additional fields here.
-VEHICLE_REPORT_TO_DIRECTOR_SCHEMA = SCHEMA.Object(
+VEHICLE_REPORT_TO_DIRECTOR_SCHEMA = FASTSCHEMA.Object(
     vin = VIN_SCHEMA,
     software_manifest = VEHICLE_VERSION_MANIFEST_SCHEMA)
 
@@ -80,7 +84,7 @@ VEHICLE_REPORT_TO_DIRECTOR_SCHEMA = SCHEMA.Object(
 DESCRIPTION_OF_ATTACKS_SCHEMA = SCHEMA.AnyString()
 
 # This is the format for a single assignment given to an ECU by the Director.
-ECU_SOFTWARE_ASSIGNMENT_SCHEMA = SCHEMA.Object(
+ECU_SOFTWARE_ASSIGNMENT_SCHEMA = FASTSCHEMA.Object(
     ecu_serial = ECU_SERIAL_SCHEMA,
     previous_time = tuf.formats.ISO8601_DATETIME_SCHEMA, #UTC_DATETIME_SCHEMA,
     current_time = tuf.formats.ISO8601_DATETIME_SCHEMA,
@@ -98,12 +102,49 @@ VEHICLE_SOFTWARE_ASSIGNMENTS_SCHEMA = SCHEMA.ListOf(
 # The format for the timeserver's signed time response will be a
 # SIGNABLE_SCHEMA (from TUF). THAT in TURN will contain, in field 'signed', one
 # of these objects:
-TIMESERVER_ATTESTATION_SCHEMA = SCHEMA.Object(
+TIMESERVER_ATTESTATION_SCHEMA = FASTSCHEMA.Object(
     time = ISO8601_DATETIME_SCHEMA,
     nonces = NONCE_LIST_SCHEMA)
 
-SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA = SCHEMA.Object(
+SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA = FASTSCHEMA.Object(
     object_name = 'SIGNABLE_TIMESERVER_ATTESTATION_SCHEMA',
     signed = TIMESERVER_ATTESTATION_SCHEMA,
     signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA))
 
+# A Timeserver that signs the time for a batch of requests at once signs, in
+# place of the nonces, the root of a Merkle tree over the nonce lists of the
+# requests (see uptane/merkle.py). The response to each request carries that
+# request's nonces and their inclusion proof alongside the signable, outside
+# the signed contents.
+MERKLE_PROOF_STEP_SCHEMA = FASTSCHEMA.Object(
+    object_name = 'MERKLE_PROOF_STEP_SCHEMA',
+    side = SCHEMA.OneOf([SCHEMA.String('left'), SCHEMA.String('right')]),
+    hash = HASH_SCHEMA)
+
+MERKLE_PROOF_SCHEMA = SCHEMA.ListOf(MERKLE_PROOF_STEP_SCHEMA)
+
+BATCHED_TIMESERVER_ATTESTATION_SCHEMA = FASTSCHEMA.Object(
+    time = ISO8601_DATETIME_SCHEMA,
+    merkle_root = HASH_SCHEMA)
+
+SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA = FASTSCHEMA.Object(
+    object_name = 'SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA',
+    signed = BATCHED_TIMESERVER_ATTESTATION_SCHEMA,
+    signatures = SCHEMA.ListOf(SIGNATURE_SCHEMA),
+    nonces = NONCE_LIST_SCHEMA,
+    merkle_proof = MERKLE_PROOF_SCHEMA)
+
+
+
+# Describes an image a Primary provides to a Secondary in chunks (see
+# Primary.get_image_chunk): the image's filepath relative to the targets
+# directory, its length, the size of each chunk (all but the last are this
+# size), and the SHA-256 hash of each chunk, in order. The chunk hashes only
+# let a Secondary detect and re-request a chunk damaged in transfer; the image
+# must still be validated against trusted target info.
+IMAGE_CHUNK_MANIFEST_SCHEMA = FASTSCHEMA.Object(
+    object_name = 'IMAGE_CHUNK_MANIFEST_SCHEMA',
+    filepath = RELPATH_SCHEMA,
+    length = LENGTH_SCHEMA,
+    chunk_size = SCHEMA.Integer(lo=1),
+    chunk_hashes = SCHEMA.ListOf(HASH_SCHEMA))
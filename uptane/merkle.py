@@ -0,0 +1,136 @@
+"""
+<Program Name>
+  merkle.py
+
+<Purpose>
+  Merkle trees over the nonce lists of a batch of Timeserver requests, so that
+  a Timeserver can attest to the time for the whole batch with one signature,
+  over the root of the tree, and each requester (and each ECU whose nonce it
+  sent) can check with a short inclusion proof that its nonces are in the
+  tree.
+
+  Each leaf is the list of nonces from one request. Leaves and interior nodes
+  are hashed with SHA-256, with distinct prefixes (as in RFC 6962) so that a
+  leaf cannot be passed off as an interior node or vice versa. A node with no
+  sibling at its level is carried up to the next level unchanged.
+
+  An inclusion proof is a list of steps, conforming to
+  uptane.formats.MERKLE_PROOF_SCHEMA, from the leaf up to the root: each step
+  gives the hash of the sibling of the node reached so far ('hash', in hex)
+  and whether that sibling is on the 'left' or the 'right' ('side').
+
+  Use:
+    root, proofs = build_tree([hash_leaf(nonces) for nonces in nonce_lists])
+    ...
+    assert root_from_proof(hash_leaf(nonce_lists[0]), proofs[0]) == root
+
+"""
+from __future__ import unicode_literals
+
+import uptane.formats
+import tuf
+
+import struct
+import hashlib
+import binascii
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+_NONCE = struct.Struct('>I')
+
+
+
+def hash_leaf(nonces):
+  """
+  Returns the hash (bytes) of the leaf for the given list of nonces
+  (conforming to uptane.formats.NONCE_LIST_SCHEMA).
+  """
+  uptane.formats.NONCE_LIST_SCHEMA.check_match(nonces)
+
+  return hashlib.sha256(LEAF_PREFIX +
+      b''.join(_NONCE.pack(nonce) for nonce in nonces)).digest()
+
+
+
+def hash_node(left, right):
+  """
+  Returns the hash (bytes) of the interior node with the given children
+  (hashes, as bytes).
+  """
+  return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+
+def build_tree(leaves):
+  """
+  <Purpose>
+    Builds a Merkle tree over the given leaf hashes (a non-empty list of
+    bytes, as returned by hash_leaf), returning the root hash (in hex) and a
+    list of the inclusion proofs of the leaves, in the same order.
+
+  <Exceptions>
+    tuf.FormatError
+      if there are no leaves
+  """
+  if not leaves:
+    raise tuf.FormatError('A Merkle tree must have at least one leaf.')
+
+  proofs = [[] for leaf in leaves]
+
+  # Each node of the level being built on, with the indices of the leaves
+  # under it.
+  level = [(leaf, [index]) for index, leaf in enumerate(leaves)]
+
+  while len(level) > 1:
+    next_level = []
+
+    for i in range(0, len(level) - 1, 2):
+      (left, left_leaves), (right, right_leaves) = level[i], level[i + 1]
+
+      for index in left_leaves:
+        proofs[index].append(
+            {'side': 'right', 'hash': _hexlify(right)})
+      for index in right_leaves:
+        proofs[index].append(
+            {'side': 'left', 'hash': _hexlify(left)})
+
+      next_level.append((hash_node(left, right), left_leaves + right_leaves))
+
+    if len(level) % 2:
+      next_level.append(level[-1])
+
+    level = next_level
+
+  return _hexlify(level[0][0]), proofs
+
+
+
+def root_from_proof(leaf, proof):
+  """
+  <Purpose>
+    Returns the root hash (in hex) of the Merkle tree that the given leaf hash
+    (bytes, as returned by hash_leaf) is in, according to the given inclusion
+    proof (conforming to uptane.formats.MERKLE_PROOF_SCHEMA). The leaf is in
+    a tree only if this is that tree's root.
+
+  <Exceptions>
+    tuf.FormatError
+      if the proof is malformed
+  """
+  uptane.formats.MERKLE_PROOF_SCHEMA.check_match(proof)
+
+  node = leaf
+  for step in proof:
+    sibling = binascii.unhexlify(step['hash'])
+    if step['side'] == 'left':
+      node = hash_node(sibling, node)
+    else:
+      node = hash_node(node, sibling)
+
+  return _hexlify(node)
+
+
+
+def _hexlify(digest):
+  return binascii.hexlify(digest).decode('ascii')
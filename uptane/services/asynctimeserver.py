@@ -0,0 +1,179 @@
+"""
+<Program Name>
+  asynctimeserver.py
+
+<Purpose>
+  An asyncio front end for the Timeserver (uptane.services.timeserver) that
+  serves many Primaries at once by signing the time for batches of requests:
+  requests for signed time that arrive within a short window of each other
+  are answered together, with one signature over the root of a Merkle tree
+  of their nonce lists (see uptane.services.timeserver.get_signed_time_batch
+  and uptane/merkle.py), instead of one signature per request. Each Primary
+  receives an attestation carrying its own nonces and their inclusion proof,
+  which Primaries and Secondaries validate as they would an attestation for
+  the request alone.
+
+  A request waits at most batch_window seconds for others to join its batch,
+  and a batch is signed as soon as it reaches max_batch_size requests.
+  Signing is done in a thread, so the event loop keeps accepting requests
+  meanwhile.
+
+  Requires Python 3.7 or later.
+
+  Use:
+    timeserver.set_timeserver_key(<key>)
+    server = make_server('localhost', 30601)
+    server.serve_forever()
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+import uptane.formats
+import uptane.asyncxmlrpc
+import uptane.services.timeserver as timeserver
+
+import asyncio
+
+log = uptane.logging.getLogger('asynctimeserver')
+log.addHandler(uptane.file_handler)
+log.addHandler(uptane.console_handler)
+log.setLevel(uptane.logging.DEBUG)
+
+# The longest a request waits for others to join its batch, in seconds.
+BATCH_WINDOW = 0.01
+
+# The most requests signed in one batch.
+MAX_BATCH_SIZE = 4096
+
+
+
+class BatchingTimeserver(object):
+  """
+  Answers requests for signed time in batches. See the module docstring.
+
+  Fields:
+
+    batch_window
+      The longest a request waits for others to join its batch, in seconds.
+
+    max_batch_size
+      The most requests signed in one batch.
+
+    batches_signed
+      The number of batches signed so far.
+
+    requests_signed
+      The number of requests answered so far.
+  """
+
+  def __init__(self, batch_window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE,
+      executor=None):
+
+    self.batch_window = batch_window
+    self.max_batch_size = max_batch_size
+    self.batches_signed = 0
+    self.requests_signed = 0
+
+    self._executor = executor
+
+    # The requests waiting to be signed, as (nonces, future).
+    self._pending = []
+
+    # The timer that will sign the pending requests, if one is set.
+    self._timer = None
+
+    # The batches being signed (held so that they are not garbage collected).
+    self._signing = set()
+
+
+
+  async def get_signed_time(self, nonces):
+    """
+    Returns a batched time attestation for the given list of nonces,
+    conforming to uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA,
+    once the batch the request joins is signed.
+    """
+    uptane.formats.NONCE_LIST_SCHEMA.check_match(nonces)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append((nonces, future))
+
+    if len(self._pending) >= self.max_batch_size:
+      self._sign_pending()
+
+    elif self._timer is None:
+      self._timer = loop.call_later(self.batch_window, self._sign_pending)
+
+    return await future
+
+
+
+  def _sign_pending(self):
+    """
+    Starts signing the pending requests as a batch.
+    """
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    batch, self._pending = self._pending, []
+
+    if batch:
+      task = asyncio.ensure_future(self._sign_batch(batch))
+      self._signing.add(task)
+      task.add_done_callback(self._signing.discard)
+
+
+
+  async def _sign_batch(self, batch):
+    """
+    Signs a batch of requests, given as (nonces, future), and sets the result
+    of each future to the attestation for its request (or, on failure, sets
+    the exception).
+    """
+    try:
+      time_attestations = await asyncio.get_running_loop().run_in_executor(
+          self._executor, timeserver.get_signed_time_batch,
+          [nonces for nonces, future in batch])
+
+    except Exception as e:
+      log.error('Unable to sign a batch of ' + str(len(batch)) + ' time '
+          'requests: ' + repr(e))
+      for nonces, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+
+    self.batches_signed += 1
+    self.requests_signed += len(batch)
+
+    for (nonces, future), time_attestation in zip(batch, time_attestations):
+      if not future.done():
+        future.set_result(time_attestation)
+
+
+
+
+
+def make_server(host, port, batch_window=BATCH_WINDOW,
+    max_batch_size=MAX_BATCH_SIZE):
+  """
+  Returns an uptane.asyncxmlrpc.AsyncXMLRPCServer offering the Timeserver's
+  XML-RPC interface (get_signed_time and get_signed_time_ber) on the given
+  host and port, with get_signed_time answered in batches by a
+  BatchingTimeserver. The Timeserver key must be set with
+  uptane.services.timeserver.set_timeserver_key before requests are served.
+  """
+  server = uptane.asyncxmlrpc.AsyncXMLRPCServer(host, port)
+  batching_timeserver = BatchingTimeserver(
+      batch_window, max_batch_size, server.executor)
+
+  server.register_function(
+      batching_timeserver.get_signed_time, 'get_signed_time')
+  server.register_function(
+      timeserver.get_signed_time_ber, 'get_signed_time_ber')
+
+  return server
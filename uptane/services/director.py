@@ -27,26 +27,56 @@
       a map of ecu serials to target info (or filenames from which to extract
       target info)
 
+    - Ingestion of many Vehicle Manifests concurrently, verifying signatures
+      in a pool of processes (ManifestIngestionPipeline)
+
 """
 from __future__ import unicode_literals
 
 import uptane
 import uptane.formats
+import uptane.fastschema
 import uptane.common
 import uptane.services.inventorydb as inventory
 import tuf
 import tuf.formats
+import tuf.keydb
+import tuf.roledb
 import tuf.repository_tool as rt
 #import asn1_conversion as asn1
 from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
 import os
+import time
+import errno
+import hashlib
+import collections
+import multiprocessing
+import threading
+from six.moves import queue
 
 log = uptane.logging.getLogger('director')
 log.addHandler(uptane.file_handler)
 log.addHandler(uptane.console_handler)
 log.setLevel(uptane.logging.DEBUG)
 
+# The version of the root metadata shared by all vehicle repositories in
+# shared-root mode (see Director).
+SHARED_ROOT_VERSION = 1
+
+# The types of key whose signatures are deterministic (the same for the same
+# key and data). Vehicles' root metadata can only be shared (see Director) if
+# the Director's root key is of one of these types; signatures made with
+# others (e.g. RSASSA-PSS) differ every time.
+DETERMINISTIC_KEY_TYPES = ['ed25519']
+
+# Each write of a vehicle's repository signs its timestamp, snapshot and
+# targets metadata afresh, to expire rt.TIMESTAMP_EXPIRATION etc. seconds
+# later. write_dirty_director_repos rewrites a repository that has not changed
+# once its timestamp metadata (the first to expire) is due to expire within
+# this many seconds, so that vehicles are never left with expired metadata.
+EXPIRATION_REFRESH_MARGIN = rt.TIMESTAMP_EXPIRATION // 2
+
 
 
 class Director:
@@ -70,10 +100,34 @@ class Director:
     vehicle_repositories
       A dictionary of tuf.repository_tool.Repository objects, indexed by VIN.
       Each holds the Director metadata geared toward that particular vehicle.
+      In shared-root mode, this is instead a VehicleRepositories object, which
+      behaves like such a dictionary but holds only the repositories in use.
 
     director_repos_dir
       The root directory in which the repositories for each vehicle reside.
 
+    shared_root
+      Whether or not this Director is in shared-root mode. In shared-root mode:
+        - The repository for each vehicle is created (or loaded from disk)
+          only when first used, e.g. by add_target_for_ecu, rather than when
+          the vehicle is added.
+        - At most max_loaded_repositories repositories are held in memory;
+          the least recently used beyond that are written to disk and dropped
+          from memory, as are those idle for a while if evict_idle_vehicle_repos
+          is called. Memory use therefore scales with the number of vehicles
+          in use rather than the number registered.
+        - All vehicle repositories have the same root metadata (same keys,
+          version and expiration), written to disk once, in
+          <director_repos_dir>/.shared_root, and hard-linked into each
+          vehicle's repository by write_director_repo. Vehicles share a copy
+          only if their root metadata is byte-for-byte identical, which
+          requires that the Director's root key be of a type whose signatures
+          are deterministic (DETERMINISTIC_KEY_TYPES, i.e. ed25519). With any
+          other root key (e.g. RSA), each vehicle has a copy of its own, and a
+          warning is logged when the Director is created.
+        Each repository in memory still holds its own copy of the Director's
+        keys, as TUF keeps a separate key database for each repository.
+
   """
 
 
@@ -86,9 +140,14 @@ class Director:
     key_snapshot_pri,
     key_snapshot_pub,
     key_targets_pri,
-    key_targets_pub):
+    key_targets_pub,
+    shared_root=False,
+    max_loaded_repositories=None):
 
     """
+    See class docstring. max_loaded_repositories is used only in shared-root
+    mode; if it is None, repositories are only dropped from memory by
+    evict_idle_vehicle_repos.
     """
 
     tuf.formats.RELPATH_SCHEMA.check_match(director_repos_dir)
@@ -98,8 +157,16 @@ class Director:
         key_snapshot_pri, key_snapshot_pub, key_targets_pri, key_targets_pub]:
       tuf.formats.ANYKEY_SCHEMA.check_match(key)
 
+    tuf.formats.BOOLEAN_SCHEMA.check_match(shared_root)
+    if max_loaded_repositories is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(max_loaded_repositories)
+
     self.director_repos_dir = director_repos_dir
 
+    # Repositories are created and loaded by absolute path, rather than by
+    # changing the working directory, which would affect every thread.
+    self._director_repos_abspath = os.path.abspath(director_repos_dir)
+
     self.key_dirroot_pri = key_root_pri
     self.key_dirroot_pub = key_root_pub
     self.key_dirtime_pri = key_timestamp_pri
@@ -109,7 +176,45 @@ class Director:
     self.key_dirtarg_pri = key_targets_pri
     self.key_dirtarg_pub = key_targets_pub
 
-    self.vehicle_repositories = dict()
+    self.shared_root = shared_root
+
+    if shared_root:
+      if key_root_pub['keytype'] not in DETERMINISTIC_KEY_TYPES:
+        log.warning(YELLOW + 'Director root key is of type ' +
+            repr(key_root_pub['keytype']) + ', whose signatures are not '
+            'deterministic, so vehicles cannot share root metadata: each will '
+            'have a copy of its own. Use an ed25519 root key to share it.' +
+            ENDCOLORS)
+
+      self.vehicle_repositories = VehicleRepositories(
+          self._load_director_repo, self._unload_director_repo,
+          max_loaded=max_loaded_repositories)
+
+      # The expiration of the root metadata shared by all vehicle repositories.
+      self.root_expiration = tuf.formats.unix_timestamp_to_datetime(
+          int(time.time() + rt.ROOT_EXPIRATION))
+
+    else:
+      self.vehicle_repositories = dict()
+
+    # The VINs of vehicles whose repositories have changed since they were
+    # last written by write_dirty_director_repos.
+    self.dirty_vins = set()
+    self._dirty_vins_lock = threading.Lock()
+
+    # The VINs of vehicles whose changed repositories were written when they
+    # were dropped from memory (see _unload_director_repo), and which
+    # write_dirty_director_repos has yet to report as written. Access is
+    # protected by _dirty_vins_lock.
+    self._written_vins = set()
+
+    # The time at which each vehicle's repository was last written, from
+    # which its metadata expires. Access is protected by _dirty_vins_lock.
+    self._write_times = dict()
+
+    # Held while linking vehicles' root metadata to the shared copy, and while
+    # removing shared copies no longer used.
+    self._shared_root_lock = threading.Lock()
 
 
 
@@ -172,7 +277,10 @@ class Director:
           'signed in the manifest itself (' +
           repr(signed_ecu_manifest['signed']['ecu_serial']) + ').')
 
-    if ecu_serial not in inventory.ecu_public_keys:
+    try:
+      ecu_public_key = inventory.get_ecu_public_key(ecu_serial)
+
+    except uptane.UnknownECU:
       log.info(
           'Validation failed on an ECU Manifest: ECU ' + repr(ecu_serial) +
           ' is not registered.')
@@ -182,9 +290,7 @@ class Director:
           'new, Register the new ECU with its key in order to be able to '
           'submit its manifests.')
 
-    ecu_public_key = inventory.ecu_public_keys[ecu_serial]
-
-    valid = tuf.keys.verify_signature(
+    valid = uptane.common.verify_signature(
         ecu_public_key,
         signed_ecu_manifest['signatures'][0], # TODO: Fix assumptions.
         signed_ecu_manifest['signed'])
@@ -249,58 +355,153 @@ class Director:
         uptane.UnknownVehicle
           if the VIN provided is not known to this Director
 
+    """
+    # The work is done in three phases, which ManifestIngestionPipeline also
+    # runs separately:
+    #  - Checks that need no cryptography (which ECU each manifest purports to
+    #    be from, and whether that ECU is known) and the retrieval of the
+    #    public keys needed, all from the inventorydb.
+    #  - Verification of every signature in the Vehicle Manifest as one batch,
+    #    by verify_vehicle_manifest_signatures(), which touches no state.
+    #  - Saving of the Vehicle Manifest and each valid ECU Manifest in it.
+    # The Vehicle Manifest and the ECU Manifests in it are checked against
+    # their schemas in each phase; the validation session means their contents
+    # are only walked once.
+    with uptane.fastschema.validation_session():
+      primary_public_key, ecu_public_keys = self._prepare_vehicle_manifest(
+          vin, primary_ecu_serial, signed_vehicle_manifest)
+
+      primary_error, ecu_manifest_errors = verify_vehicle_manifest_signatures(
+          signed_vehicle_manifest, primary_public_key, ecu_public_keys)
+
+      self._commit_vehicle_manifest(vin, primary_ecu_serial,
+          signed_vehicle_manifest, primary_error, ecu_manifest_errors)
+
+
+
+
+
+  def _prepare_vehicle_manifest(
+      self, vin, primary_ecu_serial, signed_vehicle_manifest):
+    """
+    First phase of register_vehicle_manifest: checks the arguments and
+    registration and returns the public keys needed to verify the signatures
+    in the Vehicle Manifest, as (primary_public_key, ecu_public_keys).
+    Raises the errors that register_vehicle_manifest documents, other than
+    tuf.BadSignatureError.
     """
     uptane.formats.VIN_SCHEMA.check_match(vin)
     uptane.formats.ECU_SERIAL_SCHEMA.check_match(primary_ecu_serial)
     uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
         signed_vehicle_manifest)
 
-    if vin not in inventory.ecus_by_vin:
+    try:
+      inventory.check_vin_registered(vin)
+    except uptane.UnknownVehicle:
       raise uptane.UnknownVehicle('Received a vehicle manifest purportedly '
           'from a vehicle with a VIN that is not known to this Director.')
 
-    # Process Primary's signature on full manifest here.
-    # If it doesn't match expectations, error out here.
-    self.validate_primary_certification_in_vehicle_manifest(
-        vin, primary_ecu_serial, signed_vehicle_manifest)
-
-    # If the Primary's signature is valid, save the whole vehicle manifest to
-    # the inventorydb.
-    inventory.save_vehicle_manifest(vin, signed_vehicle_manifest)
+    # If the Primary is not who it should be, error out here.
+    if primary_ecu_serial != signed_vehicle_manifest['signed'][
+        'primary_ecu_serial']:
+      raise uptane.Spoofing('Received a spoofed or mistaken vehicle manifest: '
+          'the supposed origin Primary ECU (' + repr(primary_ecu_serial) + ') '
+          'is not the same as what is signed in the vehicle manifest itself ' +
+          '(' + repr(signed_vehicle_manifest['signed']['primary_ecu_serial']) +
+          ').')
 
-    log.info(GREEN + ' Received a Vehicle Manifest from Primary ECU ' +
-        repr(primary_ecu_serial) + ', with a valid signature from that ECU.' +
-        ENDCOLORS)
-    # TODO: Note that the above hasn't checked that the signature was from
-    # a Primary, just from an ECU. Fix.
+    try:
+      primary_public_key = inventory.get_ecu_public_key(primary_ecu_serial)
 
+    except uptane.UnknownECU:
+      log.debug(
+          'Rejecting a vehicle manifest from a Primary ECU whose '
+          'key is not registered.')
+      # Raise a fault for the offending ECU's XMLRPC request.
+      raise uptane.UnknownECU('The Director is not aware of the given Primary '
+          'ECU Serial (' + repr(primary_ecu_serial) + '. Manifest rejected. If '
+          'the ECU is new, Register the new ECU with its key in order to be '
+          'able to submit its manifests.')
 
-    # Validate signatures on and register all individual ECU manifests for each
-    # ECU (may have multiple manifests per ECU).
     all_ecu_manifests = \
         signed_vehicle_manifest['signed']['ecu_version_manifests']
 
+    # Unknown ECUs are simply left out; their manifests will be discarded.
+    ecu_public_keys = {}
     for ecu_serial in all_ecu_manifests:
-      ecu_manifests = all_ecu_manifests[ecu_serial]
-      for manifest in ecu_manifests:
-        try:
-          # This calls validate_ecu_manifest, which can raise the errors
-          # caught below.
-          self.register_ecu_manifest(vin, ecu_serial, manifest)
-        except uptane.Spoofing as e:
-          log.warning(
-              RED + 'Discarding a spoofed or malformed ECU Manifest. Error '
-              ' from validating that ECU manifest follows:\n' + ENDCOLORS +
-              repr(e))
-        except uptane.UnknownECU as e:
-          log.warning(
-              RED + 'Discarding an ECU Manifest from unknown ECU. Error from '
-              'validation attempt follows:\n' + ENDCOLORS + repr(e))
-        except tuf.BadSignatureError as e:
-          log.warning(
-              RED + 'Rejecting an ECU Manifest whose signature is invalid, '
-              'from within an otherwise valid Vehicle Manifest. Error from '
-              'validation attempt follows:\n' + ENDCOLORS + repr(e))
+      try:
+        ecu_public_keys[ecu_serial] = inventory.get_ecu_public_key(ecu_serial)
+      except uptane.UnknownECU:
+        pass
+
+    return primary_public_key, ecu_public_keys
+
+
+
+
+
+  def _commit_vehicle_manifest(self, vin, primary_ecu_serial,
+      signed_vehicle_manifest, primary_error, ecu_manifest_errors):
+    """
+    Last phase of register_vehicle_manifest: given the results of
+    verify_vehicle_manifest_signatures, raises primary_error if there is one,
+    and otherwise saves the Vehicle Manifest and each valid ECU Manifest in it,
+    discarding the others with a warning.
+    """
+    all_ecu_manifests = \
+        signed_vehicle_manifest['signed']['ecu_version_manifests']
+
+    if primary_error is not None:
+      log.debug(
+          'Rejecting a vehicle manifest because the Primary signature on it is '
+          'not valid. It must be correctly signed by the expected Primary ECU '
+          'key.')
+      # Raise a fault for the offending ECU's XMLRPC request.
+      raise primary_error
+
+    # If the Primary's signature is valid, save the whole vehicle manifest to
+    # the inventorydb, then each valid ECU Manifest in it. Each is checked
+    # against its schema when saved; the validation session means their
+    # contents are only walked once.
+    with uptane.fastschema.validation_session():
+      vehicle_manifest_id = inventory.save_vehicle_manifest(
+          vin, signed_vehicle_manifest)
+
+      log.info(GREEN + ' Received a Vehicle Manifest from Primary ECU ' +
+          repr(primary_ecu_serial) + ', with a valid signature from that ECU.' +
+          ENDCOLORS)
+      # TODO: Note that the above hasn't checked that the signature was from
+      # a Primary, just from an ECU. Fix.
+
+
+      # Register all the individual ECU manifests that were valid for each ECU
+      # (may have multiple manifests per ECU), and discard the rest with a
+      # warning.
+      for ecu_serial in all_ecu_manifests:
+        ecu_manifests = all_ecu_manifests[ecu_serial]
+        for position, manifest in enumerate(ecu_manifests):
+          error = ecu_manifest_errors[ecu_serial][position]
+
+          if error is None:
+            # The ECU Manifest is stored by reference to the Vehicle Manifest
+            # saved above.
+            self._save_ecu_manifest(vin, ecu_serial, manifest,
+                vehicle_manifest_id=vehicle_manifest_id, position=position)
+
+          elif isinstance(error, uptane.Spoofing):
+            log.warning(
+                RED + 'Discarding a spoofed or malformed ECU Manifest. Error '
+                ' from validating that ECU manifest follows:\n' + ENDCOLORS +
+                repr(error))
+          elif isinstance(error, uptane.UnknownECU):
+            log.warning(
+                RED + 'Discarding an ECU Manifest from unknown ECU. Error from '
+                'validation attempt follows:\n' + ENDCOLORS + repr(error))
+          elif isinstance(error, tuf.BadSignatureError):
+            log.warning(
+                RED + 'Rejecting an ECU Manifest whose signature is invalid, '
+                'from within an otherwise valid Vehicle Manifest. Error from '
+                'validation attempt follows:\n' + ENDCOLORS + repr(error))
 
 
 
@@ -332,7 +533,10 @@ class Director:
 
     # TODO: Consider mechanism for fetching keys from inventorydb itself,
     # rather than always registering them after Director svc starts up.
-    if primary_ecu_serial not in inventory.ecu_public_keys:
+    try:
+      ecu_public_key = inventory.get_ecu_public_key(primary_ecu_serial)
+
+    except uptane.UnknownECU:
       log.debug(
           'Rejecting a vehicle manifest from a Primary ECU whose '
           'key is not registered.')
@@ -342,9 +546,7 @@ class Director:
           'the ECU is new, Register the new ECU with its key in order to be '
           'able to submit its manifests.')
 
-    ecu_public_key = inventory.ecu_public_keys[primary_ecu_serial]
-
-    valid = tuf.keys.verify_signature(
+    valid = uptane.common.verify_signature(
         ecu_public_key,
         vehicle_manifest['signatures'][0], # TODO: Fix assumptions.
         vehicle_manifest['signed'])
@@ -364,15 +566,34 @@ class Director:
 
 
 
-  def register_ecu_manifest(self, vin, ecu_serial, signed_ecu_manifest):
+  def register_ecu_manifest(self, vin, ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=None, position=None):
     """
+    Validates the given ECU Manifest and saves it in the InventoryDB.
+
+    If the ECU Manifest is part of a Vehicle Manifest already saved in the
+    InventoryDB, vehicle_manifest_id and position identify it there (see
+    inventorydb.save_ecu_manifest), so that it is not stored twice.
     """
     # Error out if the signature isn't valid and from the expected party.
     # Also checks argument format.
     self.validate_ecu_manifest(ecu_serial, signed_ecu_manifest)
 
     # Otherwise, we save it:
-    inventory.save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest)
+    self._save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest,
+        vehicle_manifest_id=vehicle_manifest_id, position=position)
+
+
+
+
+
+  def _save_ecu_manifest(self, vin, ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=None, position=None):
+    """
+    Saves an ECU Manifest that has already been validated.
+    """
+    inventory.save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest,
+        vehicle_manifest_id=vehicle_manifest_id, position=position)
 
     log.debug('Stored a valid ECU manifest from ECU ' + repr(ecu_serial))
 
@@ -420,6 +641,9 @@ class Director:
 
     If the repository already exists, it is overwritten.
 
+    In shared-root mode (see class docstring), the repository is not created
+    until it is first used.
+
     Usage:
 
       d = uptane.services.director.Director(...)
@@ -440,12 +664,9 @@ class Director:
 
     uptane.formats.VIN_SCHEMA.check_match(vin)
 
-    # Repository Tool expects to use the current directory.
-    # Figure out if this is impactful and needs to be changed.
-    os.chdir(self.director_repos_dir) # TODO: Is messing with cwd a bad idea?
-
     # Generates absolute path for a subdirectory with name equal to vin,
-    # in the current directory, making (relatively) sure that there isn't
+    # in the Director's repositories directory, making (relatively) sure that
+    # there isn't
     # anything suspect like "../" in the VIN.
     # Then I strip the common prefix back off the absolute path to get a
     # relative path and keep the guarantees.
@@ -453,19 +674,292 @@ class Director:
     vin = uptane.common.scrub_filename(vin, self.director_repos_dir)
     vin = os.path.relpath(vin, self.director_repos_dir)
 
-    self.vehicle_repositories[vin] = this_repo = rt.create_new_repository(
-        vin, repository_name=vin)
+    if self.shared_root:
+      self.vehicle_repositories.add(vin)
+    else:
+      self.vehicle_repositories[vin] = self._load_director_repo(vin, False)
+
+    self.mark_director_repo_dirty(vin)
+
+
+
 
 
-    this_repo.root.add_verification_key(self.key_dirroot_pub)
-    this_repo.timestamp.add_verification_key(self.key_dirtime_pub)
-    this_repo.snapshot.add_verification_key(self.key_dirsnap_pub)
-    this_repo.targets.add_verification_key(self.key_dirtarg_pub)
+  def _load_director_repo(self, vin, exists):
+    """
+    Returns a new repository object for the given vehicle, with the Director's
+    keys loaded. If exists is True, the repository's metadata is loaded from
+    the last write of that repository (in metadata.staged); otherwise, a new
+    repository is created.
+    """
+    repo_dir = os.path.join(self._director_repos_abspath, vin)
+
+    if exists:
+      this_repo = rt.load_repository(repo_dir, repository_name=vin)
+
+    else:
+      this_repo = rt.create_new_repository(repo_dir, repository_name=vin)
+
+      this_repo.root.add_verification_key(self.key_dirroot_pub)
+      this_repo.timestamp.add_verification_key(self.key_dirtime_pub)
+      this_repo.snapshot.add_verification_key(self.key_dirsnap_pub)
+      this_repo.targets.add_verification_key(self.key_dirtarg_pub)
+
     this_repo.root.load_signing_key(self.key_dirroot_pri)
     this_repo.timestamp.load_signing_key(self.key_dirtime_pri)
     this_repo.snapshot.load_signing_key(self.key_dirsnap_pri)
     this_repo.targets.load_signing_key(self.key_dirtarg_pri)
 
+    return this_repo
+
+
+
+
+
+  def _unload_director_repo(self, vin, repo, persist):
+    """
+    Releases the given vehicle repository, which is being dropped from memory.
+    If persist is True and the repository has changed since it was last
+    written, it is first written (to metadata.staged), so that
+    _load_director_repo can load it again later, and the next call to
+    write_dirty_director_repos reports it as written. A repository that has
+    not changed is not written again, so its metadata versions stay the same.
+    """
+    if persist:
+      with self._dirty_vins_lock:
+        dirty = vin in self.dirty_vins
+        self.dirty_vins.discard(vin)
+
+      if dirty:
+        write_time = time.time()
+
+        try:
+          self._write_director_repo(repo)
+
+        except Exception:
+          self.mark_director_repo_dirty(vin)
+          raise
+
+        with self._dirty_vins_lock:
+          self._written_vins.add(vin)
+          self._write_times[vin] = write_time
+
+    # Release what TUF holds for the repository.
+    tuf.roledb.remove_roledb(vin)
+    tuf.keydb.remove_keydb(vin)
+
+
+
+
+
+  def write_director_repo(self, vin):
+    """
+    Signs and writes the metadata for the given vehicle's repository to its
+    metadata.staged directory. In shared-root mode, the vehicle's root metadata
+    is then replaced by a link to the shared copy.
+    """
+    uptane.formats.VIN_SCHEMA.check_match(vin)
+
+    if vin not in self.vehicle_repositories:
+      raise uptane.UnknownVehicle('The VIN provided, ' + repr(vin) + ' is not '
+          'that of a vehicle known to this Director.')
+
+    write_time = time.time()
+
+    self._write_director_repo(self.vehicle_repositories[vin])
+
+    with self._dirty_vins_lock:
+      self._write_times[vin] = write_time
+
+
+
+
+
+  def _write_director_repo(self, repo):
+
+    # Writing re-signs the metadata of every role, so extend the expiration of
+    # each role that must be kept fresh (see EXPIRATION_REFRESH_MARGIN).
+    now = time.time()
+    for role, expiration in [
+        (repo.timestamp, rt.TIMESTAMP_EXPIRATION),
+        (repo.snapshot, rt.SNAPSHOT_EXPIRATION),
+        (repo.targets, rt.TARGETS_EXPIRATION)]:
+      role.expiration = tuf.formats.unix_timestamp_to_datetime(
+          int(now + expiration))
+
+    if not self.shared_root:
+      repo.write()
+      return
+
+    # Writing increments the version of each role's metadata. Pin the version
+    # (and expiration) of root metadata, so that it is identical for every
+    # vehicle and unchanged by each write.
+    repo.root.version = SHARED_ROOT_VERSION - 1
+    repo.root.expiration = self.root_expiration
+
+    repo.write()
+
+    root_fname = os.path.join(
+        repo._repository_directory, 'metadata.staged', 'root.json')
+
+    with open(root_fname, 'rb') as fobj:
+      digest = hashlib.sha256(fobj.read()).hexdigest()
+
+    shared_root_dir = os.path.join(self.director_repos_dir, '.shared_root')
+    shared_root_fname = os.path.join(shared_root_dir, digest + '.root.json')
+
+    if not os.path.exists(shared_root_dir):
+      os.makedirs(shared_root_dir)
+
+    with self._shared_root_lock:
+      try:
+        # The first vehicle to write this root metadata provides the shared
+        # copy.
+        os.link(root_fname, shared_root_fname)
+
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+
+        # The shared copy already exists. Atomically replace this vehicle's
+        # copy with a link to it.
+        temp_fname = root_fname + '.link'
+        if os.path.exists(temp_fname):
+          os.remove(temp_fname)
+        os.link(shared_root_fname, temp_fname)
+        os.rename(temp_fname, root_fname)
+
+
+
+
+
+  def remove_unused_shared_roots(self):
+    """
+    In shared-root mode, removes the shared copies of root metadata (see
+    write_director_repo) that no vehicle's repository links to any longer,
+    e.g. after the root metadata was changed and every vehicle's repository
+    rewritten. Returns the filenames of the copies removed.
+    write_dirty_director_repos calls this after writing repositories.
+    """
+    shared_root_dir = os.path.join(self.director_repos_dir, '.shared_root')
+
+    if not os.path.exists(shared_root_dir):
+      return []
+
+    removed = []
+
+    with self._shared_root_lock:
+      for fname in sorted(os.listdir(shared_root_dir)):
+        if not fname.endswith('.root.json'):
+          continue
+
+        shared_root_fname = os.path.join(shared_root_dir, fname)
+
+        # The shared directory's own entry is the only link left.
+        if os.stat(shared_root_fname).st_nlink == 1:
+          os.remove(shared_root_fname)
+          removed.append(shared_root_fname)
+
+    return removed
+
+
+
+
+
+  def mark_director_repo_dirty(self, vin):
+    """
+    Notes that the given vehicle's repository has changed, so that the next
+    call to write_dirty_director_repos writes it. The Director's own methods
+    (e.g. add_target_for_ecu) do this; call it after changing a repository
+    in vehicle_repositories directly (e.g. changing its keys or expiration).
+    """
+    with self._dirty_vins_lock:
+      self.dirty_vins.add(vin)
+
+
+
+
+
+  def write_dirty_director_repos(self, vins=None):
+    """
+    Signs and writes (see write_director_repo) the repository of each vehicle
+    that has changed since it was last written by this method, or whose
+    metadata is due to expire soon (see EXPIRATION_REFRESH_MARGIN), leaving
+    the other vehicles' metadata untouched. If vins is given, only the
+    repositories of those vehicles (those of them that need writing) are
+    written. Call this periodically, not only after changes, so that vehicles
+    keep receiving unexpired metadata.
+
+    Returns the list of VINs of the vehicles whose repositories were written,
+    so that the caller can publish those. These include vehicles whose
+    changed repositories were written when they were dropped from memory
+    since the last call (see evict_idle_vehicle_repos).
+    """
+    if vins is not None:
+      for vin in vins:
+        uptane.formats.VIN_SCHEMA.check_match(vin)
+
+    # Repositories written before this time have timestamp metadata expiring
+    # within EXPIRATION_REFRESH_MARGIN seconds.
+    refresh_before = \
+        time.time() + EXPIRATION_REFRESH_MARGIN - rt.TIMESTAMP_EXPIRATION
+
+    with self._dirty_vins_lock:
+      vins_needing_write = self.dirty_vins.union(
+          vin for vin, write_time in self._write_times.items()
+          if write_time < refresh_before)
+
+      if vins is None:
+        vins_to_write = sorted(vins_needing_write)
+        already_written = self._written_vins
+      else:
+        vins_to_write = sorted(vins_needing_write.intersection(vins))
+        already_written = self._written_vins.intersection(vins)
+
+      self._written_vins = self._written_vins.difference(already_written)
+
+    written_vins = [vin for vin in already_written if vin not in vins_to_write]
+
+    for vin in vins_to_write:
+      # Clear the mark first, so that a change made while writing marks the
+      # repository dirty again. If writing fails, restore the mark.
+      with self._dirty_vins_lock:
+        self.dirty_vins.discard(vin)
+
+      try:
+        self.write_director_repo(vin)
+
+      except Exception:
+        self.mark_director_repo_dirty(vin)
+        with self._dirty_vins_lock:
+          self._written_vins.update(already_written)
+        raise
+
+      written_vins.append(vin)
+
+    if self.shared_root and vins_to_write:
+      self.remove_unused_shared_roots()
+
+    return sorted(written_vins)
+
+
+
+
+
+  def evict_idle_vehicle_repos(self, idle_seconds):
+    """
+    In shared-root mode, writes and drops from memory the repositories of
+    vehicles that have not been used for at least idle_seconds seconds.
+    Returns the VINs of the vehicles whose repositories were dropped.
+    """
+    tuf.formats.LENGTH_SCHEMA.check_match(idle_seconds)
+
+    if not self.shared_root:
+      raise uptane.Error('Vehicle repositories can only be evicted from '
+          'memory in shared-root mode.')
+
+    return self.vehicle_repositories.evict_idle(idle_seconds)
+
 
 
 
@@ -497,6 +991,8 @@ class Director:
     self.vehicle_repositories[vin].targets.add_target(
         target_filepath, custom={'ecu_serial': ecu_serial})
 
+    self.mark_director_repo_dirty(vin)
+
 
 
 
@@ -511,3 +1007,526 @@ class Director:
 
 
 
+
+class VehicleRepositories(object):
+  """
+  A dictionary-like collection of vehicle repositories, indexed by VIN, that
+  holds in memory only the repositories in use. Used by a Director in
+  shared-root mode (see Director).
+
+  Repositories are obtained and released through the two functions given:
+
+    load_repository(vin, exists)
+      returns the repository for the given VIN. exists is False if the
+      repository has not been loaded before (since the VIN was added), in
+      which case it should be created anew.
+
+    unload_repository(vin, repository, persist)
+      releases the given repository, which is being dropped from memory. If
+      persist is True, it must be saved so that load_repository can load it
+      again later.
+
+  A repository is loaded when it is first looked up (e.g. vehicle_repos[vin]).
+  If more than max_loaded repositories are loaded, the least recently used
+  are unloaded; evict and evict_idle unload repositories explicitly.
+  """
+
+  def __init__(self, load_repository, unload_repository, max_loaded=None):
+
+    self._load_repository = load_repository
+    self._unload_repository = unload_repository
+    self._max_loaded = max_loaded
+
+    # Maps each VIN added to whether or not its repository has been unloaded
+    # (and so saved) before, so that it should be loaded rather than created.
+    self._vins = {}
+
+    # Maps the VIN of each loaded repository to [repository, time last used],
+    # least recently used first.
+    self._loaded = collections.OrderedDict()
+
+    self._lock = threading.RLock()
+
+
+
+  def add(self, vin):
+    """
+    Adds a vehicle, whose repository will be created when first looked up. If
+    the vehicle has already been added, its repository is discarded, to be
+    created anew.
+    """
+    with self._lock:
+      if vin in self._loaded:
+        repository = self._loaded.pop(vin)[0]
+        self._unload_repository(vin, repository, False)
+
+      self._vins[vin] = False
+
+
+
+  def __contains__(self, vin):
+    return vin in self._vins
+
+
+
+  def __iter__(self):
+    with self._lock:
+      return iter(list(self._vins))
+
+
+
+  def __len__(self):
+    return len(self._vins)
+
+
+
+  def keys(self):
+    return list(self)
+
+
+
+  def __getitem__(self, vin):
+
+    with self._lock:
+      if vin not in self._vins:
+        raise KeyError(vin)
+
+      if vin in self._loaded:
+        entry = self._loaded.pop(vin)
+
+      else:
+        entry = [self._load_repository(vin, self._vins[vin]), None]
+
+      entry[1] = time.time()
+      self._loaded[vin] = entry
+
+      if self._max_loaded is not None:
+        while len(self._loaded) > max(self._max_loaded, 1):
+          self.evict(next(iter(self._loaded)))
+
+      return entry[0]
+
+
+
+  def loaded_vins(self):
+    """
+    Returns the VINs of the vehicles whose repositories are in memory, least
+    recently used first.
+    """
+    with self._lock:
+      return list(self._loaded)
+
+
+
+  def evict(self, vin):
+    """
+    Saves and drops from memory the repository for the given VIN, if it is
+    loaded.
+    """
+    with self._lock:
+      if vin not in self._loaded:
+        return
+
+      repository = self._loaded[vin][0]
+      self._unload_repository(vin, repository, True)
+
+      del self._loaded[vin]
+      self._vins[vin] = True
+
+
+
+  def evict_idle(self, idle_seconds):
+    """
+    Saves and drops from memory the repositories not used in the last
+    idle_seconds seconds, returning their VINs.
+    """
+    with self._lock:
+      cutoff = time.time() - idle_seconds
+      idle_vins = [vin for vin in self._loaded
+          if self._loaded[vin][1] <= cutoff]
+
+      for vin in idle_vins:
+        self.evict(vin)
+
+      return idle_vins
+
+
+
+
+
+def verify_vehicle_manifest_signatures(
+    signed_vehicle_manifest, primary_public_key, ecu_public_keys):
+  """
+  Checks the Primary's signature on the given Vehicle Manifest and the
+  signature on each ECU Manifest within it, verifying all of the signatures as
+  one batch (see uptane.common.verify_signatures), so that each signed object
+  is encoded only once.
+
+  This uses no state beyond its arguments, so that it can be run anywhere
+  (e.g. in another process). It does not check the format of its arguments;
+  the caller should have done so.
+
+  Arguments:
+    signed_vehicle_manifest
+      a Vehicle Manifest, uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA
+
+    primary_public_key
+      the public key registered for the Primary that sent the Vehicle Manifest
+
+    ecu_public_keys
+      a dictionary mapping the ECU Serials of the ECU Manifests in the Vehicle
+      Manifest to the public keys registered for those ECUs. ECUs that are not
+      registered should be left out.
+
+  Returns:
+    A tuple (primary_error, ecu_manifest_errors).
+    primary_error is None if the Primary's signature is valid, and otherwise a
+    tuf.BadSignatureError to raise.
+    ecu_manifest_errors is a dictionary mapping each ECU Serial in the Vehicle
+    Manifest to a list with one element per ECU Manifest from that ECU, in
+    order: None if the ECU Manifest is valid, and otherwise an
+    uptane.Spoofing, uptane.UnknownECU, or tuf.BadSignatureError describing
+    why it is not.
+  """
+
+  all_ecu_manifests = \
+      signed_vehicle_manifest['signed']['ecu_version_manifests']
+
+  ecu_manifest_errors = {}
+
+  # The Primary's signature is verified first, and then the signature on each
+  # ECU Manifest from a known ECU. Record where each one is.
+  signatures_to_verify = [(
+      primary_public_key,
+      signed_vehicle_manifest['signatures'][0], # TODO: Fix assumptions.
+      signed_vehicle_manifest['signed'])]
+  positions_verified = []
+
+  for ecu_serial in all_ecu_manifests:
+    ecu_manifest_errors[ecu_serial] = errors = []
+
+    for position, signed_ecu_manifest in enumerate(
+        all_ecu_manifests[ecu_serial]):
+
+      if ecu_serial != signed_ecu_manifest['signed']['ecu_serial']:
+        errors.append(uptane.Spoofing('Received a spoofed or mistaken '
+            'manifest: supposed origin ECU (' + repr(ecu_serial) + ') is not '
+            'the same as what is signed in the manifest itself (' +
+            repr(signed_ecu_manifest['signed']['ecu_serial']) + ').'))
+
+      elif ecu_serial not in ecu_public_keys:
+        errors.append(uptane.UnknownECU('The Director is not aware of the '
+            'given ECU SERIAL (' + repr(ecu_serial) + '. Manifest rejected. If '
+            'the ECU is new, Register the new ECU with its key in order to be '
+            'able to submit its manifests.'))
+
+      else:
+        errors.append(None)
+        signatures_to_verify.append((
+            ecu_public_keys[ecu_serial],
+            signed_ecu_manifest['signatures'][0], # TODO: Fix assumptions.
+            signed_ecu_manifest['signed']))
+        positions_verified.append((ecu_serial, position))
+
+
+  results = uptane.common.verify_signatures(signatures_to_verify)
+
+  primary_error = None
+  if not results[0]:
+    primary_error = tuf.BadSignatureError('Sender supplied an invalid '
+        'signature. Vehicle Manifest is questionable; discarding. If you see '
+        'this persistently, it is possible that there is a man in the middle '
+        'attack or misconfiguration.')
+
+  for (ecu_serial, position), valid in zip(positions_verified, results[1:]):
+    if not valid:
+      ecu_manifest_errors[ecu_serial][position] = tuf.BadSignatureError(
+          'Sender supplied an invalid signature. ECU Manifest is '
+          'unacceptable. If you see this persistently, it is possible that '
+          'the Primary is compromised or that there is a man in the middle '
+          'attack or misconfiguration.')
+
+  return primary_error, ecu_manifest_errors
+
+
+
+
+
+def _verify_vehicle_manifest_signatures_in_worker(args):
+  """
+  Runs verify_vehicle_manifest_signatures in a worker process of a
+  ManifestIngestionPipeline, returning (error, result): any exception is
+  returned rather than raised, so that it reaches the pipeline intact.
+  """
+  try:
+    return None, verify_vehicle_manifest_signatures(*args)
+  except Exception as e:
+    return e, None
+
+
+
+
+
+class PendingVehicleManifest(object):
+  """
+  A Vehicle Manifest submitted to a ManifestIngestionPipeline, returned by
+  ManifestIngestionPipeline.submit().
+
+  Call wait() to block until the manifest has been processed. wait() returns
+  None if the manifest was registered and raises whatever
+  Director.register_vehicle_manifest would have raised otherwise.
+  """
+
+  def __init__(self, vin, primary_ecu_serial, signed_vehicle_manifest):
+    self.vin = vin
+    self.primary_ecu_serial = primary_ecu_serial
+    self.signed_vehicle_manifest = signed_vehicle_manifest
+
+    # Set by the pipeline. verification is the result of
+    # verify_vehicle_manifest_signatures, and error any exception raised
+    # while processing the manifest.
+    self.verified = False
+    self.verification = None
+    self.error = None
+
+    self._done = threading.Event()
+
+
+
+  def done(self):
+    return self._done.is_set()
+
+
+
+  def wait(self, timeout=None):
+    """
+    Blocks until the manifest has been processed (or timeout seconds have
+    passed, raising uptane.Error). Raises the error that processing it
+    produced, if any.
+    """
+    if not self._done.wait(timeout):
+      raise uptane.Error('Timed out waiting for a Vehicle Manifest from VIN ' +
+          repr(self.vin) + ' to be processed.')
+
+    if self.error is not None:
+      raise self.error
+
+
+
+
+
+class ManifestIngestionPipeline(object):
+  """
+  Registers Vehicle Manifests with a Director, verifying their signatures in
+  a pool of worker processes, so that ingestion is not limited to one core.
+
+  Each Vehicle Manifest submitted goes through the same three phases as in
+  Director.register_vehicle_manifest:
+
+    - A dispatching thread takes it from the intake queue, performs the
+      checks that need the inventorydb, and sends it to the process pool.
+    - A worker process runs verify_vehicle_manifest_signatures on it.
+    - The results are committed to the inventorydb, by the thread that
+      finished its verification (usually the pool's result thread).
+      Manifests from the same VIN are committed in the order in which they
+      were submitted, even if their verification finishes out of order: a
+      manifest whose verification finishes early waits for those submitted
+      before it from the same vehicle, but not for those from other vehicles.
+
+  At most max_pending Vehicle Manifests may be in the pipeline (submitted but
+  not yet committed) at once; submit() blocks until there is room.
+
+  Usage:
+    pipeline = ManifestIngestionPipeline(director, num_processes=4)
+    pending = pipeline.submit(vin, primary_ecu_serial, signed_vehicle_manifest)
+    ...
+    pending.wait()
+    ...
+    pipeline.close()
+
+  Or, with the same interface as Director.register_vehicle_manifest (e.g. for
+  use by an XMLRPC server with one thread per request):
+    pipeline.register_vehicle_manifest(
+        vin, primary_ecu_serial, signed_vehicle_manifest)
+
+  Arguments:
+    director
+      the Director to register manifests with
+
+    num_processes
+      the number of worker processes; by default, the number of CPUs
+
+    max_pending
+      the maximum number of Vehicle Manifests in the pipeline at once
+  """
+
+  def __init__(self, director, num_processes=None, max_pending=1000):
+
+    if num_processes is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(num_processes)
+    tuf.formats.LENGTH_SCHEMA.check_match(max_pending)
+
+    self.director = director
+
+    self._pool = multiprocessing.Pool(num_processes)
+    self._intake = queue.Queue(maxsize=max_pending)
+    self._room = threading.BoundedSemaphore(max_pending)
+
+    # Manifests dispatched but not yet committed, by VIN, in order of
+    # submission, and the VINs whose manifests some thread is committing.
+    # Access to both is protected by _commit_lock, which is not held while
+    # committing.
+    self._pending_by_vin = {}
+    self._committing_vins = set()
+    self._commit_lock = threading.Lock()
+
+    # Protects _closed, so that no manifest is queued after the sentinel
+    # with which close() stops the dispatcher.
+    self._closed = False
+    self._intake_lock = threading.Lock()
+
+    self._dispatcher = threading.Thread(target=self._dispatch)
+    self._dispatcher.daemon = True
+    self._dispatcher.start()
+
+
+
+  def submit(self, vin, primary_ecu_serial, signed_vehicle_manifest):
+    """
+    Queues the given Vehicle Manifest for registration, blocking while the
+    pipeline is full, and returns a PendingVehicleManifest.
+
+    Raises uptane.Error if the pipeline has been closed.
+    """
+    if self._closed:
+      raise uptane.Error('This manifest ingestion pipeline has been closed.')
+
+    pending = PendingVehicleManifest(
+        vin, primary_ecu_serial, signed_vehicle_manifest)
+
+    self._room.acquire()
+
+    with self._intake_lock:
+      if self._closed:
+        self._room.release()
+        raise uptane.Error('This manifest ingestion pipeline has been closed.')
+
+      self._intake.put(pending)
+
+    return pending
+
+
+
+  def register_vehicle_manifest(
+      self, vin, primary_ecu_serial, signed_vehicle_manifest):
+    """
+    Synchronous equivalent of Director.register_vehicle_manifest, with the
+    same arguments, return value and exceptions, going through the pipeline.
+    """
+    self.submit(vin, primary_ecu_serial, signed_vehicle_manifest).wait()
+
+
+
+  def close(self):
+    """
+    Stops accepting Vehicle Manifests, waits for those already submitted to be
+    processed, and shuts down the worker processes.
+    """
+    with self._intake_lock:
+      if self._closed:
+        return
+
+      self._closed = True
+      self._intake.put(None) # Tells the dispatcher to stop.
+
+    self._dispatcher.join()
+    self._pool.close()
+    self._pool.join()
+
+
+
+  def _dispatch(self):
+    """Runs in the dispatching thread until close() is called."""
+
+    while True:
+      pending = self._intake.get()
+
+      if pending is None:
+        return
+
+      with self._commit_lock:
+        self._pending_by_vin.setdefault(
+            pending.vin, collections.deque()).append(pending)
+
+      try:
+        primary_public_key, ecu_public_keys = \
+            self.director._prepare_vehicle_manifest(pending.vin,
+            pending.primary_ecu_serial, pending.signed_vehicle_manifest)
+
+      except Exception as e:
+        self._verified(pending, (e, None))
+        continue
+
+      # The worker reports verification errors in its outcome, so
+      # error_callback only runs if the pool itself fails (e.g. the arguments
+      # or the outcome cannot be pickled, or a worker dies), in which case
+      # the manifest must still be finished, or it and every later manifest
+      # from the same vehicle would wait forever.
+      self._pool.apply_async(
+          _verify_vehicle_manifest_signatures_in_worker,
+          ((pending.signed_vehicle_manifest, primary_public_key,
+          ecu_public_keys),),
+          callback=lambda outcome, pending=pending:
+              self._verified(pending, outcome),
+          error_callback=lambda e, pending=pending:
+              self._verified(pending, (e, None)))
+
+
+
+  def _verified(self, pending, outcome):
+    """
+    Records the outcome ((error, verification)) of the first two phases for
+    the given manifest, and commits every manifest from the same vehicle that
+    is now at the front of the line, unless another thread is already
+    committing that vehicle's manifests (in which case it will).
+    """
+    vin = pending.vin
+
+    with self._commit_lock:
+      pending.error, pending.verification = outcome
+      pending.verified = True
+
+      if vin in self._committing_vins:
+        return
+      self._committing_vins.add(vin)
+
+    while True:
+      with self._commit_lock:
+        in_order = self._pending_by_vin[vin]
+
+        if not in_order or not in_order[0].verified:
+          if not in_order:
+            del self._pending_by_vin[vin]
+          self._committing_vins.remove(vin)
+          return
+
+        next_pending = in_order.popleft()
+
+      self._commit(next_pending)
+
+
+
+  def _commit(self, pending):
+    try:
+      if pending.error is None:
+        primary_error, ecu_manifest_errors = pending.verification
+        self.director._commit_vehicle_manifest(pending.vin,
+            pending.primary_ecu_serial, pending.signed_vehicle_manifest,
+            primary_error, ecu_manifest_errors)
+
+    except Exception as e:
+      pending.error = e
+
+    finally:
+      pending._done.set()
+      self._room.release()
@@ -16,10 +16,43 @@
 
 
 
+<Storage Backends>
+  The public functions below check their arguments and the registration of
+  vehicles and ECUs, and delegate the storage itself to a backend object from
+  uptane.services.inventorydb_backends. By default, this is a
+  MemoryInventoryBackend holding the global dictionaries described below.
+
+  To persist the inventory across restarts and keep lookups indexed at large
+  fleet sizes, switch to the SQLite backend before registering anything:
+
+    inventorydb.set_backend(
+        inventorydb_backends.SQLiteInventoryBackend('inventory.sqlite'))
+
+  Note that when another backend is in use, the global dictionaries below are
+  not used and remain empty; code outside this module should use the public
+  functions rather than reading the dictionaries directly.
+
+
+
+<Retention>
+  By default, every manifest saved is kept. set_retention_policy() limits the
+  number of manifests kept per vehicle and per ECU (older ones are removed as
+  new ones are saved), and prune_manifests_older_than() removes manifests
+  older than a given timeserver time. Removed manifests are discarded, or, if
+  a spill directory is configured, appended to compressed segments on disk
+  (one gzip member per pruning) from which they can be read back with
+  get_spilled_vehicle_manifests() and get_spilled_ecu_manifests().
+
+  ECU Manifests that the Director saves from within a Vehicle Manifest are
+  stored by reference to that Vehicle Manifest rather than as a second copy.
+
+
+
 <Globals>
   The following five global dictionaries store information about ECUs and
   vehicles, including their serials, keys, and manifests submitted from
-  (ostensibly) them to the Director.
+  (ostensibly) them to the Director, when the default in-memory backend is in
+  use.
 
     vehicle_manifests
 
@@ -91,17 +124,29 @@
 
 <Public Functions>
 
+  Storage:
+    set_backend(new_backend)
+
+  Retention:
+    set_retention_policy(max_vehicle_manifests_per_vin=None,
+        max_ecu_manifests_per_ecu=None, spill_dir=None)
+    prune_manifests_older_than(timeserver_time)
+    get_spilled_vehicle_manifests(vin)
+    get_spilled_ecu_manifests(ecu_serial)
+
   Registration:
     register_ecu(is_primary, vin, ecu_serial, public_key, overwrite=True)
     check_ecu_registered(ecu_serial)
     check_vin_registered(vin)
+    get_ecu_serials_in_vehicle(vin)
 
   Get Public Key:
     get_ecu_public_key(ecu_serial)
 
   Save Manifests:
     save_vehicle_manifest(vin, signed_vehicle_manifest)
-    save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest)
+    save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest,
+        vehicle_manifest_id=None, position=None)
 
   Get Manifests:
     get_vehicle_manifests(vin)
@@ -117,8 +162,14 @@ from io import open
 
 import uptane
 import uptane.formats
+import uptane.services.inventorydb_backends as backends
 import tuf
 
+import binascii
+import gzip
+import json
+import os
+
 # Global dictionaries
 vehicle_manifests = {}
 ecu_manifests = {}
@@ -126,6 +177,188 @@ primary_ecus_by_vin = {}
 ecus_by_vin = {}
 ecu_public_keys = {}
 
+# The default backend, storing data in the global dictionaries above.
+memory_backend = backends.MemoryInventoryBackend(
+    vehicle_manifests=vehicle_manifests,
+    ecu_manifests=ecu_manifests,
+    primary_ecus_by_vin=primary_ecus_by_vin,
+    ecus_by_vin=ecus_by_vin,
+    ecu_public_keys=ecu_public_keys)
+
+# The backend that all public functions in this module currently use.
+backend = memory_backend
+
+# How many manifests to keep, and where to put those removed. See
+# set_retention_policy(). None means no limit / discard removed manifests.
+retention_policy = {
+    'max_vehicle_manifests_per_vin': None,
+    'max_ecu_manifests_per_ecu': None,
+    'spill_dir': None}
+
+
+
+def set_backend(new_backend):
+  """
+  Makes the given storage backend (an instance of a subclass of
+  uptane.services.inventorydb_backends.InventoryBackend) the one used by all
+  functions in this module. Data stored in the previous backend is not copied.
+
+  To return to the default in-memory backend, pass memory_backend.
+
+  <Exceptions>
+    tuf.FormatError
+      if new_backend is not an InventoryBackend
+  """
+  global backend
+
+  if not isinstance(new_backend, backends.InventoryBackend):
+    raise tuf.FormatError('Expected an inventory backend (an instance of '
+        'uptane.services.inventorydb_backends.InventoryBackend); received: ' +
+        repr(new_backend))
+
+  backend = new_backend
+
+
+
+
+
+def set_retention_policy(max_vehicle_manifests_per_vin=None,
+    max_ecu_manifests_per_ecu=None, spill_dir=None):
+  """
+  Sets how many manifests are kept for each vehicle and each ECU. Whenever a
+  manifest is saved, the oldest manifests beyond these limits are removed.
+  None means no limit. Limits apply to manifests saved from now on; existing
+  manifests beyond the limits are removed the next time the vehicle or ECU
+  saves a manifest.
+
+  If spill_dir is not None, removed manifests (including those removed by
+  prune_manifests_older_than) are appended to compressed files in that
+  directory rather than discarded. The directory is created if necessary.
+
+  <Exceptions>
+    tuf.FormatError
+      if the limits are not positive integers or None, or spill_dir is not a
+      path or None
+  """
+  for limit in [max_vehicle_manifests_per_vin, max_ecu_manifests_per_ecu]:
+    if limit is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(limit)
+      if limit < 1:
+        raise tuf.FormatError('Manifest retention limits must be at least 1; '
+            'received ' + repr(limit))
+
+  if spill_dir is not None:
+    tuf.formats.PATH_SCHEMA.check_match(spill_dir)
+
+  retention_policy['max_vehicle_manifests_per_vin'] = \
+      max_vehicle_manifests_per_vin
+  retention_policy['max_ecu_manifests_per_ecu'] = max_ecu_manifests_per_ecu
+  retention_policy['spill_dir'] = spill_dir
+
+
+
+
+
+def prune_manifests_older_than(timeserver_time):
+  """
+  Removes, for every vehicle and ECU, manifests older than the given
+  timeserver time (tuf.formats.ISO8601_DATETIME_SCHEMA). An ECU
+  Manifest's age is its timeserver_time; a Vehicle Manifest's age is the
+  latest timeserver_time among the ECU Manifests in it (and a Vehicle Manifest
+  containing no ECU Manifests is kept).
+
+  Removed manifests are spilled to disk if the retention policy says to.
+  """
+  tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(timeserver_time)
+
+  for vin in backend.get_vins():
+    _spill('vehicle_manifests', vin,
+        backend.prune_vehicle_manifests(vin, older_than=timeserver_time))
+
+  for ecu_serial in backend.get_ecu_serials():
+    _spill('ecu_manifests', ecu_serial,
+        backend.prune_ecu_manifests(ecu_serial, older_than=timeserver_time))
+
+
+
+
+
+def get_spilled_vehicle_manifests(vin):
+  """
+  Returns the list of Vehicle Manifests from the given vehicle that have been
+  removed by the retention policy and spilled to disk, oldest first.
+  """
+  uptane.formats.VIN_SCHEMA.check_match(vin)
+  return _read_spilled('vehicle_manifests', vin)
+
+
+
+
+
+def get_spilled_ecu_manifests(ecu_serial):
+  """
+  Returns the list of ECU Manifests from the given ECU that have been removed
+  by the retention policy and spilled to disk, oldest first.
+  """
+  uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
+  return _read_spilled('ecu_manifests', ecu_serial)
+
+
+
+
+
+def _spill_fname(kind, identifier):
+  """
+  Returns the name of the segment file for the given kind of manifest
+  ('vehicle_manifests' or 'ecu_manifests') and VIN or ECU Serial. The
+  identifier is hex-encoded so that any VIN or ECU Serial is a safe filename.
+  """
+  return os.path.join(retention_policy['spill_dir'], kind,
+      binascii.hexlify(identifier.encode('utf-8')).decode('ascii') +
+      '.jsonl.gz')
+
+
+
+
+
+def _spill(kind, identifier, manifests):
+  """
+  Appends the given manifests, one JSON object per line, as a new gzip member
+  to the appropriate segment file, if spilling is enabled.
+  """
+  if not manifests or retention_policy['spill_dir'] is None:
+    return
+
+  fname = _spill_fname(kind, identifier)
+
+  if not os.path.exists(os.path.dirname(fname)):
+    os.makedirs(os.path.dirname(fname))
+
+  data = ''.join(json.dumps(manifest, sort_keys=True) + '\n'
+      for manifest in manifests)
+
+  with gzip.open(fname, 'ab') as fobj:
+    fobj.write(data.encode('utf-8'))
+
+
+
+
+
+def _read_spilled(kind, identifier):
+  if retention_policy['spill_dir'] is None:
+    return []
+
+  fname = _spill_fname(kind, identifier)
+
+  if not os.path.exists(fname):
+    return []
+
+  with gzip.open(fname, 'rb') as fobj:
+    return [json.loads(line.decode('utf-8')) for line in fobj]
+
+
+
+
 
 def get_ecu_public_key(ecu_serial):
   """
@@ -142,11 +375,11 @@ def get_ecu_public_key(ecu_serial):
 
   uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
 
-  if ecu_serial not in ecu_public_keys:
+  if not backend.is_ecu_registered(ecu_serial):
     raise uptane.UnknownECU('The given ECU Serial, ' + repr(ecu_serial) +
         ' is not known. It must be registered.')
 
-  return ecu_public_keys[ecu_serial]
+  return backend.get_ecu_public_key(ecu_serial)
 
 
 
@@ -154,7 +387,7 @@ def get_ecu_public_key(ecu_serial):
 
 def get_vehicle_manifests(vin):
   check_vin_registered(vin)
-  return vehicle_manifests[vin]
+  return backend.get_vehicle_manifests(vin)
 
 
 
@@ -162,10 +395,7 @@ def get_vehicle_manifests(vin):
 
 def get_last_vehicle_manifest(vin):
   check_vin_registered(vin)
-  if not vehicle_manifests[vin]:
-    return None
-  else:
-    return vehicle_manifests[vin][-1]
+  return backend.get_last_vehicle_manifest(vin)
 
 
 
@@ -173,7 +403,7 @@ def get_last_vehicle_manifest(vin):
 
 def get_ecu_manifests(ecu_serial):
   check_ecu_registered(ecu_serial)
-  return ecu_manifests[ecu_serial]
+  return backend.get_ecu_manifests(ecu_serial)
 
 
 
@@ -181,10 +411,7 @@ def get_ecu_manifests(ecu_serial):
 
 def get_last_ecu_manifest(ecu_serial):
   check_ecu_registered(ecu_serial)
-  if not ecu_manifests[ecu_serial]:
-    return None
-  else:
-    return ecu_manifests[ecu_serial][-1]
+  return backend.get_last_ecu_manifest(ecu_serial)
 
 
 
@@ -193,14 +420,25 @@ def save_vehicle_manifest(vin, signed_vehicle_manifest):
   """
   Given a manifest of form
   uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA, save it in an index
-  by vin, and save the individual ecu attestations in an index by ecu serial.
+  by vin, applying the retention policy to the vehicle's older manifests.
+
+  The individual ECU Manifests are not saved here (see below). Returns an id
+  for the saved Vehicle Manifest which can be passed to save_ecu_manifest so
+  that the ECU Manifests in it are stored by reference rather than copied.
   """
   check_vin_registered(vin) # check arg format and registration
 
   uptane.formats.SIGNABLE_VEHICLE_VERSION_MANIFEST_SCHEMA.check_match(
        signed_vehicle_manifest)
 
-  vehicle_manifests[vin].append(signed_vehicle_manifest)
+  vehicle_manifest_id = backend.save_vehicle_manifest(
+      vin, signed_vehicle_manifest)
+
+  if retention_policy['max_vehicle_manifests_per_vin'] is not None:
+    _spill('vehicle_manifests', vin, backend.prune_vehicle_manifests(
+        vin, keep_last=retention_policy['max_vehicle_manifests_per_vin']))
+
+  return vehicle_manifest_id
 
 
   # Not doing it this way because the Director is going to pass through a
@@ -233,22 +471,59 @@ def get_all_ecu_manifests_from_vehicle(vin):
 
   check_vin_registered(vin) # check arg format and registration
 
-  ecus_in_vehicle = ecus_by_vin[vin]
+  ecus_in_vehicle = backend.get_ecu_serials_in_vehicle(vin)
+
+  return {serial: backend.get_ecu_manifests(serial)
+      for serial in ecus_in_vehicle}
 
-  return {serial: ecu_manifests[serial] for serial in ecus_in_vehicle}
 
 
 
 
+def get_ecu_serials_in_vehicle(vin):
+  """
+  Returns a list of the ECU Serials of all ECUs associated with the given VIN,
+  in the order in which they were registered.
+  """
+
+  check_vin_registered(vin) # check arg format and registration
+
+  return list(backend.get_ecu_serials_in_vehicle(vin))
+
+
 
-def save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest):
+
+
+def save_ecu_manifest(vin, ecu_serial, signed_ecu_manifest,
+    vehicle_manifest_id=None, position=None):
+  """
+  Saves the given ECU Manifest for the given ECU, applying the retention policy
+  to the ECU's older manifests.
+
+  If the ECU Manifest came from a Vehicle Manifest saved with
+  save_vehicle_manifest, pass the id that returned as vehicle_manifest_id and
+  the index of the ECU Manifest in that Vehicle Manifest's list of manifests
+  from this ECU as position; the ECU Manifest is then stored by reference.
+  """
 
   check_ecu_registered(ecu_serial) # check format and registration
 
   uptane.formats.SIGNABLE_ECU_VERSION_MANIFEST_SCHEMA.check_match(
        signed_ecu_manifest)
 
-  ecu_manifests[ecu_serial].append(signed_ecu_manifest)
+  if (vehicle_manifest_id is None) != (position is None):
+    raise tuf.FormatError('vehicle_manifest_id and position must be provided '
+        'together, or not at all.')
+
+  if position is not None:
+    tuf.formats.LENGTH_SCHEMA.check_match(position)
+
+  backend.save_ecu_manifest(ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=vehicle_manifest_id, position=position)
+
+  if retention_policy['max_ecu_manifests_per_ecu'] is not None:
+    _spill('ecu_manifests', ecu_serial, backend.prune_ecu_manifests(
+        ecu_serial, keep_last=retention_policy['max_ecu_manifests_per_ecu']))
 
 
 
@@ -288,20 +563,17 @@ def register_ecu(is_primary, vin, ecu_serial, public_key, overwrite=True):
   uptane.formats.ECU_SERIAL_SCHEMA.check_match(ecu_serial)
   tuf.formats.ANYKEY_SCHEMA.check_match(public_key)
 
-  assert (ecu_serial in ecu_public_keys) == (ecu_serial in ecu_manifests), \
-      'Programming error: ECU registration is not consistent.'
-
   if not overwrite:
 
     # If we aren't supposed to be overwriting public keys or Primary
     # associations, make sure we don't.
 
-    if is_primary and vin in primary_ecus_by_vin and \
-        primary_ecus_by_vin[vin] is not None:
+    if is_primary and backend.is_vehicle_registered(vin) and \
+        backend.get_primary_ecu_serial(vin) is not None:
       raise uptane.Spoofing('The given VIN, ' + repr(vin) + ', is already '
           'associated with a Primary ECU.')
 
-    if ecu_serial in ecu_public_keys:
+    if backend.is_ecu_registered(ecu_serial):
       raise uptane.Spoofing('The given ECU Serial, ' + repr(ecu_serial) +
           ', is already associated with a public key.')
 
@@ -309,26 +581,14 @@ def register_ecu(is_primary, vin, ecu_serial, public_key, overwrite=True):
   # Register the VIN if it is unknown.
   # No VIN should ever be in only one or the other of ecus_by_vin or
   # vehicle_manifests, or there is a bug.
-  if vin not in ecus_by_vin:
+  if not backend.is_vehicle_registered(vin):
     register_vehicle(vin, overwrite=overwrite)
 
 
-  # Associate the ECU with the vehicle.
-  if ecu_serial not in ecus_by_vin[vin]:
-    ecus_by_vin[vin].append(ecu_serial)
-
-  if is_primary:
-    # Set the ECU as the vehicle's Primary ECU.
-    primary_ecus_by_vin[vin] = ecu_serial
-
-
-  # Save the ECU's public key.
-  ecu_public_keys[ecu_serial] = public_key
-
-
-  # Create an entry in the ecu_manifests dictionary for future manifests from
-  # the ECU.
-  ecu_manifests[ecu_serial] = []
+  # Associate the ECU with the vehicle, set it as the vehicle's Primary ECU if
+  # appropriate, save the ECU's public key, and create an empty entry for
+  # future manifests from the ECU.
+  backend.register_ecu(vin, ecu_serial, public_key, is_primary)
 
 
 
@@ -338,13 +598,11 @@ def register_vehicle(vin, primary_ecu_serial=None, overwrite=True):
 
   _check_registration_is_sane(vin)
 
-  if not overwrite and vin in ecus_by_vin:
+  if not overwrite and backend.is_vehicle_registered(vin):
     raise uptane.Spoofing('The given VIN, ' + repr(vin) + ', is already '
         'registered.')
 
-  ecus_by_vin[vin] = []
-  vehicle_manifests[vin] = []
-  primary_ecus_by_vin[vin] = primary_ecu_serial
+  backend.register_vehicle(vin, primary_ecu_serial)
 
 
 
@@ -355,7 +613,7 @@ def check_vin_registered(vin):
 
   _check_registration_is_sane(vin)
 
-  if vin not in vehicle_manifests:
+  if not backend.is_vehicle_registered(vin):
     # TODO: Should we also log here? Review logging before exceptions
     # throughout the reference implementation.
     raise uptane.UnknownVehicle('The given VIN, ' + repr(vin) + ', is not '
@@ -369,7 +627,7 @@ def _check_registration_is_sane(vin):
   """
   Asserts that a data structure invariant remains correct. A vehicle must be
   in all three of the relevant global dictionaries if it is registered, and in
-  none of them if it is not.
+  none of them if it is not. (The check itself is up to the backend.)
   """
 
   uptane.formats.VIN_SCHEMA.check_match(vin)
@@ -381,8 +639,7 @@ def _check_registration_is_sane(vin):
   #   import pdb
   #   pdb.set_trace()
 
-  assert (vin in vehicle_manifests) == (vin in ecus_by_vin) == (
-      vin in primary_ecus_by_vin), 'Programming error.'
+  backend.check_vehicle_is_consistent(vin)
 
 
 
@@ -390,6 +647,6 @@ def _check_registration_is_sane(vin):
 
 def check_ecu_registered(ecu_serial):
 
-  if ecu_serial not in ecu_public_keys:
+  if not backend.is_ecu_registered(ecu_serial):
     raise uptane.UnknownECU('The given ECU serial, ' + repr(ecu_serial) +
         ', is not known.')
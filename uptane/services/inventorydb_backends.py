@@ -0,0 +1,744 @@
+"""
+<Program Name>
+  inventorydb_backends.py
+
+<Purpose>
+  Storage backends for uptane.services.inventorydb.
+
+  inventorydb's public functions (register_ecu, save_vehicle_manifest,
+  get_last_ecu_manifest, ...) perform argument checking and enforce
+  registration rules, and then hand the actual reads and writes to a backend
+  object from this module. The backend in use is chosen with
+  uptane.services.inventorydb.set_backend().
+
+  Two backends are provided:
+
+    MemoryInventoryBackend
+      Keeps everything in Python dictionaries (the five global dictionaries in
+      inventorydb, by default). Nothing survives a restart of the process.
+      This is the default, and is what the unit tests use.
+
+    SQLiteInventoryBackend
+      Keeps everything in an SQLite database file, indexed by VIN and by ECU
+      Serial, so that lookups stay logarithmic in the number of vehicles and
+      ECUs and so that the Director's inventory survives a restart.
+
+  A backend need not check argument formats or registration: inventorydb does
+  that before calling it. Backends should be safe to call from multiple
+  threads.
+
+  ECU Manifests saved from within a Vehicle Manifest are stored by reference to
+  that Vehicle Manifest (its id and the ECU Manifest's position in it) rather
+  than duplicated. If the Vehicle Manifest is pruned while the ECU Manifest is
+  still retained, the ECU Manifest is copied out of it first.
+
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uptane
+
+import itertools
+import json
+import sqlite3
+import threading
+
+# The most ids put in one SQL statement (as "?" parameters), well within
+# SQLite's limit on the number of parameters (999, in older versions).
+_MAX_SQL_PARAMETERS = 500
+
+
+
+def get_vehicle_manifest_time(signed_vehicle_manifest):
+  """
+  Returns the latest timeserver time reported in any of the ECU Manifests
+  contained in the given Vehicle Manifest, or None if it contains none.
+  Timeserver times are ISO8601 strings of fixed format, so they can be
+  compared as strings.
+  """
+  times = [ecu_manifest['signed']['timeserver_time']
+      for ecu_manifests in
+      signed_vehicle_manifest['signed']['ecu_version_manifests'].values()
+      for ecu_manifest in ecu_manifests]
+
+  return max(times) if times else None
+
+
+
+
+
+def _indices_to_prune(times, keep_last, older_than):
+  """
+  Given the times of a list of manifests, oldest first, returns the sorted
+  indices of the manifests that are not among the last keep_last (if
+  keep_last is not None) or that have a time earlier than older_than (if
+  older_than is not None). Manifests with a time of None are never pruned for
+  their age.
+  """
+  to_prune = set()
+
+  if keep_last is not None:
+    to_prune.update(range(max(0, len(times) - keep_last)))
+
+  if older_than is not None:
+    to_prune.update(i for i, time in enumerate(times)
+        if time is not None and time < older_than)
+
+  return sorted(to_prune)
+
+
+
+class InventoryBackend(object):
+  """
+  Interface that an inventorydb storage backend must implement. See the
+  <Globals> section of inventorydb's docstring for the meaning of the data
+  stored.
+  """
+
+  def is_vehicle_registered(self, vin):
+    raise NotImplementedError
+
+  def is_ecu_registered(self, ecu_serial):
+    raise NotImplementedError
+
+  def register_vehicle(self, vin, primary_ecu_serial):
+    """
+    Registers the vehicle (or re-registers it, discarding its list of ECUs and
+    its Vehicle Manifests) and sets its Primary ECU (possibly None).
+    """
+    raise NotImplementedError
+
+  def register_ecu(self, vin, ecu_serial, public_key, is_primary):
+    """
+    Associates the ECU with the (already registered) vehicle, if it is not
+    already associated, marks it as the vehicle's Primary if is_primary is
+    True, saves its public key, and discards any ECU Manifests saved for it.
+    """
+    raise NotImplementedError
+
+  def get_primary_ecu_serial(self, vin):
+    raise NotImplementedError
+
+  def get_ecu_serials_in_vehicle(self, vin):
+    raise NotImplementedError
+
+  def get_ecu_public_key(self, ecu_serial):
+    raise NotImplementedError
+
+  def get_vins(self):
+    raise NotImplementedError
+
+  def get_ecu_serials(self):
+    raise NotImplementedError
+
+  def save_vehicle_manifest(self, vin, signed_vehicle_manifest):
+    """
+    Saves the Vehicle Manifest and returns an id for it, unique within this
+    backend, that can be passed to save_ecu_manifest.
+    """
+    raise NotImplementedError
+
+  def get_vehicle_manifests(self, vin):
+    raise NotImplementedError
+
+  def get_last_vehicle_manifest(self, vin):
+    raise NotImplementedError
+
+  def save_ecu_manifest(self, ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=None, position=None):
+    """
+    Saves the ECU Manifest. If vehicle_manifest_id is not None, the ECU
+    Manifest is the one at the given position in the list of ECU Manifests for
+    this ECU in that (saved) Vehicle Manifest, and may be stored as a
+    reference to it.
+    """
+    raise NotImplementedError
+
+  def get_ecu_manifests(self, ecu_serial):
+    raise NotImplementedError
+
+  def get_last_ecu_manifest(self, ecu_serial):
+    raise NotImplementedError
+
+  def prune_vehicle_manifests(self, vin, keep_last=None, older_than=None):
+    """
+    Removes the vehicle's Vehicle Manifests that are not among the last
+    keep_last saved or whose time (see get_vehicle_manifest_time) is earlier
+    than older_than, and returns the removed manifests, oldest first.
+    """
+    raise NotImplementedError
+
+  def prune_ecu_manifests(self, ecu_serial, keep_last=None, older_than=None):
+    """
+    Removes the ECU's ECU Manifests that are not among the last keep_last saved
+    or whose timeserver_time is earlier than older_than, and returns the
+    removed manifests, oldest first.
+    """
+    raise NotImplementedError
+
+  def check_vehicle_is_consistent(self, vin):
+    """
+    Asserts that the data stored for the given VIN is internally consistent.
+    Backends that cannot become inconsistent need not override this.
+    """
+    pass
+
+
+
+
+
+class MemoryInventoryBackend(InventoryBackend):
+  """
+  Backend storing the inventory in five dictionaries, structured as described
+  for the globals of the same names in inventorydb. If no dictionaries are
+  given, new, empty ones are created.
+  """
+
+  def __init__(self, vehicle_manifests=None, ecu_manifests=None,
+      primary_ecus_by_vin=None, ecus_by_vin=None, ecu_public_keys=None):
+
+    self.vehicle_manifests = {} if vehicle_manifests is None \
+        else vehicle_manifests
+    self.ecu_manifests = {} if ecu_manifests is None else ecu_manifests
+    self.primary_ecus_by_vin = {} if primary_ecus_by_vin is None \
+        else primary_ecus_by_vin
+    self.ecus_by_vin = {} if ecus_by_vin is None else ecus_by_vin
+    self.ecu_public_keys = {} if ecu_public_keys is None else ecu_public_keys
+
+    self._lock = threading.RLock()
+    self._vehicle_manifest_ids = itertools.count()
+
+
+
+  def is_vehicle_registered(self, vin):
+    return vin in self.vehicle_manifests
+
+
+
+  def is_ecu_registered(self, ecu_serial):
+    return ecu_serial in self.ecu_public_keys
+
+
+
+  def register_vehicle(self, vin, primary_ecu_serial):
+    with self._lock:
+      self.ecus_by_vin[vin] = []
+      self.vehicle_manifests[vin] = []
+      self.primary_ecus_by_vin[vin] = primary_ecu_serial
+
+
+
+  def register_ecu(self, vin, ecu_serial, public_key, is_primary):
+    with self._lock:
+      assert (ecu_serial in self.ecu_public_keys) == \
+          (ecu_serial in self.ecu_manifests), \
+          'Programming error: ECU registration is not consistent.'
+
+      if ecu_serial not in self.ecus_by_vin[vin]:
+        self.ecus_by_vin[vin].append(ecu_serial)
+
+      if is_primary:
+        self.primary_ecus_by_vin[vin] = ecu_serial
+
+      self.ecu_public_keys[ecu_serial] = public_key
+      self.ecu_manifests[ecu_serial] = []
+
+
+
+  def get_primary_ecu_serial(self, vin):
+    return self.primary_ecus_by_vin[vin]
+
+
+
+  def get_ecu_serials_in_vehicle(self, vin):
+    return self.ecus_by_vin[vin]
+
+
+
+  def get_ecu_public_key(self, ecu_serial):
+    return self.ecu_public_keys[ecu_serial]
+
+
+
+  def get_vins(self):
+    return list(self.vehicle_manifests)
+
+
+
+  def get_ecu_serials(self):
+    return list(self.ecu_public_keys)
+
+
+
+  def save_vehicle_manifest(self, vin, signed_vehicle_manifest):
+    self.vehicle_manifests[vin].append(signed_vehicle_manifest)
+    return next(self._vehicle_manifest_ids)
+
+
+
+  def get_vehicle_manifests(self, vin):
+    return self.vehicle_manifests[vin]
+
+
+
+  def get_last_vehicle_manifest(self, vin):
+    if not self.vehicle_manifests[vin]:
+      return None
+    return self.vehicle_manifests[vin][-1]
+
+
+
+  def save_ecu_manifest(self, ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=None, position=None):
+    # The ECU Manifest object given is the one inside the Vehicle Manifest, so
+    # keeping a reference to it here does not duplicate it.
+    self.ecu_manifests[ecu_serial].append(signed_ecu_manifest)
+
+
+
+  def get_ecu_manifests(self, ecu_serial):
+    return self.ecu_manifests[ecu_serial]
+
+
+
+  def get_last_ecu_manifest(self, ecu_serial):
+    if not self.ecu_manifests[ecu_serial]:
+      return None
+    return self.ecu_manifests[ecu_serial][-1]
+
+
+
+  def prune_vehicle_manifests(self, vin, keep_last=None, older_than=None):
+    with self._lock:
+      return self._prune(self.vehicle_manifests[vin], keep_last, older_than,
+          get_vehicle_manifest_time)
+
+
+
+  def prune_ecu_manifests(self, ecu_serial, keep_last=None, older_than=None):
+    with self._lock:
+      return self._prune(self.ecu_manifests[ecu_serial], keep_last,
+          older_than, lambda manifest: manifest['signed']['timeserver_time'])
+
+
+
+  def _prune(self, manifests, keep_last, older_than, get_time):
+    """Removes manifests from the given list in place, returning them."""
+    indices = _indices_to_prune(
+        [get_time(manifest) for manifest in manifests]
+        if older_than is not None else [None] * len(manifests),
+        keep_last, older_than)
+
+    removed = [manifests[i] for i in indices]
+    indices = set(indices)
+    manifests[:] = [manifest for i, manifest in enumerate(manifests)
+        if i not in indices]
+
+    return removed
+
+
+
+  def check_vehicle_is_consistent(self, vin):
+    # A VIN may be in either none or all three of these dictionaries, and
+    # nowhere in between, or there is a bug.
+    assert (vin in self.vehicle_manifests) == (vin in self.ecus_by_vin) == (
+        vin in self.primary_ecus_by_vin), 'Programming error.'
+
+
+
+
+
+class SQLiteInventoryBackend(InventoryBackend):
+  """
+  Backend storing the inventory in an SQLite database.
+
+  Public keys and manifests are stored as JSON text. Every table is indexed
+  by the identifier it is looked up by (VIN or ECU Serial), and manifests are
+  additionally ordered by an autoincrementing id, so fetching the most recent
+  manifest for a vehicle or ECU is a single index lookup.
+
+  An ECU Manifest saved from within a Vehicle Manifest has no JSON of its own:
+  its row holds the id of the Vehicle Manifest row and its position in it.
+
+  The layout of the database is versioned (in SQLite's user_version), and a
+  database of an earlier version is migrated when it is opened. Version 1
+  stored every ECU Manifest as JSON of its own and no timeserver times;
+  version 2 adds the timeserver times (for pruning) and ECU Manifests stored
+  by reference. A database of a later version than this code knows of is
+  refused.
+
+  Arguments:
+    db_fname
+      The filename of the database. It is created if it does not exist, and
+      reused (with all of its contents) if it does. ':memory:' may be given
+      for a database that is not persisted.
+  """
+
+  SCHEMA_VERSION = 2
+
+  # Exactly one of manifest and vehicle_manifest_id is NULL.
+  _ECU_MANIFESTS_TABLE_STATEMENT = (
+      'CREATE TABLE IF NOT EXISTS ecu_manifests ('
+      '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+      '  ecu_serial TEXT NOT NULL,'
+      '  timeserver_time TEXT NOT NULL,'
+      '  manifest TEXT,'
+      '  vehicle_manifest_id INTEGER,'
+      '  position INTEGER)')
+
+  _SCHEMA_STATEMENTS = [
+      'CREATE TABLE IF NOT EXISTS vehicles ('
+      '  vin TEXT PRIMARY KEY,'
+      '  primary_ecu_serial TEXT)',
+
+      'CREATE TABLE IF NOT EXISTS ecus ('
+      '  ecu_serial TEXT PRIMARY KEY,'
+      '  public_key TEXT NOT NULL)',
+
+      'CREATE TABLE IF NOT EXISTS vehicle_ecus ('
+      '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+      '  vin TEXT NOT NULL,'
+      '  ecu_serial TEXT NOT NULL,'
+      '  UNIQUE (vin, ecu_serial))',
+
+      'CREATE INDEX IF NOT EXISTS vehicle_ecus_by_vin '
+      '  ON vehicle_ecus (vin, id)',
+
+      'CREATE TABLE IF NOT EXISTS vehicle_manifests ('
+      '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+      '  vin TEXT NOT NULL,'
+      '  timeserver_time TEXT,'
+      '  manifest TEXT NOT NULL)',
+
+      'CREATE INDEX IF NOT EXISTS vehicle_manifests_by_vin '
+      '  ON vehicle_manifests (vin, id)',
+
+      _ECU_MANIFESTS_TABLE_STATEMENT,
+
+      'CREATE INDEX IF NOT EXISTS ecu_manifests_by_serial '
+      '  ON ecu_manifests (ecu_serial, id)',
+
+      'CREATE INDEX IF NOT EXISTS ecu_manifests_by_vehicle_manifest '
+      '  ON ecu_manifests (vehicle_manifest_id)']
+
+  # Selects ECU Manifest rows along with the JSON of the Vehicle Manifest they
+  # refer to, if any. See _resolve_ecu_manifests.
+  _ECU_MANIFEST_QUERY = (
+      'SELECT e.ecu_serial, e.manifest, v.manifest, e.position '
+      'FROM ecu_manifests AS e '
+      'LEFT JOIN vehicle_manifests AS v ON e.vehicle_manifest_id = v.id ')
+
+
+  def __init__(self, db_fname):
+
+    self.db_fname = db_fname
+
+    # The connection is shared by all threads (e.g. the Director's XMLRPC
+    # thread and the demo's own calls), so access to it is serialized.
+    self._lock = threading.RLock()
+    self._connection = sqlite3.connect(db_fname, check_same_thread=False)
+
+    with self._lock:
+      version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+
+      # Databases made before the layout was versioned have version 0, like
+      # new ones, but already have tables.
+      if version == 0 and self._connection.execute(
+          "SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+          "name = 'ecu_manifests'").fetchone() is not None:
+        version = 1
+
+      if version > self.SCHEMA_VERSION:
+        self._connection.close()
+        raise uptane.Error('The inventory database ' + repr(db_fname) +
+            ' has layout version ' + str(version) + ', but only versions up '
+            'to ' + str(self.SCHEMA_VERSION) + ' are supported.')
+
+      with self._connection:
+        if version == 1:
+          self._migrate_from_version_1()
+
+        for statement in self._SCHEMA_STATEMENTS:
+          self._connection.execute(statement)
+
+        self._connection.execute(
+            'PRAGMA user_version = ' + str(self.SCHEMA_VERSION))
+
+
+
+  def _migrate_from_version_1(self):
+    """
+    Adds the timeserver times of version 2 to a version 1 database, keeping
+    every ECU Manifest as JSON of its own. The caller must hold the lock and
+    be in a with block on the connection, which commits the migration (or
+    rolls it back) as a whole.
+    """
+    # sqlite3 does not begin transactions for schema changes by itself.
+    self._connection.execute('BEGIN')
+
+    self._connection.execute(
+        'ALTER TABLE vehicle_manifests ADD COLUMN timeserver_time TEXT')
+
+    for vehicle_manifest_id, manifest in self._connection.execute(
+        'SELECT id, manifest FROM vehicle_manifests').fetchall():
+      self._connection.execute(
+          'UPDATE vehicle_manifests SET timeserver_time = ? WHERE id = ?',
+          (get_vehicle_manifest_time(json.loads(manifest)),
+          vehicle_manifest_id))
+
+    # timeserver_time is NOT NULL, which a column cannot be made by ALTER
+    # TABLE, so the table is rebuilt. (Dropping the old table also drops its
+    # index, which the schema statements then recreate.)
+    self._connection.execute(
+        'ALTER TABLE ecu_manifests RENAME TO ecu_manifests_version_1')
+    self._connection.execute(self._ECU_MANIFESTS_TABLE_STATEMENT)
+
+    for ecu_manifest_id, ecu_serial, manifest in self._connection.execute(
+        'SELECT id, ecu_serial, manifest FROM ecu_manifests_version_1 '
+        'ORDER BY id').fetchall():
+      self._connection.execute(
+          'INSERT INTO ecu_manifests (id, ecu_serial, timeserver_time, '
+          'manifest) VALUES (?, ?, ?, ?)', (ecu_manifest_id, ecu_serial,
+          json.loads(manifest)['signed']['timeserver_time'], manifest))
+
+    self._connection.execute('DROP TABLE ecu_manifests_version_1')
+
+
+
+  def close(self):
+    with self._lock:
+      self._connection.close()
+
+
+
+  def _fetchone(self, query, parameters):
+    with self._lock:
+      return self._connection.execute(query, parameters).fetchone()
+
+
+
+  def _fetchall(self, query, parameters):
+    with self._lock:
+      return self._connection.execute(query, parameters).fetchall()
+
+
+
+  def is_vehicle_registered(self, vin):
+    return self._fetchone(
+        'SELECT 1 FROM vehicles WHERE vin = ?', (vin,)) is not None
+
+
+
+  def is_ecu_registered(self, ecu_serial):
+    return self._fetchone(
+        'SELECT 1 FROM ecus WHERE ecu_serial = ?', (ecu_serial,)) is not None
+
+
+
+  def register_vehicle(self, vin, primary_ecu_serial):
+    with self._lock, self._connection:
+      self._connection.execute(
+          'INSERT OR REPLACE INTO vehicles (vin, primary_ecu_serial) '
+          'VALUES (?, ?)', (vin, primary_ecu_serial))
+      self._connection.execute(
+          'DELETE FROM vehicle_ecus WHERE vin = ?', (vin,))
+      self._delete_vehicle_manifests([row[0] for row in self._fetchall(
+          'SELECT id FROM vehicle_manifests WHERE vin = ?', (vin,))])
+
+
+
+  def register_ecu(self, vin, ecu_serial, public_key, is_primary):
+    with self._lock, self._connection:
+      self._connection.execute(
+          'INSERT OR IGNORE INTO vehicle_ecus (vin, ecu_serial) VALUES (?, ?)',
+          (vin, ecu_serial))
+
+      if is_primary:
+        self._connection.execute(
+            'UPDATE vehicles SET primary_ecu_serial = ? WHERE vin = ?',
+            (ecu_serial, vin))
+
+      self._connection.execute(
+          'INSERT OR REPLACE INTO ecus (ecu_serial, public_key) VALUES (?, ?)',
+          (ecu_serial, json.dumps(public_key, sort_keys=True)))
+      self._connection.execute(
+          'DELETE FROM ecu_manifests WHERE ecu_serial = ?', (ecu_serial,))
+
+
+
+  def get_primary_ecu_serial(self, vin):
+    return self._fetchone(
+        'SELECT primary_ecu_serial FROM vehicles WHERE vin = ?', (vin,))[0]
+
+
+
+  def get_ecu_serials_in_vehicle(self, vin):
+    return [row[0] for row in self._fetchall(
+        'SELECT ecu_serial FROM vehicle_ecus WHERE vin = ? ORDER BY id',
+        (vin,))]
+
+
+
+  def get_ecu_public_key(self, ecu_serial):
+    return json.loads(self._fetchone(
+        'SELECT public_key FROM ecus WHERE ecu_serial = ?', (ecu_serial,))[0])
+
+
+
+  def get_vins(self):
+    return [row[0] for row in self._fetchall('SELECT vin FROM vehicles', ())]
+
+
+
+  def get_ecu_serials(self):
+    return [row[0] for row in self._fetchall('SELECT ecu_serial FROM ecus', ())]
+
+
+
+  def save_vehicle_manifest(self, vin, signed_vehicle_manifest):
+    with self._lock, self._connection:
+      return self._connection.execute(
+          'INSERT INTO vehicle_manifests (vin, timeserver_time, manifest) '
+          'VALUES (?, ?, ?)',
+          (vin, get_vehicle_manifest_time(signed_vehicle_manifest),
+          json.dumps(signed_vehicle_manifest, sort_keys=True))).lastrowid
+
+
+
+  def get_vehicle_manifests(self, vin):
+    return [json.loads(row[0]) for row in self._fetchall(
+        'SELECT manifest FROM vehicle_manifests WHERE vin = ? ORDER BY id',
+        (vin,))]
+
+
+
+  def get_last_vehicle_manifest(self, vin):
+    row = self._fetchone(
+        'SELECT manifest FROM vehicle_manifests WHERE vin = ? '
+        'ORDER BY id DESC LIMIT 1', (vin,))
+    return None if row is None else json.loads(row[0])
+
+
+
+  def save_ecu_manifest(self, ecu_serial, signed_ecu_manifest,
+      vehicle_manifest_id=None, position=None):
+
+    if vehicle_manifest_id is None:
+      manifest = json.dumps(signed_ecu_manifest, sort_keys=True)
+    else:
+      manifest = None
+
+    with self._lock, self._connection:
+      self._connection.execute(
+          'INSERT INTO ecu_manifests (ecu_serial, timeserver_time, manifest, '
+          'vehicle_manifest_id, position) VALUES (?, ?, ?, ?, ?)',
+          (ecu_serial, signed_ecu_manifest['signed']['timeserver_time'],
+          manifest, vehicle_manifest_id, position))
+
+
+
+  def get_ecu_manifests(self, ecu_serial):
+    return self._resolve_ecu_manifests(self._fetchall(
+        self._ECU_MANIFEST_QUERY + 'WHERE e.ecu_serial = ? ORDER BY e.id',
+        (ecu_serial,)))
+
+
+
+  def get_last_ecu_manifest(self, ecu_serial):
+    manifests = self._resolve_ecu_manifests(self._fetchall(
+        self._ECU_MANIFEST_QUERY + 'WHERE e.ecu_serial = ? '
+        'ORDER BY e.id DESC LIMIT 1', (ecu_serial,)))
+    return manifests[0] if manifests else None
+
+
+
+  def _resolve_ecu_manifests(self, rows):
+    """
+    Given rows from _ECU_MANIFEST_QUERY, returns the ECU Manifests they
+    describe, extracting referenced ones from their Vehicle Manifests. Each
+    Vehicle Manifest is only decoded once.
+    """
+    decoded_vehicle_manifests = {}
+    manifests = []
+
+    for ecu_serial, manifest, vehicle_manifest, position in rows:
+      if manifest is not None:
+        manifests.append(json.loads(manifest))
+        continue
+
+      if vehicle_manifest not in decoded_vehicle_manifests:
+        decoded_vehicle_manifests[vehicle_manifest] = \
+            json.loads(vehicle_manifest)
+
+      manifests.append(decoded_vehicle_manifests[vehicle_manifest][
+          'signed']['ecu_version_manifests'][ecu_serial][position])
+
+    return manifests
+
+
+
+  def prune_vehicle_manifests(self, vin, keep_last=None, older_than=None):
+    with self._lock, self._connection:
+      rows = self._fetchall(
+          'SELECT id, timeserver_time, manifest FROM vehicle_manifests '
+          'WHERE vin = ? ORDER BY id', (vin,))
+      indices = _indices_to_prune(
+          [row[1] for row in rows], keep_last, older_than)
+      self._delete_vehicle_manifests([rows[i][0] for i in indices])
+
+    return [json.loads(rows[i][2]) for i in indices]
+
+
+
+  def _delete_vehicle_manifests(self, ids):
+    """
+    Deletes the Vehicle Manifests with the given ids, first copying any ECU
+    Manifests that refer to them into their own rows. The caller must hold the
+    lock and be in a transaction.
+    """
+    for vehicle_manifest_id in ids:
+      ecu_rows = self._fetchall(
+          'SELECT id, ecu_serial, position FROM ecu_manifests '
+          'WHERE vehicle_manifest_id = ?', (vehicle_manifest_id,))
+
+      if ecu_rows:
+        vehicle_manifest = json.loads(self._fetchone(
+            'SELECT manifest FROM vehicle_manifests WHERE id = ?',
+            (vehicle_manifest_id,))[0])
+
+        for ecu_manifest_id, ecu_serial, position in ecu_rows:
+          ecu_manifest = vehicle_manifest['signed']['ecu_version_manifests'][
+              ecu_serial][position]
+          self._connection.execute(
+              'UPDATE ecu_manifests SET manifest = ?, '
+              'vehicle_manifest_id = NULL, position = NULL WHERE id = ?',
+              (json.dumps(ecu_manifest, sort_keys=True), ecu_manifest_id))
+
+      self._connection.execute(
+          'DELETE FROM vehicle_manifests WHERE id = ?', (vehicle_manifest_id,))
+
+
+
+  def prune_ecu_manifests(self, ecu_serial, keep_last=None, older_than=None):
+    with self._lock, self._connection:
+      rows = self._fetchall(
+          'SELECT id, timeserver_time FROM ecu_manifests '
+          'WHERE ecu_serial = ? ORDER BY id', (ecu_serial,))
+      ids = [rows[i][0] for i in _indices_to_prune(
+          [row[1] for row in rows], keep_last, older_than)]
+
+      removed = []
+
+      # The ids are in ascending order, so the manifests removed stay oldest
+      # first across chunks.
+      for start in range(0, len(ids), _MAX_SQL_PARAMETERS):
+        chunk = ids[start:start + _MAX_SQL_PARAMETERS]
+        placeholders = ', '.join('?' * len(chunk))
+        removed.extend(self._resolve_ecu_manifests(self._fetchall(
+            self._ECU_MANIFEST_QUERY + 'WHERE e.id IN (' + placeholders + ') '
+            'ORDER BY e.id', chunk)))
+        self._connection.execute(
+            'DELETE FROM ecu_manifests WHERE id IN (' + placeholders + ')',
+            chunk)
+
+    return removed
@@ -7,22 +7,57 @@
   Initialized with a key, the Timeserver will, when given a list of nonces,
   return a signed time attestation that includes those nonces.
 
+  In tick mode (see set_tick_mode), work that does not depend on the nonces
+  is done once per second of the clock, or once per key, rather than once per
+  request: the clock string and the canonical encoding of the attestation
+  around the nonces are kept for the current second, and the signing key is
+  kept ready to sign. The attestations are the same as otherwise.
+
 """
 from __future__ import unicode_literals
 
 import uptane
 import uptane.formats
 import uptane.common  # for sign_signable and canonical_key_from_pub_and_pri
+import uptane.merkle  # for batched attestations
+import uptane.fastschema  # for tick mode
 import tuf
 import tuf.repository_tool as rt
+import tuf.schema as SCHEMA
 #import asn1_conversion as asn1
 #from uptane import GREEN, RED, YELLOW, ENDCOLORS
 
 import time
+import json
+import binascii
 #log = uptane.logging.getLogger('timeserver')
 
+try:
+  import nacl.signing
+  _USE_PYNACL = True
+except ImportError: # pragma: no cover
+  _USE_PYNACL = False
+
 timeserver_key = None
 
+# Whether get_signed_time works in tick mode. See set_tick_mode.
+tick_mode = False
+
+# In tick mode, (the current UNIX time in seconds, the clock string for it,
+# and the end of the canonical encoding of an attestation at that time, after
+# its nonces), replaced when the second changes.
+_tick = None
+
+# In tick mode, a function returning the signature (conforming to
+# tuf.formats.SIGNATURE_SCHEMA) of the given bytes with timeserver_key, or
+# None if the key cannot be used that way (only ed25519 keys can, with
+# PyNaCl).
+_sign_bytes = None
+
+# Returns True if its argument conforms to uptane.formats.NONCE_LIST_SCHEMA.
+_nonce_list_matches = uptane.fastschema.compile_schema(
+    uptane.formats.NONCE_LIST_SCHEMA)
+
 
 
 def set_timeserver_key(private_key):
@@ -35,10 +70,85 @@ def set_timeserver_key(private_key):
 
   timeserver_key = private_key
 
+  _prepare_tick_mode()
+
+
+
+
+def set_tick_mode(enabled):
+  """
+  Turns tick mode (see the module docstring) on or off for get_signed_time
+  and get_signed_time_batch.
+  """
+  global tick_mode
+
+  tuf.formats.BOOLEAN_SCHEMA.check_match(enabled)
+
+  tick_mode = enabled
+
+  _prepare_tick_mode()
+
+
+
+
+def _prepare_tick_mode():
+  """
+  Precomputes what tick mode can for the current key.
+  """
+  global _tick
+  global _sign_bytes
+
+  _tick = None
+  _sign_bytes = None
+
+  if not tick_mode or timeserver_key is None or not _USE_PYNACL or \
+      timeserver_key['keytype'] != 'ed25519':
+    return
+
+  signing_key = nacl.signing.SigningKey(binascii.unhexlify(
+      timeserver_key['keyval']['private'].encode('utf-8')))
+  keyid = timeserver_key['keyid']
+
+  def sign_bytes(data):
+    return {
+        'keyid': keyid,
+        'method': 'ed25519',
+        'sig': binascii.hexlify(
+            signing_key.sign(data).signature).decode('utf-8')}
+
+  _sign_bytes = sign_bytes
+
+
+
+
+def _get_tick():
+  """
+  Returns the tick mode state for the current second (see _tick), computing
+  it if the second has changed.
+  """
+  global _tick
+
+  now = int(time.time())
+  tick = _tick
+
+  if tick is None or tick[0] != now:
+    clock = tuf.formats.unix_timestamp_to_datetime(now).isoformat() + 'Z'
+    tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(clock)
+    # Canonical JSON sorts keys: 'nonces' comes before 'time'.
+    tick = (now, clock, ('],"time":' + json.dumps(clock) + '}').encode(
+        'utf-8'))
+    _tick = tick
+
+  return tick
+
 
 
 
 def get_signed_time(nonces):
+
+  if tick_mode and _sign_bytes is not None:
+    return _get_signed_time_tick(nonces)
+
   uptane.formats.NONCE_LIST_SCHEMA.check_match(nonces)
 
   # Get the time, format it appropriately, and check the resulting format.
@@ -63,6 +173,73 @@ def get_signed_time(nonces):
 
 
 
+def _get_signed_time_tick(nonces):
+  """
+  get_signed_time in tick mode: the nonces are the only part of the
+  attestation that is encoded and checked for each request.
+  """
+  if not _nonce_list_matches(nonces):
+    uptane.formats.NONCE_LIST_SCHEMA.check_match(nonces) # Raises FormatError
+
+  now, clock, encoded_end = _get_tick()
+
+  # The canonical encoding of {'time': clock, 'nonces': nonces}.
+  encoded = b'{"nonces":[' + ','.join(
+      [str(nonce) for nonce in nonces]).encode('utf-8') + encoded_end
+
+  return {
+    'signed': {'time': clock, 'nonces': nonces},
+    'signatures': [_sign_bytes(encoded)]
+  }
+
+
+
+def get_signed_time_batch(nonce_lists):
+  """
+  Like get_signed_time, but for a batch of requests at once, with a single
+  signature: given a list of lists of nonces (one list per request), returns
+  a list of attestations (one per request, in the same order) conforming to
+  uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.
+
+  What is signed is the time and the root of a Merkle tree over the nonce
+  lists (see uptane/merkle.py). Each attestation carries the nonces of its
+  request and their inclusion proof; all share the same signed contents and
+  signature. Clients check them with uptane.common.get_attested_nonces.
+  """
+  SCHEMA.ListOf(uptane.formats.NONCE_LIST_SCHEMA).check_match(nonce_lists)
+
+  merkle_root, proofs = uptane.merkle.build_tree(
+      [uptane.merkle.hash_leaf(nonces) for nonces in nonce_lists])
+
+  if tick_mode:
+    clock = _get_tick()[1]
+  else:
+    clock = tuf.formats.unix_timestamp_to_datetime(int(time.time()))
+    clock = clock.isoformat() + 'Z'
+    tuf.formats.ISO8601_DATETIME_SCHEMA.check_match(clock)
+
+  batch_attestation = tuf.formats.make_signable(
+      {'time': clock, 'merkle_root': merkle_root})
+
+  batch_attestation = uptane.common.sign_signable(
+      batch_attestation, [timeserver_key])
+
+  time_attestations = []
+  for nonces, proof in zip(nonce_lists, proofs):
+    time_attestation = {
+      'signed': batch_attestation['signed'],
+      'signatures': batch_attestation['signatures'],
+      'nonces': nonces,
+      'merkle_proof': proof
+    }
+    uptane.formats.SIGNABLE_BATCHED_TIMESERVER_ATTESTATION_SCHEMA.check_match(
+        time_attestation)
+    time_attestations.append(time_attestation)
+
+  return time_attestations
+
+
+
 def get_signed_time_ber(nonces):
   """
   Same as get_signed_time, but re-encodes the resulting JSON into a BER